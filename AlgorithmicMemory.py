@@ -55,22 +55,74 @@ import copy
 import time
 import numpy as np
 import random
+import threading
+from mapsloader import ChunkIndex as ci
+from mapsloader import Instrumentation as instr
+from mapsloader import Integrity as integrity
 
 max_float = sys.float_info.max ** 0.34
 min_float = -max_float
 
-verbosity = 8
+verbosity = 0
+
+stats = instr.stats
+
+# TimeRoot ids are handed to each thread in blocks of this many
+TIME_ROOT_BLOCK = 1024
+
+class TimeRootBlock(threading.local):
+    """
+    The calling thread's block of TimeRoot ids: next .. end - 1.
+    """
+    def __init__(self):
+        self.next = 0
+        self.end = 0
+        self.epoch = -1
 
 class TimeRoot:
 
+    __slots__ = ('tr',)
+
+    # first id not handed out to any thread yet
     trctr = 0
 
+    # bumped by advance(), so threads drop the blocks they reserved before
+    epoch = 0
+
+    lock = threading.Lock()
+    ids = TimeRootBlock()
+
     def __init__(self, ctr = None):
         if ctr is None:
-            self.tr = TimeRoot.trctr
-        else:
-            self.tr = ctr
-        TimeRoot.trctr += 1
+            ids = TimeRoot.ids
+            ctr = ids.next
+            if ctr == ids.end or ids.epoch != TimeRoot.epoch:
+                ctr = TimeRoot.reserve(ids)
+            ids.next = ctr + 1
+        self.tr = ctr
+
+    @staticmethod
+    def reserve(ids, n = TIME_ROOT_BLOCK):
+        """
+        Hand the calling thread a fresh block of n ids; returns the first.
+        """
+        with TimeRoot.lock:
+            start = TimeRoot.trctr
+            TimeRoot.trctr += n
+            ids.epoch = TimeRoot.epoch
+        ids.end = start + n
+        return start
+
+    @staticmethod
+    def advance(minimum):
+        """
+        Keep freshly minted ids at or above minimum (e.g. past restored ones).
+        Blocks reserved before may reach past minimum even when trctr does,
+        so every thread drops its block.
+        """
+        with TimeRoot.lock:
+            TimeRoot.trctr = max(TimeRoot.trctr, minimum)
+            TimeRoot.epoch += 1
 
     def __str__(self):
         return "tr_" + str(self.tr)
@@ -88,6 +140,9 @@ class LBit:
     LBit is a six-dim data structure element. TimeRoot is a measure of linear progress.
 
     """
+    # dbit is only set by DBit.set_3d
+    __slots__ = ('tr', 'data', 'other', 'x', 'y', 'z', 'dbit')
+
     def __init__(self, tr: TimeRoot, data=None, other=None, x=None, y=None, z=None): 
         self.tr = tr        # time_root identifier
         self.data = data    # binary string
@@ -114,12 +169,17 @@ class LBit:
     
 
 class DBit:
+
+    # slot: position in AlgorithmicMemory.dbit_list, None unless stacked
+    __slots__ = ('lbit0', 'lbit1', 'x', 'y', 'z', 'slot')
+
     def __init__(self, lbit0: LBit, lbit1: LBit, x=0, y=0, z=0):
         self.lbit0 = lbit0
         self.lbit1 = lbit1
         self.x = x
         self.y = y
         self.z = z
+        self.slot = None
 
         # Connect the "other" fields
         self.lbit0.other = self.lbit1
@@ -394,10 +454,18 @@ def latticeModel(dbit = None):
 
 class AlgorithmicMemory:
 
-    def __init__(self):
+    def __init__(self, jump = True, reclaim = True):
         self.i = 0
 
-        self.dbits = {}  # Dictionary to store dbits with keys as tuples of coordinates
+        # jump: move_head_abs relocates the head straight to its target window
+        # instead of walking it there one unit at a time
+        self.jump = jump
+
+        # reclaim: free the empty root DBits of a head window once the head
+        # has left it (see release_scaffold)
+        self.reclaim = reclaim
+
+        self.dbits = ci.ChunkIndex()  # chunked (x, y, z) -> dbit index
 
         self.dbit_list = []
 
@@ -413,6 +481,29 @@ class AlgorithmicMemory:
         self.headz = -1
         
         self.last_rv = None
+
+        # change tracking for incremental saves, keyed by lbit0 TimeRoot id:
+        # DBits stacked since the last clear_dirty() and the coordinates of
+        # DBits removed since then. Restored (persisted) DBits start clean.
+        self.dirty = {}
+        self.deleted = {}
+
+        # total DBits removed, so derived structures can tell they are stale
+        self.removed = 0
+
+        # cells changed since the last integrity check (see check_touched);
+        # None until a full check starts the tracking, so a lattice nobody
+        # checks does not collect them
+        self.touched = None
+
+        # keys of the chunks whose stacks changed since the last read
+        # snapshot was taken (see WorldLattice.snapshot)
+        self.changed = set()
+
+        # concurrent mode (see concurrent): guards dbit_list, and striped
+        # locks over chunk keys guard linking
+        self.lock = None
+        self.chunk_locks = None
         
         self.initialize_head(self.headx, self.heady, self.headz)
         
@@ -430,13 +521,67 @@ class AlgorithmicMemory:
 
         self.prune(1, 1, 1)
         self.prune(-1, -1, -1)
+        self.removed = 0
+        self.touched = None
+        self.changed = set()
+
+    def concurrent(self, stripes = 64):
+        """
+        Switch on concurrent mode: threads may then insert through their own
+        Cursor (see new_cursor). The head (insert, prune, move_head_abs) stays
+        single-threaded.
+        """
+        if self.lock is None:
+            self.lock = threading.Lock()
+            self.chunk_locks = [ threading.Lock() for _ in range(stripes) ]
+            self.dbits.lock = threading.Lock()
+        return self
+
+    def new_cursor(self):
+
+        return Cursor(self.concurrent())
+
+    def locks_for(self, keys):
+        """
+        The chunk locks covering chunk keys, in the one order every thread
+        takes them in.
+        """
+        stripes = len(self.chunk_locks)
+        return [ self.chunk_locks[i] for i in sorted({ hash(key) % stripes for key in keys }) ]
 
     def insert_dbit(self, dbit):
 
-        self.dbit_list.append(dbit)
+        if self.lock is None:
+            dbit.slot = len(self.dbit_list)
+            self.dbit_list.append(dbit)
+        else:
+            with self.lock:
+                dbit.slot = len(self.dbit_list)
+                self.dbit_list.append(dbit)
+
+    def release_dbit(self, dbit):
+        """
+        O(1) removal from dbit_list: the last entry takes dbit's slot.
+        """
+        if self.lock is not None:
+            with self.lock:
+                return self.release_slot(dbit)
+        return self.release_slot(dbit)
+
+    def release_slot(self, dbit):
+
+        slot = dbit.slot
+        if slot is None:
+            raise ValueError(f"DBit at ({dbit.x},{dbit.y},{dbit.z}) is not stacked")
+        last = self.dbit_list.pop()
+        if last is not dbit:
+            self.dbit_list[slot] = last
+            last.slot = slot
+        dbit.slot = None
 
     def initialize_head(self, xstart, ystart, zstart, xdim = 3, ydim = 3, zdim = 3):
 
+        previous = self.head
         self.head = np.empty((xdim, ydim, zdim), dtype = object)
         # print(f"HEAD: initializing from ({xstart},{ystart},{zstart})")
 
@@ -447,6 +592,8 @@ class AlgorithmicMemory:
             rv.set_3d()
             return rv
 
+        allocated = 0
+
         for i in range(xstart, xstart + xdim):
             for j in range(ystart, ystart + ydim):
                 for k in range(zstart, zstart + zdim):
@@ -456,6 +603,7 @@ class AlgorithmicMemory:
                         dbit = self.dbits[(i,j,k)]
                     except KeyError as e:
                         dbit = dbit_init(name, i, j, k)
+                        allocated += 1
                     # print(f"i = {i}, xstart={xstart}, self.headx={self.headx} | j = {j}, ystart={ystart}, self.heady={self.heady} | k = {k}, zstart={zstart}, self.headz={self.headz}")
                     if i > xstart:
                         # print(f"i-1 = {i-1}, xstart = {xstart}")
@@ -471,6 +619,8 @@ class AlgorithmicMemory:
                         dbit.lbit0.z = self.head[i - xstart, j - ystart, k-1 - zstart].lbit1
                     
                     self.dbits[(i,j,k)] = dbit
+                    if self.touched is not None:
+                        self.touched.add((i,j,k))
 
                     self.head[i-xstart,j-ystart,k-zstart] = dbit
 
@@ -480,118 +630,133 @@ class AlgorithmicMemory:
         self.heady = ystart
         self.headz = zstart
 
-        return self.head[int(xdim/3), int(ydim/3), int(zdim/3)]
+        # the cells of the previous window the head has left only stay when
+        # something is stacked on them
+        if self.reclaim and previous is not None:
+            for dbit in previous.flat:
+                if (xstart <= dbit.x < xstart + xdim and ystart <= dbit.y < ystart + ydim
+                        and zstart <= dbit.z < zstart + zdim):
+                    continue
+                if self.dbits.get((dbit.x, dbit.y, dbit.z)) is dbit:
+                    self.release_scaffold(dbit)
 
+        if stats.enabled:
+            stats.window_rebuilds += 1
+            stats.dbits_allocated += allocated
+            stats.links += ((xdim-1) * ydim * zdim + xdim * (ydim-1) * zdim
+                            + xdim * ydim * (zdim-1))
 
-    def debug_clear(self):
-        self.dbits = {}
+        self.last_rv = self.head[int(xdim/3), int(ydim/3), int(zdim/3)]
+        return self.last_rv
 
-    def check_integrity(self, dbit = None):
-        if verbosity != 0:
-            print("                             / integrity \\                             ")
-            print("i.________________________.*/ sanity check \\*._______________________.i")
-
-        def make_tests():
-            dictionary = [ 'x', 'y', 'z' ]
-
-            tests = []
-
-            for a1 in dictionary:
-                for a2 in dictionary:
-                    testsequence0 = [ 'lbit0' ]
-                    testsequence1 = [ 'lbit1' ]
-                    testsequence2 = [ 'lbit0' ]
-                    testsequence3 = [ 'lbit1' ]
-
-                    if a1 == a2:
-                        continue
-
-                    testsequence0.append(a1)
-                    testsequence0.append('other')
-                    testsequence0.append(a2)
-                    testsequence0.append(a1)
-                    testsequence0.append('other')
-                    testsequence0.append(a2)
-                    testsequence0.append('dbit')
-
-                    testsequence1.append(a1)
-                    testsequence1.append('other')
-                    testsequence1.append(a2)
-                    testsequence1.append(a1)
-                    testsequence1.append('other')
-                    testsequence1.append(a2)
-                    testsequence1.append('dbit')
-
-                    testsequence2.append(a1)
-                    testsequence2.append(a2)
-                    testsequence2.append('other')
-                    testsequence2.append(a1)
-                    testsequence2.append(a2)
-                    testsequence2.append('dbit')
- 
-                    testsequence3.append(a1)
-                    testsequence3.append(a2)
-                    testsequence3.append('other')
-                    testsequence3.append(a1)
-                    testsequence3.append(a2)
-                    testsequence3.append('dbit')
+    def release_scaffold(self, dbit):
+        """
+        Free the root DBit dbit if nothing is stacked on it: drop it from
+        dbits and cut the links its six neighbors hold to it. Returns True
+        if it was freed.
+        """
+        lbit0 = dbit.lbit0
+        lbit1 = dbit.lbit1
+        if lbit0.other is not lbit1:
+            return False
+        links = 0
+        if lbit0.x is not None:
+            lbit0.x.x = None
+            links += 1
+        if lbit1.x is not None:
+            lbit1.x.x = None
+            links += 1
+        if lbit0.y is not None:
+            lbit0.y.y = None
+            links += 1
+        if lbit1.y is not None:
+            lbit1.y.y = None
+            links += 1
+        if lbit0.z is not None:
+            lbit0.z.z = None
+            links += 1
+        if lbit1.z is not None:
+            lbit1.z.z = None
+            links += 1
+        coords = (dbit.x, dbit.y, dbit.z)
+        del self.dbits[coords]
+        if self.touched is not None:
+            self.touched.add(coords)
+
+        if stats.enabled:
+            stats.scaffolds_reclaimed += 1
+            stats.links += links
+        return True
+
+    def in_head(self, x, y, z):
+
+        return (self.headx <= x <= self.headx + 2 and self.heady <= y <= self.heady + 2
+                and self.headz <= z <= self.headz + 2)
+
+    def collect_scaffolding(self):
+        """
+        Free every root DBit outside the head window that has nothing
+        stacked on it. Returns the number freed.
+        """
+        freed = 0
+        for coords, dbit in list(self.dbits.items()):
+            if not self.in_head(*coords) and self.release_scaffold(dbit):
+                freed += 1
+        return freed
 
-                    tests.append(testsequence0)
-                    tests.append(testsequence1)
-                    tests.append(testsequence2)
-                    tests.append(testsequence3)
+    def scaffolding(self):
+        """
+        Root DBits holding no data against the data DBits stacked on the
+        others, and their ratio.
+        """
+        empty = sum(1 for dbit in self.dbits.values() if dbit.lbit0.other is dbit.lbit1)
+        vertices = len(self.dbit_list)
+        return {
+            'roots': len(self.dbits),
+            'scaffolding': empty,
+            'vertices': vertices,
+            'ratio': empty / vertices if vertices else float(empty),
+            }
 
-            return tests
 
-        testing_directions = make_tests()
+    def debug_clear(self):
+        self.dbits = ci.ChunkIndex()
 
+    def check_integrity(self, dbit = None):
+        """
+        Run the link tests (see Integrity) from dbit, or from every root DBit
+        when dbit is None. Returns an IntegrityReport; nothing is printed.
+        """
+        start = time.perf_counter()
         if dbit is not None:
-            bits = { (dbit.x, dbit.y, dbit.z) : dbit }
+            items = [ ((dbit.x, dbit.y, dbit.z), dbit) ]
         else:
-            bits = self.dbits.items()
-
-        for coords, obj in bits.items():
-            subject = obj
-            for test in testing_directions:
-                validity = True
-                test_path = [ "(" + str(subject.x) + "," + str(subject.y) + "," + str(subject.z) + ")"]
-                for step in test:
-                    source_obj = obj
-                    try:
-                        obj = getattr(obj, step)
-                    except AttributeError as e:
-                        if verbosity > 10:
-                            print(f"source: {source_obj} on {step}")
-                        raise IntegrityError("[" + step + "] in: ("
-                               + str(subject.x) + ","
-                               + str(subject.y) + ","
-                               + str(subject.z) + ")." +  ".".join(test))
-                    if obj == None:
-                        obj = subject
-                        validity = False
-                        break
-                
-                    if not isinstance(source_obj, DBit):
-                        test_path.append(source_obj.data)
-                        test_path.append(step)
-
-                if validity and obj != subject:
-                    print (latticeModel())
-                    print ("__________________on test: " + " ".join(test))
-                    print ("-------------------------------------------------")
-                    print ("  ### ##  ##   #   ##")
-                    print ("  #   # # # # # #  # #")
-                    print ("  ##  ##  ##  # #  ##")
-                    print ("  #   # # # # # #  # #")
-                    print ("  ### # # # #  #   # #\n")
-                    print ("test_subject: ", subject)
-                    print ("iterator_at: ", obj)
-                    print ("\n# ".join(test_path))
-                    if not inspectDBit(subject):
-                        raise IntegrityError("[" + step + "] in: ("
-                               + str(subject.x) + ","
-                               + str(subject.y) + ","
-                               + str(subject.z) + ")." +  ".".join(test))
+            items = self.dbits.items()
+            self.touched = set()
+        report = integrity.check_cells(items, dbits = self.dbits)
+        report.seconds = time.perf_counter() - start
+        return report
+
+    def check_touched(self):
+        """
+        Re-verify only the cells within one step of those scaffolded,
+        stacked or unstacked since the last check. Cells are only recorded
+        once a full check has run, so without one this is a full check.
+        """
+        if self.touched is None:
+            return self.check_integrity()
+        start = time.perf_counter()
+        touched, self.touched = self.touched, set()
+        report = integrity.check_cells(integrity.neighborhood(self.dbits, touched), dbits = self.dbits)
+        report.seconds = time.perf_counter() - start
+        return report
+
+    def check_integrity_parallel(self, workers = None):
+        """
+        Full check split by chunk across forked worker processes.
+        """
+        self.touched = set()
+        return integrity.check_parallel(self, workers)
 
     def print_head(self):
         for i in range(self.head.shape[0]):
@@ -607,12 +772,8 @@ class AlgorithmicMemory:
         ystart = self.heady
         zstart = self.headz
 
-        if verbosity != 0:
-            print("\n___________________")
-            print("HEAD at:\n\\")
-            print(f" \\ ( x = {xstart}, y = {ystart}, z = {zstart})\n  -------------------")
-            print(f"moving = ({x},{y},{z})")
-
+        if stats.enabled:
+            stats.head_moves += 1
 
         xsign = 1
         xsteps = [0]
@@ -658,12 +819,21 @@ class AlgorithmicMemory:
 
     # def x_at_cursor(self):
 
-    def move_head_abs(self, x, y, z):
+    def move_head_abs(self, x, y, z, jump = None):
 
         if x == self.headx and y == self.heady and z == self.headz and self.last_rv is not None:
             return self.last_rv
 
-        self.last_rv = self.move_head(x-self.headx, y-self.heady, z-self.headz)
+        if jump is None:
+            jump = self.jump
+
+        if jump:
+            # materialize only the target window, O(1) in the travel distance
+            if stats.enabled:
+                stats.head_moves += 1
+            self.last_rv = self.initialize_head(x, y, z)
+        else:
+            self.last_rv = self.move_head(x-self.headx, y-self.heady, z-self.headz)
         return self.last_rv
 
     def prune(self, x, y, z):
@@ -674,28 +844,177 @@ class AlgorithmicMemory:
         while lbit_idx != lbit_idx.other.other:
             lbit_idx = lbit_idx.other
 
-        self.dbit_list.remove(lbit_idx.dbit)
+        return self.unstack(lbit_idx.dbit)
 
-        # xm.other = other.xp
-        lbit_idx.x.other = lbit_idx.other.x
-        lbit_idx.other.x.other = lbit_idx.x
+    def unstack(self, dbit):
+        """
+        Take a stacked DBit out of the "other" chain of its cell, wherever it
+        sits in the chain.
+        """
+        self.release_dbit(dbit)
 
-        return lbit_idx.dbit
+        lbit_idx = dbit.lbit0
 
+        if lbit_idx.other is dbit.lbit1:
+            # top of the chain
+            # xm.other = other.xp
+            lbit_idx.x.other = lbit_idx.other.x
+            lbit_idx.other.x.other = lbit_idx.x
+            links = 2
+        else:
+            above = lbit_idx.other.dbit
+            below = lbit_idx.x.dbit
+            below.lbit0.other = above.lbit0
+            below.lbit1.other = above.lbit1
+            above.lbit0.x = below.lbit0
+            above.lbit1.x = below.lbit1
+            links = 4
+
+        tr = lbit_idx.tr.tr
+        if self.dirty.pop(tr, None) is None:
+            self.deleted[tr] = (dbit.x, dbit.y, dbit.z)
+        self.removed += 1
+        if self.touched is not None:
+            self.touched.add((dbit.x, dbit.y, dbit.z))
+        self.changed.add(ci.chunk_key(dbit.x, dbit.y, dbit.z))
+
+        if stats.enabled:
+            stats.prunes += 1
+            stats.links += links
+
+        return dbit
+
+    def prune_region(self, lo, hi):
+        """
+        Remove every cell in the inclusive box lo..hi, root and stack, in one
+        pass. Chunks inside the box are dropped whole; neighbors outside the
+        box lose their links into it, and a head window over the box moves
+        out of it, so the box is left empty. Returns the number of stacked
+        DBits removed.
+        """
+        x0, y0, z0 = lo
+        x1, y1, z1 = hi
+        dbits = self.dbits
+        cells = []
+        for key in dbits.chunks_in_box(lo, hi):
+            chunk = dbits.chunks[key]
+            ox, oy, oz = chunk.origin()
+            if (ox >= x0 and oy >= y0 and oz >= z0 and ox + ci.CHUNK_MASK <= x1
+                    and oy + ci.CHUNK_MASK <= y1 and oz + ci.CHUNK_MASK <= z1):
+                cells.extend(dbits.drop_chunk(key).items())
+                continue
+            inside = [ (coords, root) for coords, root in chunk.items()
+                       if x0 <= coords[0] <= x1 and y0 <= coords[1] <= y1 and z0 <= coords[2] <= z1 ]
+            for coords, root in inside:
+                del dbits[coords]
+            cells.extend(inside)
+
+        removed = 0
+        links = 0
+        for (x, y, z), root in cells:
+            # cut the links from cells outside the box
+            lbit0 = root.lbit0
+            lbit1 = root.lbit1
+            if x == x0 and lbit0.x is not None:
+                lbit0.x.x = None
+                links += 1
+            if x == x1 and lbit1.x is not None:
+                lbit1.x.x = None
+                links += 1
+            if y == y0 and lbit0.y is not None:
+                lbit0.y.y = None
+                links += 1
+            if y == y1 and lbit1.y is not None:
+                lbit1.y.y = None
+                links += 1
+            if z == z0 and lbit0.z is not None:
+                lbit0.z.z = None
+                links += 1
+            if z == z1 and lbit1.z is not None:
+                lbit1.z.z = None
+                links += 1
+            if self.touched is not None and (x in (x0, x1) or y in (y0, y1) or z in (z0, z1)):
+                self.touched.add((x, y, z))
+
+            # free the stack
+            lbit_idx = lbit0.other
+            while lbit_idx is not lbit1:
+                dbit = lbit_idx.dbit
+                self.release_dbit(dbit)
+                tr = lbit_idx.tr.tr
+                if self.dirty.pop(tr, None) is None:
+                    self.deleted[tr] = (x, y, z)
+                removed += 1
+                lbit_idx = lbit_idx.other
+                if lbit_idx is dbit.lbit1:
+                    break
+            if lbit0.other is not lbit1:
+                self.changed.add(ci.chunk_key(x, y, z))
+
+        self.removed += removed
+
+        # the head window must not keep freed cells alive, nor scaffold the
+        # box again: it moves just past the nearer x face of the box
+        hx, hy, hz = self.headx, self.heady, self.headz
+        if hx + 2 >= x0 and hx <= x1 and hy + 2 >= y0 and hy <= y1 and hz + 2 >= z0 and hz <= z1:
+            hx = x0 - 3 if hx - (x0 - 3) <= x1 + 1 - hx else x1 + 1
+            self.initialize_head(hx, hy, hz)
+
+        if stats.enabled:
+            stats.prunes += removed
+            stats.links += links
+
+        return removed
+
+    def find_stacked(self, x, y, z, tr):
+        """
+        The DBit stacked at (x, y, z) whose lbit0 carries TimeRoot id tr, or None.
+        """
+        dbit = self.retrieve(x, y, z)
+        if dbit is None:
+            return None
+
+        lbit_idx = dbit.lbit0
+        while lbit_idx != lbit_idx.other.other:
+            lbit_idx = lbit_idx.other
+            if lbit_idx.tr.tr == tr:
+                return lbit_idx.dbit
+        return None
+
+    def stacked(self, keys = None):
+        """
+        The stacked DBits cell by cell, each stack bottom first: the order to
+        insert them in to rebuild the stacks. dbit_list has no such order
+        once DBits have been removed. keys limits them to those chunks.
+        """
+        if keys is None:
+            roots = self.dbits.values()
+        else:
+            roots = [ root for key in keys for _, root in self.dbits.iter_chunk(key) ]
+        dbits = []
+        for root in roots:
+            lbit_idx = root.lbit0
+            while lbit_idx != lbit_idx.other.other:
+                lbit_idx = lbit_idx.other
+                dbits.append(lbit_idx.dbit)
+        return dbits
+
+    def clear_dirty(self):
+        self.dirty = {}
+        self.deleted = {}
 
-    def insert(self, data, x, y, z):
-        if verbosity != 0:
-            print("\n.")
-            print("..")
-            print(f"... inserting {data} at ({x}, {y}, {z})")
 
-            print("warning: **** fix this and change to headsize")
+    def insert(self, data, x, y, z):
 
         dbit = self.move_head_abs(x-1,y-1,z-1)
 
-        if verbosity != 0:
-            print("moved to", dbit)
-        
+        return self.stack(dbit, data, x, y, z)
+
+    def stack(self, dbit, data, x, y, z, trs = None):
+        """
+        Push a new DBit carrying data on top of the "other" chain rooted at dbit.
+        trs optionally restores the (lbit0, lbit1) TimeRoot ids of a persisted DBit.
+        """
         lbit_idx = dbit.lbit0
 
         while lbit_idx != lbit_idx.other.other:
@@ -703,8 +1022,12 @@ class AlgorithmicMemory:
 
         dbit = lbit_idx.dbit
 
-        lbit0 = LBit(TimeRoot(), data)
-        lbit1 = LBit(TimeRoot(), "time_root")
+        if trs is None:
+            lbit0 = LBit(TimeRoot(), data)
+            lbit1 = LBit(TimeRoot(), "time_root")
+        else:
+            lbit0 = LBit(TimeRoot(trs[0]), data)
+            lbit1 = LBit(TimeRoot(trs[1]), "time_root")
 
         newbit = DBit(lbit0, lbit1, x, y, z)
         newbit.set_3d()
@@ -715,13 +1038,186 @@ class AlgorithmicMemory:
         dbit.lbit0.other = newbit.lbit0
         dbit.lbit1.other = newbit.lbit1
 
-        if verbosity > 5:
-            print(newbit)
+        if stats.enabled:
+            stats.add(inserts = 1, dbits_allocated = 1, links = 4)
+
+        if trs is None:
+            self.dirty[lbit0.tr.tr] = newbit
+        if self.touched is not None:
+            self.touched.add((x, y, z))
+        self.changed.add((x >> ci.CHUNK_BITS, y >> ci.CHUNK_BITS, z >> ci.CHUNK_BITS))
 
         self.insert_dbit(newbit)
 
         return newbit
 
+    def scaffold(self, x, y, z):
+        """
+        Return the root DBit at (x, y, z), creating it and linking it to its
+        six existing neighbors if it is not there yet. This is what a head
+        window does for one cell, without rebuilding the whole window.
+        """
+        dbits = self.dbits
+        try:
+            return dbits[x, y, z]
+        except KeyError:
+            pass
+
+        lbit0 = LBit(TimeRoot(), "3d" + str(x) + "_" + str(y) + "_" + str(z))
+        lbit1 = LBit(TimeRoot(), "time_root")
+        dbit = DBit(lbit0, lbit1, x, y, z)
+        dbit.set_3d()
+
+        links = 0
+        neighbor = dbits.get((x-1, y, z))
+        if neighbor is not None:
+            neighbor.lbit1.x = lbit0
+            lbit0.x = neighbor.lbit1
+            links += 1
+        neighbor = dbits.get((x+1, y, z))
+        if neighbor is not None:
+            lbit1.x = neighbor.lbit0
+            neighbor.lbit0.x = lbit1
+            links += 1
+        neighbor = dbits.get((x, y-1, z))
+        if neighbor is not None:
+            neighbor.lbit1.y = lbit0
+            lbit0.y = neighbor.lbit1
+            links += 1
+        neighbor = dbits.get((x, y+1, z))
+        if neighbor is not None:
+            lbit1.y = neighbor.lbit0
+            neighbor.lbit0.y = lbit1
+            links += 1
+        neighbor = dbits.get((x, y, z-1))
+        if neighbor is not None:
+            neighbor.lbit1.z = lbit0
+            lbit0.z = neighbor.lbit1
+            links += 1
+        neighbor = dbits.get((x, y, z+1))
+        if neighbor is not None:
+            lbit1.z = neighbor.lbit0
+            neighbor.lbit0.z = lbit1
+            links += 1
+
+        if stats.enabled:
+            stats.add(dbits_allocated = 1, links = links)
+
+        dbits[x, y, z] = dbit
+        if self.touched is not None:
+            self.touched.add((x, y, z))
+        return dbit
+
+    def insert_many(self, coords, payload, trs = None):
+        """
+        Bulk insert. coords is an (n, 3) integer array, payload a parallel
+        sequence of data. Points are visited in (x, y, z) order for locality and
+        linked to their neighbors in that single pass; the head is not moved.
+        trs is an optional (n, 2) array of TimeRoot ids to restore.
+        Returns the created DBits in input order.
+        """
+        coords = np.asarray(coords, dtype = np.int64).reshape(-1, 3)
+        order = np.lexsort((coords[:, 2], coords[:, 1], coords[:, 0]))
+
+        created = [None] * len(coords)
+        scaffold = self.scaffold
+        stack = self.stack
+
+        if trs is None:
+            for idx, (x, y, z) in zip(order.tolist(), coords[order].tolist()):
+                created[idx] = stack(scaffold(x, y, z), payload[idx], x, y, z)
+        else:
+            trs = np.asarray(trs, dtype = np.int64).reshape(-1, 2)
+            for idx, (x, y, z), tr in zip(order.tolist(), coords[order].tolist(),
+                                          trs[order].tolist()):
+                created[idx] = stack(scaffold(x, y, z), payload[idx], x, y, z, tr)
+            if len(trs):
+                # keep freshly minted ids clear of the restored ones
+                TimeRoot.advance(int(trs.max()) + 1)
+
+        return created
+
+# per-call timing targets, wrapped only while stats.enable(timing = True)
+stats.register(AlgorithmicMemory, ( 'initialize_head', 'move_head', 'move_head_abs',
+                                    'insert', 'insert_many', 'stack', 'scaffold',
+                                    'prune', 'check_integrity', 'check_touched',
+                                    'collect_scaffolding' ))
+
+class Cursor:
+    """
+    One thread's own insertion point into an AlgorithmicMemory in concurrent
+    mode. It links cells the way insert_many does, holding the locks of the
+    chunks it links across, so cursors on other threads can insert at the
+    same time.
+    """
+
+    def __init__(self, memory):
+        self.memory = memory
+        self.x = None
+        self.y = None
+        self.z = None
+
+    def position(self):
+        return (self.x, self.y, self.z)
+
+    def chunk_keys(self, x, y, z):
+        """
+        Keys of the chunk of (x, y, z) and of those its six neighbors are in.
+        """
+        b = ci.CHUNK_BITS
+        return { (x >> b, y >> b, z >> b),
+                 ((x - 1) >> b, y >> b, z >> b), ((x + 1) >> b, y >> b, z >> b),
+                 (x >> b, (y - 1) >> b, z >> b), (x >> b, (y + 1) >> b, z >> b),
+                 (x >> b, y >> b, (z - 1) >> b), (x >> b, y >> b, (z + 1) >> b) }
+
+    def insert(self, data, x, y, z):
+
+        memory = self.memory
+        locks = memory.locks_for(self.chunk_keys(x, y, z))
+        for lock in locks:
+            lock.acquire()
+        try:
+            dbit = memory.stack(memory.scaffold(x, y, z), data, x, y, z)
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+        self.x, self.y, self.z = x, y, z
+        return dbit
+
+    def insert_many(self, coords, payload):
+        """
+        Bulk insert chunk by chunk, holding the locks of a chunk and its six
+        face neighbors once for all the points in it. Returns the created
+        DBits in input order.
+        """
+        memory = self.memory
+        coords = np.asarray(coords, dtype = np.int64).reshape(-1, 3)
+        order = np.lexsort((coords[:, 2], coords[:, 1], coords[:, 0], ci.pack_chunk_keys(coords)))
+        keys = ci.pack_chunk_keys(coords[order])
+        bounds = np.flatnonzero(np.concatenate([ [ True ], keys[1:] != keys[:-1], [ True ] ]))
+
+        created = [None] * len(coords)
+        scaffold = memory.scaffold
+        stack = memory.stack
+        for start, stop in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+            cx, cy, cz = ci.unpack_chunk_key(int(keys[start]))
+            locks = memory.locks_for({ (cx, cy, cz), (cx - 1, cy, cz), (cx + 1, cy, cz),
+                                       (cx, cy - 1, cz), (cx, cy + 1, cz),
+                                       (cx, cy, cz - 1), (cx, cy, cz + 1) })
+            for lock in locks:
+                lock.acquire()
+            try:
+                for idx, (x, y, z) in zip(order[start:stop].tolist(),
+                                          coords[order[start:stop]].tolist()):
+                    created[idx] = stack(scaffold(x, y, z), payload[idx], x, y, z)
+            finally:
+                for lock in reversed(locks):
+                    lock.release()
+        if len(coords):
+            self.x, self.y, self.z = coords[order[-1]].tolist()
+        return created
+
+
 def inspectDBit(dbit, am :AlgorithmicMemory):
     # if verbosity > 0:
     #    return
@@ -840,4 +1336,3 @@ def model_xyz_diagonal(am: AlgorithmicMemory):
 # print("target:")
 # print("-------")
 # inspectDBit(am.target, am)
-
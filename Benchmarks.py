@@ -0,0 +1,559 @@
+"""
+
+ Benchmarks for the mapsloader lattice stack.
+
+ Run with:
+   python -m mapsloader.Benchmarks
+
+"""
+import io
+import os
+import time
+import random
+import tempfile
+import tracemalloc
+import contextlib
+import numpy as np
+from mapsloader import AlgorithmicMemory as am
+
+
+def bench_scattered_inserts(n = 200, spreads = (10, 100, 300), seed = 0):
+    """
+    Insert n points scattered over a square of side `spread`, once walking the
+    head and once jumping it. Walking scales with the distance between
+    successive points, jumping does not.
+    """
+    results = []
+    for spread in spreads:
+        rng = random.Random(seed)
+        points = [ (rng.randrange(spread), rng.randrange(spread), 0) for _ in range(n) ]
+        for jump in (False, True):
+            memory = am.AlgorithmicMemory(jump = jump)
+            start = time.perf_counter()
+            for x, y, z in points:
+                memory.insert("p", x, y, z)
+            elapsed = time.perf_counter() - start
+            results.append((spread, 'jump' if jump else 'walk', elapsed, len(memory.dbits)))
+            print(f"scattered inserts: spread={spread:5d} mode={'jump' if jump else 'walk'} "
+                  f"n={n} {elapsed * 1e3:9.2f} ms {n / elapsed:10.0f} inserts/s "
+                  f"dbits={len(memory.dbits)}")
+    return results
+
+
+class DictTimeRoot:
+    # pre-__slots__ layout of TimeRoot, kept for comparison
+    trctr = 0
+
+    def __init__(self):
+        self.tr = DictTimeRoot.trctr
+        DictTimeRoot.trctr += 1
+
+
+class DictLBit:
+    # pre-__slots__ layout of LBit, kept for comparison
+    def __init__(self, tr, data=None, other=None, x=None, y=None, z=None):
+        self.tr = tr
+        self.data = data
+        self.other = other
+        self.x = x
+        self.y = y
+        self.z = z
+
+
+class DictDBit:
+    # pre-__slots__ layout of DBit, kept for comparison
+    def __init__(self, lbit0, lbit1, x=0, y=0, z=0):
+        self.lbit0 = lbit0
+        self.lbit1 = lbit1
+        self.x = x
+        self.y = y
+        self.z = z
+        self.lbit0.other = self.lbit1
+        self.lbit1.other = self.lbit0
+
+    def set_3d(self):
+        self.lbit0.dbit = self
+        self.lbit1.dbit = self
+
+
+def bytes_per_vertex(time_root, lbit, dbit, n):
+    vertices = []
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for i in range(n):
+        lbit0 = lbit(time_root(), None)
+        lbit1 = lbit(time_root(), "time_root")
+        vertex = dbit(lbit0, lbit1, i, i, i)
+        vertex.set_3d()
+        vertices.append(vertex)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    # coordinate and TimeRoot ints and the list slot are counted for both layouts
+    return size / n
+
+
+def bench_vertex_memory(n = 100000):
+    """
+    Memory cost of one map vertex (one DBit, two LBits, two TimeRoots) with the
+    slotted classes against the old __dict__ based layout.
+    """
+    legacy = bytes_per_vertex(DictTimeRoot, DictLBit, DictDBit, n)
+    slotted = bytes_per_vertex(am.TimeRoot, am.LBit, am.DBit, n)
+    print(f"vertex memory: __dict__ {legacy:7.1f} B/vertex")
+    print(f"vertex memory: __slots__ {slotted:7.1f} B/vertex ({legacy / slotted:.2f}x smaller)")
+    return legacy, slotted
+
+
+def bench_insert_many(side = 300, loop_side = 60):
+    """
+    Grid ingestion through insert_many against the per-point insert loop.
+    """
+    results = []
+    for label, n_side in (('insert', loop_side), ('insert_many', loop_side), ('insert_many', side)):
+        i, j = np.meshgrid(np.arange(n_side), np.arange(n_side), indexing = 'ij')
+        coords = np.stack([ i.ravel(), j.ravel(), ((i + j) % 7).ravel() ], axis = 1)
+        payload = [ {'type': 'map_vertex', 'alt': float(alt)} for alt in coords[:, 2] ]
+        memory = am.AlgorithmicMemory()
+        start = time.perf_counter()
+        if label == 'insert':
+            for (x, y, z), data in zip(coords.tolist(), payload):
+                memory.insert(data, x, y, z)
+        else:
+            memory.insert_many(coords, payload)
+        elapsed = time.perf_counter() - start
+        results.append((label, len(coords), elapsed))
+        print(f"grid ingestion: {label:12s} n={len(coords):8d} {elapsed:8.3f} s "
+              f"{len(coords) / elapsed:10.0f} points/s")
+    return results
+
+
+def grid_lattice(side, origin = (0, 0, 0)):
+    from mapsloader import WorldLattice as wl
+    i, j = np.meshgrid(np.arange(side), np.arange(side), indexing = 'ij')
+    coords = np.stack([ i.ravel(), j.ravel(), ((i * 3 + j * 5) % 11).ravel() ], axis = 1)
+    lattice = wl.WorldLattice(*origin)
+    lattice.insert_batch(coords + np.array(origin), [
+        { 'type': 'map_vertex', 'lat': 38.5 + x * 1e-3, 'lon': -109.5 + y * 1e-3, 'alt': 1200.0 + z }
+        for x, y, z in coords.tolist() ])
+    return lattice
+
+
+def bench_lattice_io(side = 40):
+    """
+    Save/load of the single-file columnar format against the per-DBit pickle
+    directory written by serialize/deserialize.
+    """
+    from mapsloader import WorldLattice as wl
+    lattice = grid_lattice(side)
+    n = len(lattice.am.dbit_list)
+    results = {}
+    main_directory = wl.main_directory
+    with tempfile.TemporaryDirectory() as tmp:
+        wl.main_directory = tmp
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                lattice.serialize()
+                results['pickle save'] = time.perf_counter() - start
+                start = time.perf_counter()
+                wl.WorldLattice.deserialize(0, 0, 0)
+                results['pickle load'] = time.perf_counter() - start
+            start = time.perf_counter()
+            path = lattice.save()
+            results['columnar save'] = time.perf_counter() - start
+            start = time.perf_counter()
+            wl.WorldLattice.load(0, 0, 0)
+            results['columnar load'] = time.perf_counter() - start
+            pickle_bytes = sum(entry.stat().st_size for entry in
+                               os.scandir(wl.file_path_for_coords(0, 0, 0)))
+            columnar_bytes = os.path.getsize(path)
+        finally:
+            wl.main_directory = main_directory
+
+    for label, elapsed in results.items():
+        print(f"lattice io: {label:14s} n={n:7d} {elapsed * 1e3:10.2f} ms "
+              f"{n / elapsed:10.0f} vertices/s")
+    print(f"lattice io: pickle {pickle_bytes} bytes in {n} files, columnar {columnar_bytes} bytes in 1 file")
+    return results
+
+
+def bench_parallel_deserialize(side = 40, configurations = ((1, False), (4, False), (4, True))):
+    """
+    Cold-start load of a per-DBit pickle directory with different worker pools.
+    """
+    from mapsloader import WorldLattice as wl
+    lattice = grid_lattice(side)
+    reports = []
+    main_directory = wl.main_directory
+    with tempfile.TemporaryDirectory() as tmp:
+        wl.main_directory = tmp
+        try:
+            lattice.serialize()
+            for workers, processes in configurations:
+                report = wl.WorldLattice.deserialize(0, 0, 0, workers = workers,
+                                                     processes = processes).load_report
+                reports.append(report)
+                print(f"parallel deserialize: workers={workers} "
+                      f"{'processes' if processes else 'threads  '} "
+                      f"{report['seconds'] * 1e3:9.2f} ms {report['files_per_s']:10.0f} files/s "
+                      f"{report['vertices_per_s']:10.0f} vertices/s")
+        finally:
+            wl.main_directory = main_directory
+    return reports
+
+
+def synthetic_dem(directory, south = 38, west = -110, side = 1201):
+    """
+    A smooth synthetic SRTM tile, so DEM runs are deterministic and offline.
+    """
+    from mapsloader import ElevationProvider as ep
+    i, j = np.meshgrid(np.arange(side), np.arange(side), indexing = 'ij')
+    data = 1200 + 300 * np.sin(i / 97.0) * np.cos(j / 61.0)
+    return ep.write_hgt(directory, south, west, np.rint(data))
+
+
+def bench_dem_provider(n = 1000000, seed = 0):
+    """
+    Batch bilinear sampling from a memory-mapped .hgt tile.
+    """
+    from mapsloader import ElevationProvider as ep
+    rng = np.random.default_rng(seed)
+    lats = 38 + rng.random(n)
+    lons = -110 + rng.random(n)
+    with tempfile.TemporaryDirectory() as tmp:
+        synthetic_dem(tmp)
+        provider = ep.DEMElevationProvider(tmp)
+        start = time.perf_counter()
+        alts = provider.elevations(lats, lons)
+        elapsed = time.perf_counter() - start
+        del provider
+    print(f"dem provider: n={n:8d} {elapsed:8.3f} s {n / elapsed:12.0f} points/s")
+    return alts
+
+
+def bench_queries(side = 200, points = 100000, boxes = 1000, k = 4, seed = 0):
+    """
+    Batch nearest-neighbor and box queries through the grid index, against
+    a scan of dbit_list for the boxes.
+    """
+    lattice = grid_lattice(side)
+    rng = np.random.default_rng(seed)
+    start = time.perf_counter()
+    lattice.query_index()
+    build = time.perf_counter() - start
+
+    lats = 38.5 + rng.random(points) * side * 1e-3
+    lons = -109.5 + rng.random(points) * side * 1e-3
+    start = time.perf_counter()
+    lattice.nearest(lats, lons, k)
+    nearest = time.perf_counter() - start
+
+    lat0 = lats[:boxes]
+    lon0 = lons[:boxes]
+    start = time.perf_counter()
+    hits = len(lattice.query_box(lat0, lon0, lat0 + 5e-3, lon0 + 5e-3)['query'])
+    indexed = time.perf_counter() - start
+    start = time.perf_counter()
+    for a, b in zip(lat0[:50].tolist(), lon0[:50].tolist()):
+        [ dbit for dbit in lattice.am.dbit_list
+          if a <= dbit.lbit0.data['lat'] <= a + 5e-3 and b <= dbit.lbit0.data['lon'] <= b + 5e-3 ]
+    scan = (time.perf_counter() - start) / 50 * boxes
+
+    n = len(lattice.am.dbit_list)
+    print(f"queries: index build n={n} {build * 1e3:8.2f} ms")
+    print(f"queries: nearest k={k} {points / nearest:12.0f} points/s")
+    print(f"queries: {boxes} boxes ({hits} hits) index {indexed * 1e3:8.2f} ms, scan ~{scan * 1e3:10.2f} ms")
+    return build, nearest, indexed, scan
+
+
+def bench_integrity(side = 150, batch = 100, workers = 4):
+    """
+    Full integrity check (serial and forked) against re-checking only the
+    neighborhoods of one ingestion batch.
+    """
+    lattice = grid_lattice(side)
+    memory = lattice.am
+    full = memory.check_integrity()
+    parallel = memory.check_integrity_parallel(workers)
+
+    coords = np.stack([ np.arange(batch) % side, np.arange(batch) // side, np.full(batch, 50) ], axis = 1)
+    lattice.insert_batch(coords, [ 'batch' ] * batch)
+    touched = memory.check_touched()
+
+    print(f"integrity: full     {full.cells:8d} cells {full.seconds * 1e3:10.2f} ms ok={full.ok}")
+    print(f"integrity: parallel {parallel.cells:8d} cells {parallel.seconds * 1e3:10.2f} ms "
+          f"workers={workers} ok={parallel.ok}")
+    print(f"integrity: touched  {touched.cells:8d} cells {touched.seconds * 1e3:10.2f} ms ok={touched.ok}")
+    return full, parallel, touched
+
+
+def bench_prune(side = 100, singles = 2000, box = 60):
+    """
+    Pruning vertices one by one, and a whole box with prune_region.
+    """
+    lattice = grid_lattice(side)
+    memory = lattice.am
+    start = time.perf_counter()
+    for n in range(singles):
+        x, y = n % side, n // side
+        memory.prune(x, y, (x * 3 + y * 5) % 11)
+    singles_seconds = time.perf_counter() - start
+
+    lattice = grid_lattice(side)
+    start = time.perf_counter()
+    removed = lattice.prune_region((0, 0, -100), (box - 1, box - 1, 100))
+    region_seconds = time.perf_counter() - start
+    ok = lattice.am.check_touched().ok
+
+    print(f"prune: single {singles:8d} vertices {singles_seconds * 1e3:10.2f} ms "
+          f"({singles_seconds / singles * 1e6:.2f} us each)")
+    print(f"prune: region {removed:8d} vertices {region_seconds * 1e3:10.2f} ms ok={ok}")
+    return singles_seconds, region_seconds
+
+
+def bench_scaffolding(n = 2000, spread = 300, seed = 0):
+    """
+    Root DBits left behind by the head after n scattered inserts, with and
+    without reclaiming the windows it leaves.
+    """
+    rng = random.Random(seed)
+    points = [ (rng.randrange(spread), rng.randrange(spread), rng.randrange(10)) for _ in range(n) ]
+    results = []
+    for reclaim in (False, True):
+        memory = am.AlgorithmicMemory(reclaim = reclaim)
+        start = time.perf_counter()
+        for x, y, z in points:
+            memory.insert("p", x, y, z)
+        elapsed = time.perf_counter() - start
+        counts = memory.scaffolding()
+        results.append((reclaim, elapsed, counts))
+        print(f"scaffolding: reclaim={reclaim!s:5s} {elapsed * 1e3:9.2f} ms roots={counts['roots']:8d} "
+              f"vertices={counts['vertices']:8d} scaffolding/vertex={counts['ratio']:.3f}")
+    return results
+
+
+def missing_links(memory):
+    """
+    Neighboring root DBits that are not linked to each other.
+    """
+    missing = 0
+    for (x, y, z), dbit in memory.dbits.items():
+        for axis, up in (('x', (x + 1, y, z)), ('y', (x, y + 1, z)), ('z', (x, y, z + 1))):
+            neighbor = memory.dbits.get(up)
+            if neighbor is not None and getattr(dbit.lbit1, axis) is not neighbor.lbit0:
+                missing += 1
+    return missing
+
+
+def bench_concurrent_ingest(side = 120, threads = 4, batch = 256, seed = 0):
+    """
+    Throughput of threads inserting interleaved 5-wide slabs of a grid
+    through their own cursors, against a single-threaded insert_many. The
+    stress test proper is test_concurrent_cursors_keep_links.
+    """
+    import threading
+    i, j = np.meshgrid(np.arange(side), np.arange(side), indexing = 'ij')
+    coords = np.stack([ i.ravel(), j.ravel(), ((i * 3 + j * 5) % 11).ravel() ], axis = 1)
+    payload = [ 'p' ] * len(coords)
+
+    memory = am.AlgorithmicMemory()
+    start = time.perf_counter()
+    memory.insert_many(coords, payload)
+    serial = time.perf_counter() - start
+
+    memory = am.AlgorithmicMemory().concurrent()
+    rng = random.Random(seed)
+    slabs = (coords[:, 0] // 5) % threads
+    errors = []
+
+    def ingest(worker):
+        try:
+            cursor = memory.new_cursor()
+            rows = np.flatnonzero(slabs == worker)
+            for n in range(0, len(rows), batch):
+                part = rows[n:n + batch]
+                if rng.random() < 0.5:
+                    cursor.insert_many(coords[part], [ payload[k] for k in part.tolist() ])
+                else:
+                    for x, y, z in coords[part].tolist():
+                        cursor.insert('p', x, y, z)
+        except Exception as e:
+            errors.append(e)
+
+    workers = [ threading.Thread(target = ingest, args = (worker,)) for worker in range(threads) ]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    concurrent = time.perf_counter() - start
+
+    report = memory.check_integrity()
+    trs = [ lbit.tr.tr for dbit in memory.dbit_list for lbit in (dbit.lbit0, dbit.lbit1) ]
+    ok = (not errors and report.ok and len(memory.dbit_list) == len(coords)
+          and len(set(trs)) == len(trs) and missing_links(memory) == 0
+          and all(dbit.slot == n for n, dbit in enumerate(memory.dbit_list)))
+
+    print(f"concurrent ingest: serial          n={len(coords):8d} {serial:8.3f} s "
+          f"{len(coords) / serial:10.0f} points/s")
+    print(f"concurrent ingest: threads={threads:<2d}      n={len(coords):8d} {concurrent:8.3f} s "
+          f"{len(coords) / concurrent:10.0f} points/s ok={ok}")
+    if errors:
+        raise errors[0]
+    return serial, concurrent, ok
+
+
+def bench_snapshots(side = 300, batches = 20, batch = 100):
+    """
+    Cost of a read snapshot: the first one freezes every chunk, later ones
+    only the chunks a batch of inserts changed.
+    """
+    lattice = grid_lattice(side)
+    start = time.perf_counter()
+    first = lattice.snapshot()
+    full = time.perf_counter() - start
+
+    seconds = []
+    for n in range(batches):
+        coords = np.stack([ np.arange(batch) % side, np.full(batch, n * 7 % side), np.full(batch, 20) ], axis = 1)
+        lattice.insert_batch(coords, [ 'p' ] * batch)
+        start = time.perf_counter()
+        lattice.snapshot()
+        seconds.append(time.perf_counter() - start)
+    last = lattice.published
+    shared = sum(1 for key, view in last.views.items() if first.views.get(key) is view)
+
+    print(f"snapshots: first       {first.count:8d} vertices {len(first.views):6d} chunks {full * 1e3:9.2f} ms")
+    print(f"snapshots: incremental {batch:8d} vertices/batch       {np.mean(seconds) * 1e3:9.2f} ms "
+          f"({shared} of {len(last.views)} chunks still shared with the first)")
+    return full, seconds
+
+
+def percentile_ms(seconds, q):
+
+    return float(np.percentile(np.asarray(seconds), q) * 1e3) if seconds else float('nan')
+
+
+def bench_http(side = 120, requests = 2000, clients = 8, batch = 1000, seed = 0, workers = 4):
+    """
+    Local load test of the lattice HTTP API as deployed: LatticeServer.serve
+    with `workers` pre-forked processes, run in a child process over a saved
+    lattice. Clients mix tile, box, point and batch requests (half of the
+    repeats revalidating with If-None-Match). Reports p50 / p99 latency.
+    """
+    import sys
+    import json
+    import signal
+    import socket
+    import threading
+    import http.client
+    from mapsloader import LatticeServer as ls
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'bench.lattice')
+    lattice = grid_lattice(side)
+    lattice.save(path)
+
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    pid = os.fork()
+    if pid == 0:
+        # exit through serve()'s finally, which stops its workers
+        signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+        try:
+            ls.serve(path, port = port, workers = workers)
+        finally:
+            os._exit(0)
+    deadline = time.perf_counter() + 60
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            break
+        except OSError:
+            if time.perf_counter() > deadline:
+                os.kill(pid, signal.SIGTERM)
+                raise
+            time.sleep(0.05)
+
+    rng = random.Random(seed)
+    points = np.stack([ 38.5 + np.arange(batch) % side * 1e-3,
+                        -109.5 + np.arange(batch) // side * 1e-3 ], axis = 1).astype('<f8').tobytes()
+
+    def plan():
+        kind = rng.choice(('tile', 'box', 'point', 'batch'))
+        fmt = rng.choice(ls.FORMATS)
+        if kind == 'tile':
+            return kind, 'GET', f"/tile/{rng.randrange(4)}/0/0?format={fmt}", None
+        if kind == 'box':
+            lat, lon = 38.5 + rng.randrange(side - 10) * 1e-3, -109.5 + rng.randrange(side - 10) * 1e-3
+            return kind, 'GET', f"/box?lat0={lat}&lon0={lon}&lat1={lat + 0.01}&lon1={lon + 0.01}&format={fmt}", None
+        if kind == 'point':
+            return kind, 'GET', f"/elevation?lat={38.5 + rng.randrange(side) * 1e-3}&lon=-109.45&format={fmt}", None
+        return kind, 'POST', f"/elevation?format={fmt}", points
+
+    plans = [ plan() for _ in range(requests) ]
+    latencies = { kind: [] for kind in ('tile', 'box', 'point', 'batch') }
+    statuses = {}
+    lock = threading.Lock()
+
+    def client(part):
+        etags = {}
+        repeats = 0
+        for kind, method, url, body in part:
+            headers = { 'Content-Type': 'application/octet-stream' } if body else {}
+            if url in etags:
+                repeats += 1
+                if repeats % 2:
+                    headers['If-None-Match'] = etags[url]
+            start = time.perf_counter()
+            connection = http.client.HTTPConnection('127.0.0.1', port)
+            connection.request(method, url, body = body, headers = headers)
+            response = connection.getresponse()
+            response.read()
+            elapsed = time.perf_counter() - start
+            connection.close()
+            if response.getheader('ETag'):
+                etags[url] = response.getheader('ETag')
+            with lock:
+                latencies[kind].append(elapsed)
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+
+    threads = [ threading.Thread(target = client, args = (plans[n::clients],)) for n in range(clients) ]
+    start = time.perf_counter()
+    for worker in threads:
+        worker.start()
+    for worker in threads:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    os.kill(pid, signal.SIGTERM)
+    os.waitpid(pid, 0)
+    for name in os.listdir(directory):
+        os.remove(os.path.join(directory, name))
+    os.rmdir(directory)
+
+    every = [ seconds for values in latencies.values() for seconds in values ]
+    for kind, values in latencies.items():
+        print(f"http: {kind:6s} n={len(values):6d} p50 {percentile_ms(values, 50):8.2f} ms "
+              f"p99 {percentile_ms(values, 99):8.2f} ms")
+    print(f"http: all    n={len(every):6d} p50 {percentile_ms(every, 50):8.2f} ms "
+          f"p99 {percentile_ms(every, 99):8.2f} ms {len(every) / elapsed:8.0f} requests/s "
+          f"clients={clients} workers={workers} status={json.dumps(statuses, sort_keys = True)}")
+    return latencies
+
+
+if __name__ == '__main__':
+    bench_scattered_inserts()
+    bench_vertex_memory()
+    bench_insert_many()
+    bench_lattice_io()
+    bench_parallel_deserialize()
+    bench_dem_provider()
+    bench_queries()
+    bench_integrity()
+    bench_prune()
+    bench_scaffolding()
+    bench_concurrent_ingest()
+    bench_snapshots()
+    bench_http()
@@ -0,0 +1,186 @@
+"""
+
+ Chunked spatial index for AlgorithmicMemory.
+
+ Space is cut into fixed CHUNK_SIZE^3 blocks. Every chunk keeps an occupancy
+ bitmap next to a slot array holding the DBits, so point lookups stay O(1)
+ while iterating, dropping or persisting a whole block only touches that
+ block.
+
+"""
+import numpy as np
+
+CHUNK_BITS = 4
+CHUNK_SIZE = 1 << CHUNK_BITS
+CHUNK_MASK = CHUNK_SIZE - 1
+
+
+# packed chunk keys: 21 signed bits per axis in one int64
+PACK_BITS = 21
+PACK_BIAS = 1 << (PACK_BITS - 1)
+PACK_MASK = (1 << PACK_BITS) - 1
+
+
+def chunk_key(x, y, z):
+    return (x >> CHUNK_BITS, y >> CHUNK_BITS, z >> CHUNK_BITS)
+
+
+def pack_chunk_keys(coords):
+    """
+    Vectorized chunk keys for an (n, 3) coordinate array, packed into int64
+    so that sorting by them groups the rows chunk by chunk.
+    """
+    keys = (np.asarray(coords, dtype = np.int64) >> CHUNK_BITS) + PACK_BIAS
+    return (keys[..., 0] << (2 * PACK_BITS)) | (keys[..., 1] << PACK_BITS) | keys[..., 2]
+
+
+def pack_chunk_key(key):
+    cx, cy, cz = key
+    return (((cx + PACK_BIAS) << (2 * PACK_BITS)) | ((cy + PACK_BIAS) << PACK_BITS)
+            | (cz + PACK_BIAS))
+
+
+def unpack_chunk_key(packed):
+    return ((packed >> (2 * PACK_BITS)) - PACK_BIAS,
+            ((packed >> PACK_BITS) & PACK_MASK) - PACK_BIAS,
+            (packed & PACK_MASK) - PACK_BIAS)
+
+
+class Chunk:
+
+    __slots__ = ('key', 'occupancy', 'slots', 'count')
+
+    def __init__(self, key):
+        self.key = key
+        self.occupancy = np.zeros((CHUNK_SIZE, CHUNK_SIZE, CHUNK_SIZE), dtype = bool)
+        self.slots = np.empty((CHUNK_SIZE, CHUNK_SIZE, CHUNK_SIZE), dtype = object)
+        self.count = 0
+
+    def origin(self):
+        cx, cy, cz = self.key
+        return (cx << CHUNK_BITS, cy << CHUNK_BITS, cz << CHUNK_BITS)
+
+    def coords(self):
+        """
+        Occupied cells of the chunk as an (n, 3) array of absolute coordinates.
+        """
+        local = np.argwhere(self.occupancy)
+        return local + np.array(self.origin())
+
+    def items(self):
+        ox, oy, oz = self.origin()
+        for i, j, k in np.argwhere(self.occupancy).tolist():
+            yield (ox + i, oy + j, oz + k), self.slots[i, j, k]
+
+
+class ChunkIndex:
+    """
+    Dictionary-like (x, y, z) -> DBit mapping backed by chunks.
+    """
+
+    def __init__(self):
+        self.chunks = {}
+        self.count = 0
+        # set for concurrent writers; each one must hold the lock of the
+        # chunk it writes to, this one only guards the total count
+        self.lock = None
+
+    def chunk(self, x, y, z):
+        return self.chunks.get((x >> CHUNK_BITS, y >> CHUNK_BITS, z >> CHUNK_BITS))
+
+    def __getitem__(self, coords):
+        x, y, z = coords
+        value = self.chunks[(x >> CHUNK_BITS, y >> CHUNK_BITS, z >> CHUNK_BITS)].slots[
+            x & CHUNK_MASK, y & CHUNK_MASK, z & CHUNK_MASK]
+        if value is None:
+            raise KeyError(coords)
+        return value
+
+    def get(self, coords, default = None):
+        try:
+            return self[coords]
+        except KeyError:
+            return default
+
+    def __setitem__(self, coords, value):
+        x, y, z = coords
+        key = (x >> CHUNK_BITS, y >> CHUNK_BITS, z >> CHUNK_BITS)
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            chunk = self.chunks[key] = Chunk(key)
+        local = (x & CHUNK_MASK, y & CHUNK_MASK, z & CHUNK_MASK)
+        if not chunk.occupancy[local]:
+            chunk.occupancy[local] = True
+            chunk.count += 1
+            if self.lock is None:
+                self.count += 1
+            else:
+                with self.lock:
+                    self.count += 1
+        chunk.slots[local] = value
+
+    def __delitem__(self, coords):
+        x, y, z = coords
+        key = (x >> CHUNK_BITS, y >> CHUNK_BITS, z >> CHUNK_BITS)
+        chunk = self.chunks.get(key)
+        local = (x & CHUNK_MASK, y & CHUNK_MASK, z & CHUNK_MASK)
+        if chunk is None or not chunk.occupancy[local]:
+            raise KeyError(coords)
+        chunk.occupancy[local] = False
+        chunk.slots[local] = None
+        chunk.count -= 1
+        self.count -= 1
+        if chunk.count == 0:
+            del self.chunks[key]
+
+    def __contains__(self, coords):
+        x, y, z = coords
+        chunk = self.chunks.get((x >> CHUNK_BITS, y >> CHUNK_BITS, z >> CHUNK_BITS))
+        return chunk is not None and bool(chunk.occupancy[x & CHUNK_MASK, y & CHUNK_MASK, z & CHUNK_MASK])
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for coords, _ in self.items():
+            yield coords
+
+    def keys(self):
+        return iter(self)
+
+    def values(self):
+        for _, value in self.items():
+            yield value
+
+    def items(self):
+        for chunk in list(self.chunks.values()):
+            yield from chunk.items()
+
+    def chunk_keys(self):
+        return list(self.chunks.keys())
+
+    def iter_chunk(self, key):
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            return iter(())
+        return chunk.items()
+
+    def drop_chunk(self, key):
+        """
+        Forget a whole chunk at once. Returns the dropped Chunk (or None).
+        """
+        chunk = self.chunks.pop(key, None)
+        if chunk is not None:
+            self.count -= chunk.count
+        return chunk
+
+    def chunks_in_box(self, lo, hi):
+        """
+        Keys of the existing chunks overlapping the inclusive box lo..hi.
+        """
+        klo = chunk_key(*lo)
+        khi = chunk_key(*hi)
+        return [ key for key in self.chunks
+                 if klo[0] <= key[0] <= khi[0]
+                 and klo[1] <= key[1] <= khi[1]
+                 and klo[2] <= key[2] <= khi[2] ]
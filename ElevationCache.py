@@ -0,0 +1,156 @@
+"""
+
+ Persistent elevation cache.
+
+ Elevations are keyed by (int(lat * precision_factor), int(lon * precision_factor)),
+ the same quantization MapsLoader uses for lattice coordinates, only finer
+ (1e5 is about a meter). Lookups go through an in-memory LRU first and then
+ a SQLite table, both in batches, so only real misses reach the network.
+
+"""
+import os
+import sqlite3
+import threading
+import numpy as np
+from collections import OrderedDict
+
+# SQLite host parameter limit is 32766 on current builds, 999 on old ones
+SQL_BATCH = 400
+
+
+class LRUCache:
+
+    def __init__(self, capacity = 100000):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default = None):
+        with self.lock:
+            try:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            except KeyError:
+                return default
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last = False)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class ElevationCache:
+
+    def __init__(self, path, precision_factor = 100000, lru_size = 1000000):
+        self.path = path
+        self.precision_factor = precision_factor
+        self.lru = LRUCache(lru_size)
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+        self.db = sqlite3.connect(path, check_same_thread = False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS elevation ("
+                        "qlat INTEGER NOT NULL, qlon INTEGER NOT NULL, alt REAL NOT NULL, "
+                        "PRIMARY KEY (qlat, qlon)) WITHOUT ROWID")
+        self.db.commit()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def keys(self, locations):
+        """
+        Quantized (qlat, qlon) keys for a list of (lat, lon).
+        """
+        points = np.asarray(locations, dtype = np.float64).reshape(-1, 2)
+        return [ tuple(key) for key in (points * self.precision_factor).astype(np.int64).tolist() ]
+
+    def lookup_many(self, keys):
+        """
+        Cached elevations for keys as a float array, NaN where nothing is cached.
+        """
+        alts = np.full(len(keys), np.nan)
+        pending = {}
+        for index, key in enumerate(keys):
+            alt = self.lru.get(key)
+            if alt is None:
+                pending.setdefault(key, []).append(index)
+            else:
+                alts[index] = alt
+                self.memory_hits += 1
+
+        wanted = list(pending.keys())
+        with self.lock:
+            for start in range(0, len(wanted), SQL_BATCH):
+                batch = wanted[start:start + SQL_BATCH]
+                query = ("SELECT qlat, qlon, alt FROM elevation WHERE (qlat, qlon) IN (VALUES "
+                         + ",".join([ "(?, ?)" ] * len(batch)) + ")")
+                params = [ value for key in batch for value in key ]
+                for qlat, qlon, alt in self.db.execute(query, params):
+                    key = (qlat, qlon)
+                    self.lru.put(key, alt)
+                    indexes = pending.pop(key)
+                    alts[indexes] = alt
+                    self.disk_hits += len(indexes)
+
+        self.misses += sum(len(indexes) for indexes in pending.values())
+        return alts
+
+    def store_many(self, keys, alts):
+        rows = [ (qlat, qlon, float(alt)) for (qlat, qlon), alt in zip(keys, alts) ]
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO elevation (qlat, qlon, alt) VALUES (?, ?, ?)", rows)
+            self.db.commit()
+        for key, alt in zip(keys, alts):
+            self.lru.put(key, float(alt))
+
+    def get_altitudes(self, locations, fetch):
+        """
+        Elevations for (lat, lon) pairs in input order. fetch(list of (lat, lon))
+        is called once, with one point per distinct missing key, and only if
+        something is missing.
+        """
+        locations = list(locations)
+        keys = self.keys(locations)
+        alts = self.lookup_many(keys)
+
+        missing = {}
+        for index in np.flatnonzero(np.isnan(alts)).tolist():
+            missing.setdefault(keys[index], []).append(index)
+
+        if missing:
+            fetched = fetch([ locations[indexes[0]] for indexes in missing.values() ])
+            self.store_many(list(missing.keys()), fetched)
+            for indexes, alt in zip(missing.values(), fetched):
+                alts[indexes] = alt
+
+        return alts.tolist()
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_ratio': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            'lru_entries': len(self.lru),
+            }
+
+    def close(self):
+        with self.lock:
+            self.db.close()
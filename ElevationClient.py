@@ -0,0 +1,201 @@
+"""
+
+ Google Elevation API client.
+
+ Splits a list of (lat, lon) points into the largest batches the API accepts
+ (location count and URL length), fetches the batches concurrently over one
+ pooled requests.Session, retries OVER_QUERY_LIMIT / 5xx answers with
+ exponential backoff and returns the elevations in input order.
+
+ base_url can point at a local stub server for testing.
+
+"""
+import time
+import random
+import requests
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+ELEVATION_URL = "https://maps.googleapis.com/maps/api/elevation/json"
+
+# documented API limits
+MAX_LOCATIONS = 512
+MAX_URL_LENGTH = 16384
+
+RETRY_STATUSES = ('OVER_QUERY_LIMIT', 'UNKNOWN_ERROR')
+
+
+class ElevationError(ValueError):
+    """Exception raised when the Elevation API cannot answer a request."""
+
+    def __init__(self, message="Failed to get altitude"):
+        self.message = message
+        super().__init__(self.message)
+
+
+def polyline_chunk(value):
+    """
+    Encoded-polyline characters for one signed, already scaled delta.
+    """
+    value = ~(value << 1) if value < 0 else value << 1
+    chars = []
+    while value >= 0x20:
+        chars.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    chars.append(chr(value + 63))
+    return "".join(chars)
+
+
+def encode_polyline(locations):
+    """
+    Google encoded polyline (1e-5 degree precision) of a list of (lat, lon).
+    """
+    parts = []
+    plat = plon = 0
+    for lat, lon in locations:
+        ilat = int(round(lat * 1e5))
+        ilon = int(round(lon * 1e5))
+        parts.append(polyline_chunk(ilat - plat))
+        parts.append(polyline_chunk(ilon - plon))
+        plat, plon = ilat, ilon
+    return "".join(parts)
+
+
+def request_json(session, url, params, timeout = 30, max_retries = 5, backoff = 0.5,
+                 error = ElevationError):
+    """
+    GET a Google Maps web service and return its JSON body once 'status' is
+    OK. Connection errors, 429, 5xx and OVER_QUERY_LIMIT / UNKNOWN_ERROR are
+    retried with jittered exponential backoff; anything else raises `error`.
+    """
+    problem = None
+    for attempt in range(max_retries + 1):
+        if attempt:
+            time.sleep(backoff * (2 ** (attempt - 1)) * (1 + random.random()))
+        try:
+            response = session.get(url, params = params, timeout = timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            problem = str(e)
+            continue
+
+        if response.status_code >= 500 or response.status_code == 429:
+            problem = f"status code {response.status_code}"
+            continue
+        if response.status_code != 200:
+            raise error(f"{url} returned status code {response.status_code}: "
+                        f"{response.content[:200]!r}")
+
+        data = response.json()
+        status = data.get('status', '')
+        if status in RETRY_STATUSES:
+            problem = f"status '{status}'"
+            continue
+        if status != 'OK':
+            raise error(f"{url} returned status '{status}': {data.get('error_message', '')}")
+        return data
+
+    raise error(f"{url} still failing after {max_retries} retries: {problem}")
+
+
+def pooled_session(workers):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections = workers, pool_maxsize = workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class ElevationClient:
+
+    def __init__(self, api_key, base_url = ELEVATION_URL, max_locations = MAX_LOCATIONS,
+                 max_url_length = MAX_URL_LENGTH, polyline = False, workers = 4,
+                 max_retries = 5, backoff = 0.5, timeout = 30, session = None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.max_locations = max_locations
+        self.max_url_length = max_url_length
+        self.polyline = polyline
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        if session is None:
+            session = pooled_session(workers)
+        self.session = session
+
+    def url_overhead(self):
+        # base?locations=<...>&key=<key>
+        return len(self.base_url) + len("?locations=") + len("&key=") + len(quote(str(self.api_key), safe = ''))
+
+    def batches(self, locations):
+        """
+        Split locations into maximal (start, end) index ranges that respect
+        both the per-request location cap and the URL length limit.
+        """
+        budget = self.max_url_length - self.url_overhead()
+        ranges = []
+        start = 0
+        length = 0
+        plat = plon = 0
+        for index, (lat, lon) in enumerate(locations):
+            if self.polyline:
+                ilat = int(round(lat * 1e5))
+                ilon = int(round(lon * 1e5))
+                if index == start:
+                    # a batch restarts the delta encoding and carries the "enc:" prefix
+                    piece = len("enc%3A") + len(quote(polyline_chunk(ilat) + polyline_chunk(ilon), safe = ''))
+                else:
+                    piece = len(quote(polyline_chunk(ilat - plat) + polyline_chunk(ilon - plon), safe = ''))
+                plat, plon = ilat, ilon
+            else:
+                piece = len(quote(f"{lat},{lon}", safe = ''))
+                if index != start:
+                    piece += len("%7C")
+
+            if index != start and (index - start >= self.max_locations or length + piece > budget):
+                ranges.append((start, index))
+                start = index
+                if self.polyline:
+                    piece = len("enc%3A") + len(quote(polyline_chunk(ilat) + polyline_chunk(ilon), safe = ''))
+                else:
+                    piece -= len("%7C")
+                length = 0
+            length += piece
+
+        if start < len(locations):
+            ranges.append((start, len(locations)))
+        return ranges
+
+    def locations_param(self, locations):
+        if self.polyline:
+            return "enc:" + encode_polyline(locations)
+        return "|".join([ f"{lat},{lon}" for lat, lon in locations ])
+
+    def fetch_batch(self, locations):
+        """
+        Elevations for one batch, retrying transient failures with backoff.
+        """
+        params = { 'locations': self.locations_param(locations), 'key': self.api_key }
+        data = request_json(self.session, self.base_url, params, self.timeout,
+                            self.max_retries, self.backoff)
+
+        results = data.get('results', [])
+        if len(results) != len(locations):
+            raise ElevationError(f"Elevation API returned {len(results)} results "
+                                 f"for {len(locations)} locations")
+        return [ result['elevation'] for result in results ]
+
+    def get_altitudes(self, locations):
+        """
+        Elevations for any number of (lat, lon) pairs, in input order.
+        """
+        locations = list(locations)
+        chunks = [ locations[start:end] for start, end in self.batches(locations) ]
+        if len(chunks) <= 1 or self.workers <= 1:
+            results = [ self.fetch_batch(chunk) for chunk in chunks ]
+        else:
+            with ThreadPoolExecutor(max_workers = self.workers) as pool:
+                results = list(pool.map(self.fetch_batch, chunks))
+        return [ altitude for batch in results for altitude in batch ]
@@ -0,0 +1,197 @@
+"""
+
+ Elevation sources behind one interface.
+
+ An ElevationProvider answers whole batches: elevations(lats, lons) takes
+ two float arrays and returns a float array (NaN where it has no data).
+ get_altitudes(locations) is the list-of-(lat, lon) form the loader uses.
+
+   GoogleElevationProvider  Google Elevation API, optionally behind the
+                            persistent ElevationCache
+   DEMElevationProvider     local DEM rasters (SRTM .hgt tiles or raw
+                            int16 / float32 grids), memory-mapped and
+                            sampled bilinearly, fully vectorized
+
+"""
+import os
+import re
+import numpy as np
+from abc import ABC, abstractmethod
+from mapsloader.ElevationClient import ElevationError
+
+HGT_NAME = re.compile(r'^([NS])(\d{1,2})([EW])(\d{1,3})\.hgt$', re.IGNORECASE)
+HGT_VOID = -32768
+
+
+class ElevationProvider(ABC):
+
+    @abstractmethod
+    def elevations(self, lats, lons):
+        """
+        Elevations at two float arrays of points, NaN where there is no data.
+        """
+
+    def get_altitudes(self, locations):
+        points = np.asarray(locations, dtype = np.float64).reshape(-1, 2)
+        alts = self.elevations(points[:, 0], points[:, 1])
+        if np.isnan(alts).any():
+            missing = int(np.isnan(alts).sum())
+            raise ElevationError(f"{type(self).__name__} has no elevation for {missing} of {len(alts)} points")
+        return alts.tolist()
+
+
+class GoogleElevationProvider(ElevationProvider):
+
+    def __init__(self, client, cache = None):
+        self.client = client
+        self.cache = cache
+
+    def elevations(self, lats, lons):
+        locations = list(zip(np.asarray(lats, dtype = np.float64).tolist(),
+                             np.asarray(lons, dtype = np.float64).tolist()))
+        if self.cache is not None:
+            return np.array(self.cache.get_altitudes(locations, self.client.get_altitudes))
+        return np.array(self.client.get_altitudes(locations), dtype = np.float64)
+
+
+class DEMTile:
+    """
+    One georeferenced raster. Row 0 is the north edge, column 0 the west
+    edge, and the outer rows/columns sit exactly on the bounds (as in SRTM).
+    """
+
+    def __init__(self, path, dtype, shape, north, west, south, east, nodata = None):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.shape = tuple(shape)
+        self.north = north
+        self.west = west
+        self.south = south
+        self.east = east
+        self.nodata = nodata
+        self.data = None
+
+    def __getstate__(self):
+        # ship the tile description to worker processes, not the mapping
+        state = dict(self.__dict__)
+        state['data'] = None
+        return state
+
+    def open(self):
+        if self.data is None:
+            self.data = np.memmap(self.path, dtype = self.dtype, mode = 'r', shape = self.shape)
+        return self.data
+
+    def covers(self, lats, lons):
+        return (lats <= self.north) & (lats >= self.south) & (lons >= self.west) & (lons <= self.east)
+
+    def sample(self, lats, lons):
+        """
+        Bilinear elevations at points inside the tile.
+        """
+        data = self.open()
+        rows, cols = self.shape
+        row = (self.north - lats) / (self.north - self.south) * (rows - 1)
+        col = (lons - self.west) / (self.east - self.west) * (cols - 1)
+        r0 = np.clip(np.floor(row).astype(np.int64), 0, rows - 2)
+        c0 = np.clip(np.floor(col).astype(np.int64), 0, cols - 2)
+        fr = row - r0
+        fc = col - c0
+
+        v00 = data[r0, c0].astype(np.float64)
+        v01 = data[r0, c0 + 1].astype(np.float64)
+        v10 = data[r0 + 1, c0].astype(np.float64)
+        v11 = data[r0 + 1, c0 + 1].astype(np.float64)
+        if self.nodata is not None:
+            for values in (v00, v01, v10, v11):
+                values[values == self.nodata] = np.nan
+
+        return ((v00 * (1 - fc) + v01 * fc) * (1 - fr)
+                + (v10 * (1 - fc) + v11 * fc) * fr)
+
+
+def hgt_tile(path):
+    """
+    DEMTile for an SRTM .hgt file named like N38W110.hgt (big-endian int16,
+    1201 or 3601 samples square, one degree).
+    """
+    match = HGT_NAME.match(os.path.basename(path))
+    if match is None:
+        raise ValueError(f"not an SRTM tile name: {path}")
+    south = int(match.group(2)) * (1 if match.group(1).upper() == 'N' else -1)
+    west = int(match.group(4)) * (1 if match.group(3).upper() == 'E' else -1)
+    side = int(round((os.path.getsize(path) // 2) ** 0.5))
+    if side * side * 2 != os.path.getsize(path):
+        raise ValueError(f"unexpected .hgt size: {path}")
+    return DEMTile(path, '>i2', (side, side), south + 1, west, south, west + 1, nodata = HGT_VOID)
+
+
+def hgt_name(south, west):
+    return (f"{'N' if south >= 0 else 'S'}{abs(south):02d}"
+            f"{'E' if west >= 0 else 'W'}{abs(west):03d}.hgt")
+
+
+def write_hgt(directory, south, west, data):
+    """
+    Write an (n, n) array as an SRTM tile; handy for synthetic test terrain.
+    """
+    path = os.path.join(directory, hgt_name(south, west))
+    np.asarray(data).astype('>i2').tofile(path)
+    return path
+
+
+class DEMElevationProvider(ElevationProvider):
+
+    def __init__(self, directory = None):
+        # one-degree .hgt tiles by (south, west), other rasters in a list
+        self.hgt = {}
+        self.rasters = []
+        if directory is not None:
+            for name in sorted(os.listdir(directory)):
+                if HGT_NAME.match(name):
+                    tile = hgt_tile(os.path.join(directory, name))
+                    self.hgt[(tile.south, tile.west)] = tile
+
+    def add_raster(self, path, dtype, shape, north, west, south, east, nodata = None):
+        """
+        Register a raw grid (e.g. int16 or float32, row-major, north-up).
+        """
+        tile = DEMTile(path, dtype, shape, north, west, south, east, nodata)
+        self.rasters.append(tile)
+        return tile
+
+    def sample_hgt(self, alts, lats, lons, south, west, where = None):
+        """
+        Fill alts from the .hgt tile with corner (south, west) for each point.
+        """
+        index = np.arange(len(lats)) if where is None else np.flatnonzero(where)
+        keys, inverse = np.unique(np.stack([ south[index], west[index] ], axis = 1).astype(np.int64),
+                                  axis = 0, return_inverse = True)
+        inverse = inverse.reshape(-1)
+        for group, (tile_south, tile_west) in enumerate(keys.tolist()):
+            tile = self.hgt.get((tile_south, tile_west))
+            if tile is not None:
+                points = index[inverse == group]
+                alts[points] = tile.sample(lats[points], lons[points])
+
+    def elevations(self, lats, lons):
+        lats = np.asarray(lats, dtype = np.float64)
+        lons = np.asarray(lons, dtype = np.float64)
+        alts = np.full(lats.shape, np.nan)
+
+        if self.hgt:
+            south, west = np.floor(lats), np.floor(lons)
+            self.sample_hgt(alts, lats, lons, south, west)
+            # points on a north or east tile edge also belong to the neighbour
+            for south, west in ((np.ceil(lats) - 1, west), (south, np.ceil(lons) - 1),
+                                (np.ceil(lats) - 1, np.ceil(lons) - 1)):
+                edge = np.isnan(alts)
+                if edge.any():
+                    self.sample_hgt(alts, lats, lons, south, west, edge)
+
+        for tile in self.rasters:
+            mask = np.isnan(alts) & tile.covers(lats, lons)
+            if mask.any():
+                alts[mask] = tile.sample(lats[mask], lons[mask])
+
+        return alts
@@ -0,0 +1,140 @@
+"""
+
+ Cached, batched geocoding.
+
+ Addresses are normalized (case, whitespace, comma spacing) before they are
+ looked up, first in an in-memory LRU, then in a SQLite table. geocode_many
+ dedupes its input and resolves the remaining misses concurrently over one
+ pooled session.
+
+"""
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from mapsloader.ElevationClient import request_json, pooled_session
+from mapsloader.ElevationCache import LRUCache
+
+GEOCODE_URL = "https://maps.googleapis.com/maps/api/geocode/json"
+
+
+class GeocodeError(ValueError):
+    """Exception raised when an address cannot be geocoded."""
+
+    def __init__(self, message="Failed to geocode address"):
+        self.message = message
+        super().__init__(self.message)
+
+
+def normalize_address(address):
+    parts = [ " ".join(part.split()) for part in address.lower().split(",") ]
+    return ", ".join([ part for part in parts if part ]).strip(" .")
+
+
+class Geocoder:
+
+    def __init__(self, api_key, cache_path, base_url = GEOCODE_URL, lru_size = 10000,
+                 workers = 8, max_retries = 3, backoff = 0.5, timeout = 30, session = None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = pooled_session(workers) if session is None else session
+
+        self.lru = LRUCache(lru_size)
+        self.lock = threading.Lock()
+        directory = os.path.dirname(cache_path)
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+        self.db = sqlite3.connect(cache_path, check_same_thread = False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS geocode ("
+                        "address TEXT PRIMARY KEY, lat REAL NOT NULL, lng REAL NOT NULL)")
+        self.db.commit()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def fetch(self, address):
+        data = request_json(self.session, self.base_url, { 'address': address, 'key': self.api_key },
+                            self.timeout, self.max_retries, self.backoff, error = GeocodeError)
+        results = data.get('results')
+        if not results:
+            raise GeocodeError(f"Failed to geocode address '{address}'")
+        location = results[0]['geometry']['location']
+        return location['lat'], location['lng']
+
+    def lookup(self, keys):
+        """
+        Cached locations for normalized addresses, as a dict.
+        """
+        found = {}
+        pending = []
+        for key in keys:
+            location = self.lru.get(key)
+            if location is None:
+                pending.append(key)
+            else:
+                found[key] = location
+                self.memory_hits += 1
+
+        with self.lock:
+            for start in range(0, len(pending), 400):
+                batch = pending[start:start + 400]
+                query = ("SELECT address, lat, lng FROM geocode WHERE address IN ("
+                         + ",".join([ "?" ] * len(batch)) + ")")
+                for key, lat, lng in self.db.execute(query, batch):
+                    found[key] = (lat, lng)
+                    self.lru.put(key, (lat, lng))
+                    self.disk_hits += 1
+        return found
+
+    def store(self, located):
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO geocode (address, lat, lng) VALUES (?, ?, ?)",
+                                [ (key, lat, lng) for key, (lat, lng) in located.items() ])
+            self.db.commit()
+        for key, location in located.items():
+            self.lru.put(key, location)
+
+    def geocode_many(self, addresses):
+        """
+        (lat, lng) for every address, in input order. Each distinct address is
+        resolved once; cache misses are fetched concurrently.
+        """
+        keys = [ normalize_address(address) for address in addresses ]
+        unique = list(dict.fromkeys(keys))
+        found = self.lookup(unique)
+
+        missing = [ key for key in unique if key not in found ]
+        self.misses += len(missing)
+        if missing:
+            if len(missing) == 1 or self.workers <= 1:
+                fetched = [ self.fetch(key) for key in missing ]
+            else:
+                with ThreadPoolExecutor(max_workers = min(self.workers, len(missing))) as pool:
+                    fetched = list(pool.map(self.fetch, missing))
+            located = dict(zip(missing, fetched))
+            self.store(located)
+            found.update(located)
+
+        return [ found[key] for key in keys ]
+
+    def geocode(self, address):
+
+        return self.geocode_many([ address ])[0]
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_ratio': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
+
+    def close(self):
+        with self.lock:
+            self.db.close()
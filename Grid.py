@@ -0,0 +1,109 @@
+"""
+
+ Sampling grids for map ingestion.
+
+ A grid is the set of integer offsets (i, j), |i|, |j| <= grid_size // 2,
+ kept by a shape mask (diamond, square or circle), turned by `rotation`
+ degrees, scaled by `spacing` meters and placed around a center point on
+ the local equirectangular approximation. Everything is computed on NumPy
+ arrays; large grids are produced row block by row block.
+
+ The parameters travel with the lattice as a spec dict (see grid_spec), so
+ the geometry can be inverted later.
+
+"""
+import numpy as np
+
+METERS_PER_DEGREE = 111320
+
+SHAPES = ('diamond', 'square', 'circle')
+
+DEFAULT_SPACING = 100 / 3.28084  # 100 feet in meters
+
+
+def grid_spec(center_lat, center_lon, grid_size = 20, spacing = DEFAULT_SPACING,
+              rotation = 45, shape = 'diamond'):
+    if shape not in SHAPES:
+        raise ValueError(f"unknown grid shape '{shape}', expected one of {SHAPES}")
+    return {
+        'center_lat': float(center_lat),
+        'center_lon': float(center_lon),
+        'grid_size': int(grid_size),
+        'spacing': float(spacing),
+        'rotation': float(rotation),
+        'shape': shape,
+        }
+
+
+def grid_indices(grid_size, shape = 'diamond', rows = None):
+    """
+    (i, j) int arrays of the grid offsets inside the shape, row-major.
+    rows (a range of i values) limits the result to those rows.
+    """
+    half = grid_size // 2
+    if rows is None:
+        rows = range(-half, half + 1)
+    i, j = np.meshgrid(np.arange(rows.start, rows.stop, dtype = np.int64),
+                       np.arange(-half, half + 1, dtype = np.int64), indexing = 'ij')
+    if shape == 'diamond':
+        mask = np.abs(i) + np.abs(j) <= half
+    elif shape == 'circle':
+        mask = i * i + j * j <= half * half
+    elif shape == 'square':
+        mask = np.ones(i.shape, dtype = bool)
+    else:
+        raise ValueError(f"unknown grid shape '{shape}', expected one of {SHAPES}")
+    return i[mask], j[mask]
+
+
+def grid_points(spec, i, j):
+    """
+    (lats, lons) of grid offsets (i, j) under spec.
+    """
+    theta = np.radians(spec['rotation'])
+    cos_t, sin_t = np.cos(theta), np.sin(theta)
+    i = np.asarray(i, dtype = np.float64) * spec['spacing']
+    j = np.asarray(j, dtype = np.float64) * spec['spacing']
+    north = i * cos_t - j * sin_t
+    east = i * sin_t + j * cos_t
+    lats = spec['center_lat'] + north / METERS_PER_DEGREE
+    lons = spec['center_lon'] + east / (METERS_PER_DEGREE * np.cos(np.radians(spec['center_lat'])))
+    return lats, lons
+
+
+def make_grid(center_lat, center_lon, grid_size = 20, spacing = DEFAULT_SPACING,
+              rotation = 45, shape = 'diamond'):
+    """
+    (lats, lons) float arrays of every grid point, row-major.
+    """
+    spec = grid_spec(center_lat, center_lon, grid_size, spacing, rotation, shape)
+    return grid_points(spec, *grid_indices(grid_size, shape))
+
+
+def iter_grid(spec, block_points = 1 << 20):
+    """
+    (lats, lons) arrays of the grid in row blocks of roughly block_points
+    points, so grids of 10k x 10k never sit in memory all at once.
+    """
+    half = spec['grid_size'] // 2
+    width = 2 * half + 1
+    step = max(1, block_points // width)
+    for start in range(-half, half + 1, step):
+        rows = range(start, min(start + step, half + 1))
+        i, j = grid_indices(spec['grid_size'], spec['shape'], rows)
+        if len(i):
+            yield grid_points(spec, i, j)
+
+
+def grid_coordinates(spec, lats, lons):
+    """
+    Fractional grid offsets (i, j) of points under spec; the inverse of
+    grid_points.
+    """
+    theta = np.radians(spec['rotation'])
+    cos_t, sin_t = np.cos(theta), np.sin(theta)
+    north = (np.asarray(lats, dtype = np.float64) - spec['center_lat']) * METERS_PER_DEGREE
+    east = ((np.asarray(lons, dtype = np.float64) - spec['center_lon'])
+            * METERS_PER_DEGREE * np.cos(np.radians(spec['center_lat'])))
+    return ((north * cos_t + east * sin_t) / spec['spacing'],
+            (east * cos_t - north * sin_t) / spec['spacing'])
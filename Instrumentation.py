@@ -0,0 +1,145 @@
+"""
+
+ Hot-path instrumentation for the lattice stack.
+
+ Counters are plain integer attributes bumped behind a single `enabled`
+ check; code that concurrent cursors run bumps them through add(), which
+ holds a lock so no update is lost between threads. Per-call timing is done by wrapping registered methods only while
+ timing is switched on, so a disabled run executes the original functions.
+
+   from mapsloader import Instrumentation as instr
+   instr.stats.enable(timing = True)
+   ...
+   print(instr.stats.snapshot())
+
+"""
+import time
+import functools
+import threading
+
+COUNTERS = ( 'head_moves', 'window_rebuilds', 'dbits_allocated',
+             'inserts', 'prunes', 'links', 'scaffolds_reclaimed' )
+
+# histogram buckets are powers of two in nanoseconds: bucket b holds calls
+# that took [2**b, 2**(b+1)) ns
+HISTOGRAM_BUCKETS = 40
+
+
+class Timing:
+
+    __slots__ = ('calls', 'total', 'buckets')
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.calls = 0
+        self.total = 0
+        self.buckets = [0] * HISTOGRAM_BUCKETS
+
+    def record(self, elapsed_ns):
+        self.calls += 1
+        self.total += elapsed_ns
+        bucket = elapsed_ns.bit_length() - 1 if elapsed_ns > 0 else 0
+        self.buckets[min(bucket, HISTOGRAM_BUCKETS - 1)] += 1
+
+    def snapshot(self):
+        return {
+            'calls': self.calls,
+            'total_s': self.total / 1e9,
+            'mean_us': self.total / self.calls / 1e3 if self.calls else 0.0,
+            'histogram_ns': { 2 ** b: n for b, n in enumerate(self.buckets) if n },
+        }
+
+
+class Instrumentation:
+
+    def __init__(self):
+        self.enabled = False
+        self.timing = False
+        self.registered = []
+        self.originals = {}
+        self.timings = {}
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        for name in COUNTERS:
+            setattr(self, name, 0)
+        # the timing wrappers hold on to their Timing, clear them in place
+        for timing in self.timings.values():
+            timing.clear()
+
+    def add(self, **counts):
+        """
+        Bump several counters at once, safely from any thread.
+        """
+        with self.lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def register(self, cls, names):
+        """
+        Declare methods of cls that get per-call timing while timing is on.
+        """
+        self.registered.append((cls, tuple(names)))
+        if self.timing:
+            self.wrap(cls, names)
+
+    def wrap(self, cls, names):
+        for name in names:
+            key = (cls, name)
+            if key in self.originals:
+                continue
+            original = cls.__dict__[name]
+            label = cls.__name__ + '.' + name
+            timing = self.timings.setdefault(label, Timing())
+
+            def timed(*args, _original = original, _timing = timing, **kwargs):
+                start = time.perf_counter_ns()
+                try:
+                    return _original(*args, **kwargs)
+                finally:
+                    _timing.record(time.perf_counter_ns() - start)
+
+            functools.update_wrapper(timed, original)
+            self.originals[key] = original
+            setattr(cls, name, timed)
+
+    def unwrap(self):
+        for (cls, name), original in self.originals.items():
+            setattr(cls, name, original)
+        self.originals = {}
+
+    def enable(self, timing = False):
+        self.enabled = True
+        self.timing = timing
+        if timing:
+            for cls, names in self.registered:
+                self.wrap(cls, names)
+        else:
+            self.unwrap()
+
+    def disable(self):
+        self.enabled = False
+        self.timing = False
+        self.unwrap()
+
+    def snapshot(self):
+        return {
+            'enabled': self.enabled,
+            'counters': { name: getattr(self, name) for name in COUNTERS },
+            'timings': { name: timing.snapshot()
+                         for name, timing in self.timings.items() if timing.calls },
+        }
+
+    def report(self):
+        snap = self.snapshot()
+        lines = [ f"{name:>16s}: {value}" for name, value in snap['counters'].items() ]
+        for name, timing in sorted(snap['timings'].items(), key = lambda t: -t[1]['total_s']):
+            lines.append(f"{name:>40s}: {timing['calls']:10d} calls "
+                         f"{timing['total_s']:10.4f} s {timing['mean_us']:10.2f} us/call")
+        return "\n".join(lines)
+
+
+stats = Instrumentation()
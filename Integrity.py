@@ -0,0 +1,274 @@
+"""
+
+ Link integrity checks for AlgorithmicMemory.
+
+ Every test is a closed walk from a cell's root DBit around one plaquette
+ of two axes (e.g. lbit0.x.other.y.x.other.y.dbit) that has to come back
+ to the DBit it started from; 'other' turns around on the root of the cell
+ it is in. A walk that runs into a missing neighbor (None) is skipped, one
+ that reaches an attribute that is not there is 'broken', one that closes
+ on another DBit is a 'mismatch'. Each cell's neighbor links ('link') and
+ its stack of data DBits ('stack') are checked on their own.
+
+ The walks only ever leave a cell by one step on each of two axes, so a
+ change at a cell can only break the tests of cells within one step of it.
+ That is what incremental checks re-verify. Full checks can be split by
+ chunk over forked worker processes, which see the lattice copy-on-write.
+
+"""
+import os
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+def make_tests():
+    """
+    The walk of every test as a tuple of attribute names.
+    """
+    tests = []
+    for a1 in ('x', 'y', 'z'):
+        for a2 in ('x', 'y', 'z'):
+            if a1 == a2:
+                continue
+            for start in ('lbit0', 'lbit1'):
+                tests.append((start, a1, 'other', a2, a1, 'other', a2, 'dbit'))
+            for start in ('lbit0', 'lbit1'):
+                tests.append((start, a1, a2, 'other', a1, a2, 'dbit'))
+    return tuple(tests)
+
+
+TESTS = make_tests()
+
+NEIGHBORHOOD = tuple((dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1))
+
+
+class IntegrityFailure:
+
+    __slots__ = ('coords', 'test', 'reason', 'step')
+
+    def __init__(self, coords, test, reason, step = None):
+        self.coords = coords    # (x, y, z) of the root DBit the walk started from
+        self.test = test        # the walk, a tuple of attribute names
+        self.reason = reason    # 'broken', 'mismatch', 'link' or 'stack'
+        self.step = step        # attribute that was missing, for 'broken'
+
+    def __repr__(self):
+        return f"IntegrityFailure({self.coords}, {'.'.join(self.test)}, {self.reason})"
+
+
+class IntegrityReport:
+
+    def __init__(self, cells = 0, walks = 0, skipped = 0, failures = None, seconds = 0.0):
+        self.cells = cells          # root DBits checked
+        self.walks = walks          # walks that closed on some DBit
+        self.skipped = skipped      # walks cut short by a missing neighbor
+        self.failures = [] if failures is None else failures
+        self.seconds = seconds
+
+    @property
+    def ok(self):
+        return not self.failures
+
+    def merge(self, other):
+        self.cells += other.cells
+        self.walks += other.walks
+        self.skipped += other.skipped
+        self.failures.extend(other.failures)
+        return self
+
+    def failed_cells(self):
+        return sorted({ failure.coords for failure in self.failures })
+
+    def as_dict(self):
+        return {
+            'ok': self.ok,
+            'cells': self.cells,
+            'walks': self.walks,
+            'skipped': self.skipped,
+            'failures': [ { 'coords': list(failure.coords), 'test': '.'.join(failure.test),
+                            'reason': failure.reason, 'step': failure.step }
+                          for failure in self.failures ],
+            'seconds': self.seconds,
+            }
+
+    def raise_for_failures(self, error):
+        """
+        Raise error (e.g. AlgorithmicMemory.IntegrityError) on the first failure.
+        """
+        if self.failures:
+            failure = self.failures[0]
+            raise error(f"[{failure.step or failure.reason}] in: {failure.coords}."
+                        + ".".join(failure.test)
+                        + f" ({len(self.failures)} failures in {len(self.failed_cells())} cells)")
+
+    def __repr__(self):
+        return (f"IntegrityReport(ok={self.ok}, cells={self.cells}, walks={self.walks}, "
+                f"skipped={self.skipped}, failures={len(self.failures)})")
+
+
+def flip(lbit):
+    """
+    The other LBit of lbit's own DBit. Walks turn around on the cell's root
+    rather than following lbit.other, which leads into the cell's stack.
+    """
+    dbit = lbit.dbit
+    return dbit.lbit1 if lbit is dbit.lbit0 else dbit.lbit0
+
+
+def foreign(dbits, dbit):
+    """
+    Whether dbit is a cell of another lattice than the one indexed by dbits,
+    e.g. across a TiledWorld seam, where it has its own local coordinates.
+    """
+    return dbits is not None and dbits.get((dbit.x, dbit.y, dbit.z)) is not dbit
+
+
+def crosses(dbits, subject, test):
+    """
+    Whether the walk of test from subject passes through another lattice.
+    """
+    obj = subject
+    for step in test[:-1]:
+        obj = flip(obj) if step == 'other' else getattr(obj, step)
+        if foreign(dbits, obj.dbit):
+            return True
+    return False
+
+
+def check_links(coords, root, failures, dbits = None):
+    """
+    Every neighbor link of root must be mutual and lead to the adjacent
+    cell. With dbits (root's lattice), links into another lattice are only
+    checked for being mutual: its cells have coordinates of their own.
+    """
+    x, y, z = coords
+    for axis, up in (('x', (x + 1, y, z)), ('y', (x, y + 1, z)), ('z', (x, y, z + 1))):
+        neighbor = getattr(root.lbit1, axis)
+        if neighbor is not None:
+            dbit = neighbor.dbit
+            if (getattr(neighbor, axis) is not root.lbit1 or neighbor is not dbit.lbit0
+                    or ((dbit.x, dbit.y, dbit.z) != up and not foreign(dbits, dbit))):
+                failures.append(IntegrityFailure(coords, ('lbit1', axis), 'link'))
+        neighbor = getattr(root.lbit0, axis)
+        if neighbor is not None and getattr(neighbor, axis) is not root.lbit0:
+            failures.append(IntegrityFailure(coords, ('lbit0', axis), 'link'))
+
+
+def check_stack(coords, root, failures, limit):
+    """
+    The stack above root must be two parallel "other" chains whose x links
+    point back down, one DBit per level, ending in a top whose LBits point
+    at each other.
+    """
+    below0, below1 = root.lbit0, root.lbit1
+    for _ in range(limit):
+        above0, above1 = below0.other, below1.other
+        if above0 is below1 and above1 is below0:
+            return
+        if (above0 is None or above1 is None or above0.x is not below0 or above1.x is not below1
+                or above0.dbit is not above1.dbit):
+            failures.append(IntegrityFailure(coords, ('other',), 'stack'))
+            return
+        below0, below1 = above0, above1
+    failures.append(IntegrityFailure(coords, ('other',), 'stack'))
+
+
+def check_cells(items, report = None, limit = 1 << 20, dbits = None):
+    """
+    Run every test, and the stack check, from each (coords, root DBit) of
+    items. limit bounds the stack walk so a cycle cannot hang the check.
+    dbits is the lattice the items belong to: with it, links and walks
+    into another lattice (a TiledWorld seam) are not held to its coordinates.
+    """
+    if report is None:
+        report = IntegrityReport()
+    failures = report.failures
+    cells = walks = skipped = 0
+    for coords, subject in items:
+        cells += 1
+        for test in TESTS:
+            obj = subject
+            try:
+                for step in test:
+                    obj = flip(obj) if step == 'other' else getattr(obj, step)
+                    if obj is None:
+                        break
+            except AttributeError:
+                failures.append(IntegrityFailure(coords, test, 'broken', step))
+                continue
+            if obj is None:
+                skipped += 1
+                continue
+            if obj is not subject and dbits is not None and crosses(dbits, subject, test):
+                # lattices meeting at a seam each have their own cells
+                # around their origin; walks across it are not checked
+                skipped += 1
+                continue
+            walks += 1
+            if obj is not subject:
+                failures.append(IntegrityFailure(coords, test, 'mismatch'))
+        try:
+            check_links(coords, subject, failures, dbits)
+            check_stack(coords, subject, failures, limit)
+        except AttributeError as e:
+            failures.append(IntegrityFailure(coords, (), 'broken', e.name))
+    report.cells += cells
+    report.walks += walks
+    report.skipped += skipped
+    return report
+
+
+def neighborhood(dbits, touched):
+    """
+    (coords, root DBit) of the existing cells within one step of any touched cell.
+    """
+    cells = set()
+    for x, y, z in touched:
+        for dx, dy, dz in NEIGHBORHOOD:
+            cells.add((x + dx, y + dy, z + dz))
+    items = []
+    for coords in sorted(cells):
+        dbit = dbits.get(coords)
+        if dbit is not None:
+            items.append((coords, dbit))
+    return items
+
+
+# the AlgorithmicMemory a forked worker checks, set just before the pool forks
+forked_memory = None
+
+
+def check_chunks(keys):
+    dbits = forked_memory.dbits
+    report = IntegrityReport()
+    for key in keys:
+        check_cells(dbits.iter_chunk(key), report, dbits = dbits)
+    return report
+
+
+def check_parallel(memory, workers = None, chunks_per_task = 16):
+    """
+    Full check of memory split by chunk across forked worker processes.
+    Runs in this process when fork is not available or one worker is asked for.
+    """
+    global forked_memory
+    start = time.perf_counter()
+    keys = sorted(memory.dbits.chunk_keys())
+    tasks = [ keys[i:i + chunks_per_task] for i in range(0, len(keys), chunks_per_task) ]
+    workers = workers or os.cpu_count() or 1
+
+    report = IntegrityReport()
+    if workers == 1 or len(tasks) <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+        check_cells(memory.dbits.items(), report, dbits = memory.dbits)
+    else:
+        forked_memory = memory
+        try:
+            with ProcessPoolExecutor(max_workers = workers,
+                                     mp_context = multiprocessing.get_context('fork')) as pool:
+                for part in pool.map(check_chunks, tasks):
+                    report.merge(part)
+        finally:
+            forked_memory = None
+    report.seconds = time.perf_counter() - start
+    return report
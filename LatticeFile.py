@@ -0,0 +1,423 @@
+"""
+
+ Single-file columnar lattice format.
+
+ A lattice file is a small JSON header followed by contiguous, 64-byte aligned
+ typed arrays:
+
+   MAGIC (4 bytes) | version (uint32) | header length (uint64) | header JSON
+   | array | array | ...
+
+ The header records the lattice origin, the row count and, for every array,
+ its dtype, shape and byte offset. Rows are sorted by packed chunk key and
+ then by (x, y, z), so all vertices of a chunk are one contiguous run.
+
+ Columns:
+   coords    int64 (n, 3)     AlgorithmicMemory coordinates
+   chunk     int64 (n,)       packed chunk key of each row
+   tr        int64 (n, 2)     lbit0 / lbit1 TimeRoot ids
+   links     int64 (n, 2, 4)  TimeRoot ids behind lbit0/lbit1 .x .y .z .other,
+                              -1 where the link is None
+   payload/<key>              one column per payload key when every payload is
+                              a dict with the same scalar keys, strings stored
+                              as int32 codes into header categories
+   payload_pickle uint8       a single pickled list otherwise
+
+ Incremental saves go to a journal next to the file: append-only records,
+ each a lattice image of the DBits added since the previous save plus the
+ TimeRoot ids and coordinates of removed ones (deleted_tr, deleted_coords).
+ Records carry the generation of the base file they apply to, so a journal
+ left behind by an interrupted compaction is ignored.
+
+"""
+import io
+import os
+import json
+import pickle
+import numpy as np
+from mapsloader import ChunkIndex as ci
+
+MAGIC = b'MLAT'
+VERSION = 1
+ALIGN = 64
+PREAMBLE = 16
+
+
+class LatticeFormatError(Exception):
+    """Exception raised for unreadable lattice files."""
+
+    def __init__(self, message="Malformed lattice file"):
+        self.message = message
+        super().__init__(self.message)
+
+
+def align(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def tr_of(lbit):
+    return -1 if lbit is None else lbit.tr.tr
+
+
+def dbit_columns(dbits):
+    """
+    Coordinate, TimeRoot and link columns for a list of DBits, plus their payloads.
+    """
+    n = len(dbits)
+    coords = np.empty((n, 3), dtype = np.int64)
+    trs = np.empty((n, 2), dtype = np.int64)
+    links = np.empty((n, 2, 4), dtype = np.int64)
+    payload = []
+    for row, dbit in enumerate(dbits):
+        lbit0 = dbit.lbit0
+        lbit1 = dbit.lbit1
+        coords[row] = (dbit.x, dbit.y, dbit.z)
+        trs[row] = (lbit0.tr.tr, lbit1.tr.tr)
+        links[row, 0] = (tr_of(lbit0.x), tr_of(lbit0.y), tr_of(lbit0.z), tr_of(lbit0.other))
+        links[row, 1] = (tr_of(lbit1.x), tr_of(lbit1.y), tr_of(lbit1.z), tr_of(lbit1.other))
+        payload.append(lbit0.data)
+    return { 'coords': coords, 'tr': trs, 'links': links }, payload
+
+
+def column_kind(values):
+    if all(isinstance(v, str) for v in values):
+        return 'str'
+    if all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+        return 'int'
+    if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+        return 'float'
+    return None
+
+
+def encode_payload(payload):
+    """
+    Split payloads into typed columns. Returns (arrays, spec) where spec goes
+    into the header and tells decode_payload how to put the rows back together.
+    """
+    keys = None
+    if payload and all(isinstance(p, dict) for p in payload):
+        keys = list(payload[0].keys())
+        if any(list(p.keys()) != keys for p in payload):
+            keys = None
+
+    if keys is not None:
+        arrays = {}
+        columns = []
+        for key in keys:
+            values = [ p[key] for p in payload ]
+            kind = column_kind(values)
+            if kind is None:
+                break
+            if kind == 'str':
+                categories, codes = np.unique(np.array(values, dtype = object).astype(str),
+                                              return_inverse = True)
+                arrays['payload/' + key] = codes.astype(np.int32)
+                columns.append({ 'key': key, 'kind': kind, 'categories': categories.tolist() })
+            else:
+                arrays['payload/' + key] = np.array(values, dtype = np.int64 if kind == 'int'
+                                                    else np.float64)
+                columns.append({ 'key': key, 'kind': kind })
+        else:
+            return arrays, { 'kind': 'columns', 'columns': columns }
+
+    blob = np.frombuffer(pickle.dumps(list(payload), protocol = pickle.HIGHEST_PROTOCOL),
+                         dtype = np.uint8)
+    return { 'payload_pickle': blob }, { 'kind': 'pickle' }
+
+
+def decode_payload(arrays, spec, rows = slice(None)):
+    """
+    Rebuild the payload list (optionally only for `rows`) from encode_payload output.
+    """
+    if spec['kind'] == 'pickle':
+        payload = pickle.loads(arrays['payload_pickle'].tobytes())
+        if isinstance(rows, slice):
+            return payload[rows]
+        return [ payload[row] for row in np.asarray(rows).tolist() ]
+
+    keys = []
+    columns = []
+    for column in spec['columns']:
+        values = np.asarray(arrays['payload/' + column['key']][rows])
+        if column['kind'] == 'str':
+            values = np.array(column['categories'], dtype = object)[values]
+        keys.append(column['key'])
+        columns.append(values.tolist())
+    return [ dict(zip(keys, row)) for row in zip(*columns) ]
+
+
+def sort_rows(coords):
+    """
+    Row order of the file: by packed chunk key, then x, y, z.
+    """
+    chunk = ci.pack_chunk_keys(coords)
+    order = np.lexsort((coords[:, 2], coords[:, 1], coords[:, 0], chunk))
+    return order, chunk[order]
+
+
+def encode_dbits(dbits):
+    """
+    All file columns for a list of DBits, rows in file order. Returns (arrays, payload spec).
+    The DBits of a cell have to come bottom of the stack first; sorting keeps their order.
+    """
+    arrays, payload = dbit_columns(dbits)
+    order, chunk = sort_rows(arrays['coords'])
+    arrays = { name: array[order] for name, array in arrays.items() }
+    arrays['chunk'] = chunk
+    payload_arrays, payload_spec = encode_payload([ payload[i] for i in order.tolist() ])
+    arrays.update(payload_arrays)
+    return arrays, payload_spec
+
+
+def dump(file, arrays, meta):
+    """
+    Stream one lattice image (preamble, header, arrays) into an open binary file.
+    """
+    layout = {}
+    offset = 0
+    for name in arrays:
+        array = arrays[name] = np.ascontiguousarray(arrays[name])
+        layout[name] = { 'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset }
+        offset = align(offset + array.nbytes)
+
+    header = dict(meta)
+    header['version'] = VERSION
+    header['arrays'] = layout
+    encoded = json.dumps(header).encode('utf-8')
+    data_start = align(PREAMBLE + len(encoded))
+
+    file.write(MAGIC)
+    file.write(np.array([VERSION], dtype = '<u4').tobytes())
+    file.write(np.array([data_start - PREAMBLE], dtype = '<u8').tobytes())
+    file.write(encoded)
+    file.write(b'\0' * (data_start - PREAMBLE - len(encoded)))
+    position = data_start
+    for name, array in arrays.items():
+        start = data_start + layout[name]['offset']
+        file.write(b'\0' * (start - position))
+        file.write(array.tobytes())
+        position = start + array.nbytes
+
+
+def write_lattice(path, arrays, meta):
+    """
+    Write arrays (name -> ndarray) and a JSON-able meta dict to path. The file
+    is written next to path and renamed into place.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        dump(file, arrays, meta)
+    os.replace(tmp_path, path)
+
+
+def parse_header(preamble, body):
+    if len(preamble) != PREAMBLE or preamble[:4] != MAGIC:
+        raise LatticeFormatError("not a lattice file")
+    version = int(np.frombuffer(preamble[4:8], dtype = '<u4')[0])
+    if version > VERSION:
+        raise LatticeFormatError(f"unsupported lattice file version {version}")
+    header = json.loads(bytes(body).rstrip(b'\0').decode('utf-8'))
+    return header
+
+
+def header_length(preamble):
+    return int(np.frombuffer(preamble[8:16], dtype = '<u8')[0])
+
+
+def read_header(file):
+    preamble = file.read(PREAMBLE)
+    length = header_length(preamble) if len(preamble) == PREAMBLE else 0
+    header = parse_header(preamble, file.read(length))
+    header['data_start'] = PREAMBLE + length
+    return header
+
+
+def parse(buffer, base = 0):
+    """
+    Decode a lattice image that starts at byte `base` of buffer. The arrays
+    are views into buffer.
+    """
+    preamble = bytes(buffer[base:base + PREAMBLE])
+    length = header_length(preamble) if len(preamble) == PREAMBLE else 0
+    header = parse_header(preamble, buffer[base + PREAMBLE:base + PREAMBLE + length])
+    header['data_start'] = PREAMBLE + length
+
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        dtype = np.dtype(spec['dtype'])
+        shape = tuple(spec['shape'])
+        count = int(np.prod(shape)) if shape else 1
+        offset = base + header['data_start'] + spec['offset']
+        arrays[name] = np.frombuffer(buffer, dtype = dtype, count = count,
+                                     offset = offset).reshape(shape)
+    return header, arrays
+
+
+def read_lattice(path, mmap = False):
+    """
+    Returns (header, arrays). With mmap the arrays are read-only np.memmap
+    views into the file, otherwise the whole file is read in one go.
+    """
+    if not mmap:
+        with open(path, 'rb') as file:
+            return parse(file.read())
+
+    with open(path, 'rb') as file:
+        header = read_header(file)
+
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        dtype = np.dtype(spec['dtype'])
+        shape = tuple(spec['shape'])
+        offset = header['data_start'] + spec['offset']
+        if int(np.prod(shape)) == 0:
+            arrays[name] = np.empty(shape, dtype = dtype)
+        else:
+            arrays[name] = np.memmap(path, dtype = dtype, mode = 'r', offset = offset, shape = shape)
+    return header, arrays
+
+
+# Journal: an append-only sequence of records, each one a lattice image
+# prefixed by JOURNAL_MAGIC and its byte length.
+JOURNAL_MAGIC = b'MLJR'
+
+
+def append_journal(path, arrays, meta):
+    buffer = io.BytesIO()
+    dump(buffer, arrays, meta)
+    record = buffer.getvalue()
+    with open(path, 'ab') as file:
+        file.write(JOURNAL_MAGIC)
+        file.write(np.array([len(record)], dtype = '<u8').tobytes())
+        file.write(record)
+        file.flush()
+        os.fsync(file.fileno())
+    return len(record) + 12
+
+
+def read_journal(path):
+    """
+    All complete records of a journal as a list of (header, arrays). A torn
+    record at the tail (interrupted append) is ignored.
+    """
+    try:
+        with open(path, 'rb') as file:
+            buffer = file.read()
+    except FileNotFoundError:
+        return []
+
+    records = []
+    position = 0
+    while position + 12 <= len(buffer):
+        if buffer[position:position + 4] != JOURNAL_MAGIC:
+            raise LatticeFormatError(f"bad journal record at byte {position}")
+        length = int(np.frombuffer(buffer[position + 4:position + 12], dtype = '<u8')[0])
+        if position + 12 + length > len(buffer):
+            break
+        records.append(parse(buffer, position + 12))
+        position += 12 + length
+    return records
+
+
+def decode_dbit_files(paths):
+    """
+    Decode a batch of per-DBit pickle files written by WorldLattice.serialize
+    into (coords, payload, trs). Module level so process pools can run it.
+    """
+    coords = []
+    trs = []
+    payload = []
+    for path in paths:
+        with open(path, 'rb') as file:
+            x = pickle.load(file)
+            y = pickle.load(file)
+            z = pickle.load(file)
+            lbit0tr = pickle.load(file)
+            lbit0data = pickle.load(file)
+            for _ in range(4):
+                pickle.load(file)   # lbit0 x, y, z, other
+            lbit1tr = pickle.load(file)
+        coords.append((x, y, z))
+        trs.append((lbit0tr, lbit1tr))
+        payload.append(lbit0data)
+    return (np.array(coords, dtype = np.int64).reshape(-1, 3), payload,
+            np.array(trs, dtype = np.int64).reshape(-1, 2))
+
+
+def decode_lattice_file(path):
+    """
+    Read and decode a lattice file into (header, coords, payload, trs, extra),
+    extra holding the LOD pyramid arrays.
+    """
+    header, arrays = read_lattice(path)
+    extra = { name: values for name, values in arrays.items() if name.startswith('lod/') }
+    return header, arrays['coords'], decode_payload(arrays, header['payload']), arrays['tr'], extra
+
+
+class MappedLattice:
+    """
+    Read-only memory-mapped view of a lattice file. Nothing but the header is
+    read up front; chunk rows are located with a binary search over the
+    sorted chunk column and decoded on demand.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.header, self.arrays = read_lattice(path, mmap = True)
+        self.count = self.header['count']
+        self.loaded = set()
+        # pickled payloads are one blob: unpickled on the first fault, kept
+        self.pickled = None
+
+    def chunk_rows(self, packed):
+        chunk = self.arrays['chunk']
+        return slice(int(np.searchsorted(chunk, packed, 'left')),
+                     int(np.searchsorted(chunk, packed, 'right')))
+
+    def take(self, key):
+        """
+        Rows of chunk `key` not handed out yet, as (coords, payload, trs).
+        Returns None once the chunk has been taken (or holds no rows).
+        """
+        packed = ci.pack_chunk_key(key)
+        if packed in self.loaded:
+            return None
+        self.loaded.add(packed)
+        rows = self.chunk_rows(packed)
+        if rows.start == rows.stop:
+            return None
+        return (np.array(self.arrays['coords'][rows]), self.payload(rows),
+                np.array(self.arrays['tr'][rows]))
+
+    def payload(self, rows):
+
+        spec = self.header['payload']
+        if spec['kind'] != 'pickle':
+            return decode_payload(self.arrays, spec, rows)
+        if self.pickled is None:
+            self.pickled = decode_payload(self.arrays, spec)
+        if isinstance(rows, slice):
+            return self.pickled[rows]
+        return [ self.pickled[row] for row in np.asarray(rows).tolist() ]
+
+    def column_rows(self, x0, y0, x1, y1):
+        """
+        Rows of the chunks over the inclusive x / y box x0..x1, y0..y1 at any
+        z. Rows are sorted by packed chunk key, x major, so the chunks of one
+        chunk column along x are one range of rows.
+        """
+        chunk = self.arrays['chunk']
+        if not len(chunk):
+            return np.zeros(0, dtype = np.int64)
+        (kx0, ky0, _), (kx1, ky1, _) = ci.chunk_key(x0, y0, 0), ci.chunk_key(x1, y1, 0)
+        kx0 = max(kx0, ci.unpack_chunk_key(int(chunk[0]))[0])
+        kx1 = min(kx1, ci.unpack_chunk_key(int(chunk[-1]))[0])
+        ranges = [ np.zeros(0, dtype = np.int64) ]
+        for kx in range(kx0, kx1 + 1):
+            start = np.searchsorted(chunk, ci.pack_chunk_key((kx, ky0, -ci.PACK_BIAS)))
+            stop = np.searchsorted(chunk, ci.pack_chunk_key((kx, ky1 + 1, -ci.PACK_BIAS)))
+            ranges.append(np.arange(start, stop))
+        return np.concatenate(ranges)
+
+    def chunk_keys(self):
+        return [ ci.unpack_chunk_key(int(packed)) for packed in np.unique(self.arrays['chunk']) ]
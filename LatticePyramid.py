@@ -0,0 +1,167 @@
+"""
+
+ Level-of-detail pyramid over a lattice.
+
+ Level L groups the vertices of the lattice into 2^L x 2^L columns of
+ (x, y) cells and keeps, per non-empty cell, the minimum, maximum, sum and
+ count of their altitudes. Level 1 is reduced from the vertices, every
+ further level from the one below, all with sorted-key reduceat passes.
+
+ Inserts are queued and folded into every level on the next read, so the
+ pyramid stays in sync at the cost of one vectorized merge per batch of
+ inserts. Removals cannot be folded out of a min / max; they make the
+ owner rebuild instead.
+
+"""
+import numpy as np
+
+LEVELS = 8
+
+# cell keys: x and y (each within +-2^30) as the two 32-bit halves of one int64
+CELL_BIAS = 1 << 30
+CELL_MASK = (1 << 32) - 1
+
+
+def pack_cells(x, y):
+    return ((np.asarray(x, dtype = np.int64) + CELL_BIAS) << 32) | (np.asarray(y, dtype = np.int64) + CELL_BIAS)
+
+
+def unpack_cells(cells):
+    return (cells >> 32) - CELL_BIAS, (cells & CELL_MASK) - CELL_BIAS
+
+
+def reduce_cells(cells, alt_min, alt_max, alt_sum, count):
+    """
+    Merge rows with equal cell keys. Returns the level columns sorted by cell.
+    """
+    order = np.argsort(cells, kind = 'stable')
+    cells = cells[order]
+    if len(cells) == 0:
+        return { 'cell': cells, 'min': alt_min[order], 'max': alt_max[order],
+                 'sum': alt_sum[order], 'count': count[order] }
+    starts = np.flatnonzero(np.concatenate([ [ True ], cells[1:] != cells[:-1] ]))
+    return {
+        'cell': cells[starts],
+        'min': np.minimum.reduceat(alt_min[order], starts),
+        'max': np.maximum.reduceat(alt_max[order], starts),
+        'sum': np.add.reduceat(alt_sum[order], starts),
+        'count': np.add.reduceat(count[order], starts),
+        }
+
+
+def coarsen(level):
+    """
+    The next level up: every cell key halved on both axes, then merged.
+    """
+    x, y = unpack_cells(level['cell'])
+    return reduce_cells(pack_cells(x >> 1, y >> 1), level['min'], level['max'],
+                        level['sum'], level['count'])
+
+
+def merge_levels(a, b):
+
+    return reduce_cells(*[ np.concatenate([ a[name], b[name] ])
+                           for name in ('cell', 'min', 'max', 'sum', 'count') ])
+
+
+class LatticePyramid:
+
+    def __init__(self, levels = LEVELS):
+        self.depth = levels
+        # self.levels[L - 1] is level L
+        self.levels = []
+        self.pending = []
+        # owner's removal count this pyramid reflects
+        self.removed = 0
+
+    def build(self, x, y, alt):
+        """
+        Levels 1 .. depth for vertex columns x, y and altitudes alt.
+        """
+        self.levels = self.reduce_points(x, y, alt)
+        self.pending = []
+        return self
+
+    def reduce_points(self, x, y, alt):
+        alt = np.asarray(alt, dtype = np.float64)
+        level = reduce_cells(pack_cells(np.asarray(x, dtype = np.int64) >> 1,
+                                        np.asarray(y, dtype = np.int64) >> 1),
+                             alt, alt, alt, np.ones(len(alt), dtype = np.int64))
+        levels = [ level ]
+        for _ in range(self.depth - 1):
+            level = coarsen(level)
+            levels.append(level)
+        return levels
+
+    def add(self, x, y, alt):
+        """
+        Queue inserted vertices; they are folded in on the next read.
+        """
+        self.pending.append((np.atleast_1d(np.asarray(x, dtype = np.int64)),
+                             np.atleast_1d(np.asarray(y, dtype = np.int64)),
+                             np.atleast_1d(np.asarray(alt, dtype = np.float64))))
+
+    def flush(self):
+        if not self.pending:
+            return self
+        x, y, alt = [ np.concatenate(column) for column in zip(*self.pending) ]
+        self.pending = []
+        added = self.reduce_points(x, y, alt)
+        if not self.levels:
+            self.levels = added
+        else:
+            self.levels = [ merge_levels(level, new) for level, new in zip(self.levels, added) ]
+        return self
+
+    def level_for(self, resolution):
+        """
+        The coarsest level whose cells (2^L lattice units) are no wider than
+        resolution; 0 means the vertices themselves.
+        """
+        if resolution is None or resolution < 2:
+            return 0
+        return int(min(self.depth, np.floor(np.log2(resolution))))
+
+    def cells(self, level, box = None):
+        """
+        Columns of one level (1 .. depth): x, y of each cell's lower corner in
+        lattice units, and min / max / mean altitude and vertex count. box
+        (x0, y0, x1, y1), inclusive and in lattice units, keeps the cells
+        overlapping it.
+        """
+        self.flush()
+        columns = self.levels[level - 1]
+        x, y = unpack_cells(columns['cell'])
+        x = x << level
+        y = y << level
+        keep = slice(None)
+        if box is not None:
+            x0, y0, x1, y1 = box
+            size = 1 << level
+            keep = (x + size > x0) & (x <= x1) & (y + size > y0) & (y <= y1)
+        return {
+            'level': level,
+            'x': x[keep],
+            'y': y[keep],
+            'min': columns['min'][keep],
+            'max': columns['max'][keep],
+            'mean': columns['sum'][keep] / columns['count'][keep],
+            'count': columns['count'][keep],
+            }
+
+    def arrays(self):
+        """
+        The levels as named arrays for a lattice file.
+        """
+        self.flush()
+        return { f"lod/{level}/{name}": values
+                 for level, columns in enumerate(self.levels, 1)
+                 for name, values in columns.items() }
+
+    @staticmethod
+    def from_arrays(arrays, depth):
+        pyramid = LatticePyramid(depth)
+        pyramid.levels = [ { name: arrays[f"lod/{level}/{name}"]
+                             for name in ('cell', 'min', 'max', 'sum', 'count') }
+                           for level in range(1, depth + 1) ]
+        return pyramid
@@ -0,0 +1,238 @@
+"""
+
+ Spatial queries over lattice vertices by their GPS position.
+
+ GridIndex buckets the (lat, lon) of every vertex on a uniform grid laid over
+ a local equirectangular projection (meters), sized for about bucket_size
+ vertices per bucket. Vertices are sorted by bucket, so a bucket is one
+ slice of the sorted arrays (CSR layout) and a row of buckets is one
+ contiguous slice too.
+
+ Both queries take arrays and answer them together:
+
+   box(lat0, lon0, lat1, lon1)   all vertices inside each box
+   nearest(lats, lons, k)        the k nearest vertices of each point,
+                                 searched in growing rings of buckets until
+                                 the k-th distance is provably final
+
+"""
+import numpy as np
+
+METERS_PER_DEGREE = 111320
+
+# nearest() works through the query points this many at a time
+QUERY_BLOCK = 16384
+
+# ring_search() ranks about this many candidates at a time at most
+CANDIDATE_BLOCK = 1 << 20
+
+
+class GridIndex:
+
+    def __init__(self, lats, lons, alts, coords, bucket_size = 4):
+        lats = np.asarray(lats, dtype = np.float64)
+        lons = np.asarray(lons, dtype = np.float64)
+        self.count = len(lats)
+
+        self.ref_lat = float(np.mean(lats)) if self.count else 0.0
+        self.lon_scale = METERS_PER_DEGREE * np.cos(np.radians(self.ref_lat))
+        x, y = self.project(lats, lons)
+
+        if self.count:
+            self.x0, self.y0 = float(x.min()), float(y.min())
+            width = max(float(x.max()) - self.x0, 1e-9)
+            height = max(float(y.max()) - self.y0, 1e-9)
+        else:
+            self.x0 = self.y0 = 0.0
+            width = height = 1.0
+        # square buckets holding about bucket_size vertices each
+        self.cell = max(np.sqrt(width * height * bucket_size / max(self.count, 1)),
+                        max(width, height) / 4096, 1e-6)
+        self.nx = int(width // self.cell) + 1
+        self.ny = int(height // self.cell) + 1
+
+        bucket = self.bucket_of(x, y)
+        order = np.argsort(bucket, kind = 'stable')
+        self.order = order
+        self.x = x[order]
+        self.y = y[order]
+        self.lat = lats[order]
+        self.lon = lons[order]
+        self.alt = np.asarray(alts, dtype = np.float64)[order]
+        self.coords = np.asarray(coords, dtype = np.int64).reshape(-1, 3)[order]
+        # vertices of bucket b are self.x[starts[b]:starts[b + 1]]
+        self.starts = np.searchsorted(bucket[order], np.arange(self.nx * self.ny + 1))
+        # vertices in buckets (0..i-1, 0..j-1) are prefix[i, j]
+        self.prefix = np.zeros((self.nx + 1, self.ny + 1), dtype = np.int64)
+        self.prefix[1:, 1:] = np.diff(self.starts).reshape(self.nx, self.ny).cumsum(0).cumsum(1)
+
+    def project(self, lats, lons):
+
+        return (np.asarray(lats, dtype = np.float64) * METERS_PER_DEGREE,
+                np.asarray(lons, dtype = np.float64) * self.lon_scale)
+
+    def bucket_xy(self, x, y):
+
+        return (np.floor((x - self.x0) / self.cell).astype(np.int64),
+                np.floor((y - self.y0) / self.cell).astype(np.int64))
+
+    def bucket_of(self, x, y):
+
+        bx, by = self.bucket_xy(x, y)
+        return np.clip(bx, 0, self.nx - 1) * self.ny + np.clip(by, 0, self.ny - 1)
+
+    def box(self, lat0, lon0, lat1, lon1):
+        """
+        Vertices inside each box, as (query, rows): query[i] is the box the
+        i-th hit belongs to, rows[i] its position in the index arrays.
+        """
+        lat0, lon0, lat1, lon1 = finite(lat0, lon0, lat1, lon1)
+        lat0, lat1 = np.minimum(lat0, lat1), np.maximum(lat0, lat1)
+        lon0, lon1 = np.minimum(lon0, lon1), np.maximum(lon0, lon1)
+        x0, y0 = self.project(lat0, lon0)
+        x1, y1 = self.project(lat1, lon1)
+        bx0, by0 = self.bucket_xy(x0, y0)
+        bx1, by1 = self.bucket_xy(x1, y1)
+        bx0, bx1 = np.clip(bx0, 0, self.nx), np.clip(bx1, -1, self.nx - 1)
+        by0, by1 = np.clip(by0, 0, self.ny), np.clip(by1, -1, self.ny - 1)
+
+        # one contiguous slice of the sorted arrays per (box, bucket row)
+        rows = np.maximum(bx1 - bx0 + 1, 0) * (by1 >= by0)
+        query, row = spans(np.arange(len(lat0)), bx0, bx0 + rows)
+        start = self.starts[row * self.ny + by0[query]]
+        stop = self.starts[row * self.ny + by1[query] + 1]
+        query, candidates = spans(query, start, stop)
+
+        inside = ((self.lat[candidates] >= lat0[query]) & (self.lat[candidates] <= lat1[query])
+                  & (self.lon[candidates] >= lon0[query]) & (self.lon[candidates] <= lon1[query]))
+        return query[inside], candidates[inside]
+
+    def nearest(self, lats, lons, k = 1, max_distance = None):
+        """
+        (rows, distances) of shape (n, k): the k nearest vertices of each
+        point by ground distance in meters, closest first. Rows are -1 and
+        distances inf where the index holds fewer than k vertices, and for
+        the whole row of a point with no vertex within max_distance: the
+        search around such a point stops at that radius.
+        """
+        qx, qy = self.project(*finite(lats, lons))
+        n = len(qx)
+        rows = np.full((n, k), -1, dtype = np.int64)
+        distances = np.full((n, k), np.inf)
+        if self.count == 0 or n == 0:
+            return rows, distances
+
+        for start in range(0, n, QUERY_BLOCK):
+            block = slice(start, start + QUERY_BLOCK)
+            rows[block], distances[block] = self.nearest_block(qx[block], qy[block], k, max_distance)
+        return rows, distances
+
+    def nearest_block(self, qx, qy, k, max_distance = None):
+
+        n = len(qx)
+        rows = np.full((n, k), -1, dtype = np.int64)
+        distances = np.full((n, k), np.inf)
+        bx, by = self.bucket_xy(qx, qy)
+        bx = np.clip(bx, 0, self.nx - 1)
+        by = np.clip(by, 0, self.ny - 1)
+        pending = np.arange(n)
+        radius = 1
+        while len(pending):
+            found_rows, found_dist = self.ring_search(qx[pending], qy[pending], bx[pending],
+                                                      by[pending], radius, k)
+            # distance from each point to the nearest bucket not searched yet;
+            # sides where the searched block reaches the grid edge do not count
+            margin = np.full(len(pending), np.inf)
+            for b, q, origin, limit in ((bx[pending], qx[pending], self.x0, self.nx),
+                                        (by[pending], qy[pending], self.y0, self.ny)):
+                low = b - radius
+                high = b + radius + 1
+                margin = np.where(low > 0, np.minimum(margin, q - (origin + low * self.cell)), margin)
+                margin = np.where(high < limit, np.minimum(margin, origin + high * self.cell - q), margin)
+
+            done = found_dist[:, -1] <= margin
+            if max_distance is not None:
+                # every vertex left is farther than max_distance
+                far = ~(found_dist[:, 0] <= max_distance)
+                found_rows[far] = -1
+                found_dist[far] = np.inf
+                done |= far & (margin >= max_distance)
+            rows[pending[done]] = found_rows[done]
+            distances[pending[done]] = found_dist[done]
+            pending = pending[~done]
+            radius *= 2
+        return rows, distances
+
+    def ring_search(self, qx, qy, bx, by, radius, k):
+        """
+        k best candidates of each point among the buckets within radius.
+        Points are ranked in groups whose candidate table stays within
+        CANDIDATE_BLOCK entries, so rings spanning the whole index do not
+        cost points x vertices memory.
+        """
+        n = len(qx)
+        rows = np.full((n, k), -1, dtype = np.int64)
+        distances = np.full((n, k), np.inf)
+        # [x0, x1) x [y0, y1) buckets per point
+        x0 = np.clip(bx - radius, 0, self.nx)
+        x1 = np.maximum(np.clip(bx + radius + 1, 0, self.nx), x0)
+        y0 = np.clip(by - radius, 0, self.ny)
+        y1 = np.maximum(np.clip(by + radius + 1, 0, self.ny), y0)
+        counts = self.prefix[x1, y1] - self.prefix[x0, y1] - self.prefix[x1, y0] + self.prefix[x0, y0]
+
+        # by growing width, a group's table is its size times its last width
+        width = np.maximum(np.maximum(counts, x1 - x0), k)
+        by_width = np.argsort(width, kind = 'stable')
+        start = 0
+        while start < n:
+            span = by_width[start:start + CANDIDATE_BLOCK]
+            size = np.arange(1, len(span) + 1) * width[span]
+            stop = start + max(int(np.searchsorted(size, CANDIDATE_BLOCK, 'right')), 1)
+            group = by_width[start:stop]
+            rows[group], distances[group] = self.ring_block(qx[group], qy[group], x0[group], x1[group],
+                                                            y0[group], y1[group], k)
+            start = stop
+        return rows, distances
+
+    def ring_block(self, qx, qy, x0, x1, y0, y1, k):
+
+        n = len(qx)
+        query, row = spans(np.arange(n), x0, x1)
+        query, candidates = spans(query, self.starts[row * self.ny + y0[query]],
+                                  self.starts[row * self.ny + y1[query]])
+
+        distance = np.hypot(self.x[candidates] - qx[query], self.y[candidates] - qy[query])
+        counts = np.bincount(query, minlength = n)
+        width = max(int(counts.max()) if n else 0, k)
+        position = np.arange(len(query)) - np.repeat(np.cumsum(counts) - counts, counts)
+        table = np.full((n, width), np.inf)
+        table[query, position] = distance
+        ids = np.full((n, width), -1, dtype = np.int64)
+        ids[query, position] = candidates
+
+        best = np.argpartition(table, k - 1, axis = 1)[:, :k] if width > k else np.tile(np.arange(width), (n, 1))
+        best_dist = np.take_along_axis(table, best, axis = 1)
+        order = np.argsort(best_dist, axis = 1, kind = 'stable')
+        best = np.take_along_axis(best, order, axis = 1)
+        return np.take_along_axis(ids, best, axis = 1), np.take_along_axis(best_dist, order, axis = 1)
+
+
+def finite(*values):
+    """
+    The values as float arrays; ValueError if any holds NaN or inf.
+    """
+    values = [ np.atleast_1d(np.asarray(v, dtype = np.float64)) for v in values ]
+    if not all(np.isfinite(v).all() for v in values):
+        raise ValueError("query coordinates must be finite")
+    return values
+
+
+def spans(query, start, stop):
+    """
+    Expand [start, stop) ranges into (query, position) pairs, one per element.
+    """
+    lengths = np.maximum(stop - start, 0)
+    total = int(lengths.sum())
+    owner = np.repeat(np.arange(len(lengths)), lengths)
+    position = np.arange(total) - np.repeat(np.cumsum(lengths) - lengths, lengths) + np.repeat(start, lengths)
+    return np.asarray(query)[owner], position
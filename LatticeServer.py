@@ -0,0 +1,432 @@
+"""
+
+ Read-only HTTP API over a persisted WorldLattice.
+
+   GET  /tile/<level>/<tx>/<ty>          overview cells of one tile: TILE_CELLS x
+                                         TILE_CELLS cells of pyramid level `level`
+                                         (level 0: the vertices themselves)
+   GET  /box?lat0=&lon0=&lat1=&lon1=     vertices inside a lat/lon box
+   GET  /elevation?lat=&lon=             altitude at one point (altitude_at,
+                                         optional max_distance in meters)
+   POST /elevation                       altitudes of many points: JSON
+                                         {"lats": [...], "lons": [...]} or a body of
+                                         little-endian float64 (lat, lon) pairs,
+                                         at most MAX_BATCH points / MAX_BODY bytes
+
+ Every endpoint answers ?format=json (default), npz (numpy.load) or packed:
+ one little-endian record per row, its dtype in the X-Lattice-Dtype header.
+ GET responses are kept encoded in an LRU and carry an ETag, so repeated
+ tiles cost a dictionary lookup and clients holding them get 304.
+
+ The lattice is opened memory-mapped (WorldLattice.open) and never written.
+ Point and box reads go through one read view of it, a GridIndex built from
+ the mapped columns without creating DBits (WorldLattice.mapped_snapshot);
+ tiles come from the persisted level-of-detail pyramid, which stays mapped
+ from the file.
+ serve() warms both before forking its workers, so they share the lattice
+ pages instead of each loading it. Under another WSGI server, use
+ create_app() (Flask) or wsgi_app() with the file in SN_LATTICE_FILE and
+ preload the app before the workers fork.
+
+"""
+import os
+import io
+import sys
+import json
+import signal
+import hashlib
+import threading
+import numpy as np
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qsl
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+from mapsloader import WorldLattice as wl
+from mapsloader import LatticeFile as lf
+from mapsloader import ElevationCache
+
+try:
+    import flask
+except ImportError:
+    flask = None
+
+LATTICE_FILE = os.environ.get('SN_LATTICE_FILE')
+
+# cells per tile side, at every level
+TILE_CELLS = 256
+
+# most points one batch request may ask for
+MAX_BATCH = 1 << 16
+
+# largest request body read, in bytes: room for MAX_BATCH points as JSON
+MAX_BODY = 64 * MAX_BATCH
+
+FORMATS = ('json', 'npz', 'packed')
+
+CONTENT_TYPES = {
+    'json': 'application/json',
+    'npz': 'application/x-npz',
+    'packed': 'application/octet-stream',
+    }
+
+
+class Reply:
+
+    __slots__ = ('status', 'content_type', 'body', 'etag', 'headers')
+
+    def __init__(self, status, content_type, body, etag = None, headers = None):
+        self.status = status
+        self.content_type = content_type
+        self.body = body
+        self.etag = etag
+        self.headers = headers or []
+
+    def finish(self, if_none_match = None):
+        """
+        (status line, headers, body), 304 when if_none_match holds our ETag.
+        """
+        headers = list(self.headers)
+        if self.etag is not None:
+            headers.append(('ETag', self.etag))
+            if if_none_match is not None and (if_none_match.strip() == '*'
+                                              or self.etag in [ tag.strip() for tag in if_none_match.split(',') ]):
+                return '304 Not Modified', headers, b''
+        headers += [ ('Content-Type', self.content_type), ('Content-Length', str(len(self.body))) ]
+        return self.status, headers, self.body
+
+
+def error(status, message):
+
+    return Reply(status, CONTENT_TYPES['json'], json.dumps({ 'error': message }).encode('utf-8'))
+
+
+def json_column(values):
+
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        # NaN is not JSON
+        return np.where(np.isnan(values), None, values).tolist()
+    return values.tolist()
+
+
+def encode(columns, fmt):
+    """
+    Reply for a dict of equal-length columns in format fmt.
+    """
+    if fmt == 'json':
+        body = json.dumps({ name: json_column(values) for name, values in columns.items() }).encode('utf-8')
+        return Reply('200 OK', CONTENT_TYPES[fmt], body)
+    if fmt == 'npz':
+        buffer = io.BytesIO()
+        np.savez(buffer, **columns)
+        return Reply('200 OK', CONTENT_TYPES[fmt], buffer.getvalue())
+
+    columns = { name: np.asarray(values) for name, values in columns.items() }
+    dtype = np.dtype([ (name, values.dtype.newbyteorder('<'), values.shape[1:])
+                       for name, values in columns.items() ])
+    records = np.empty(len(next(iter(columns.values()))) if columns else 0, dtype = dtype)
+    for name, values in columns.items():
+        records[name] = values
+    return Reply('200 OK', CONTENT_TYPES[fmt], records.tobytes(),
+                 headers = [ ('X-Lattice-Dtype', json.dumps(dtype.descr)) ])
+
+
+def number(args, name, kind = float):
+
+    try:
+        value = kind(args[name])
+    except KeyError:
+        raise ValueError(f"missing parameter '{name}'")
+    except (TypeError, ValueError):
+        raise ValueError(f"parameter '{name}' is not a number")
+    if not np.isfinite(value):
+        raise ValueError(f"parameter '{name}' is not finite")
+    return value
+
+
+def format_of(args):
+
+    fmt = args.get('format', 'json')
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format '{fmt}', expected one of {FORMATS}")
+    return fmt
+
+
+def open_lattice(path):
+    """
+    Memory-map the lattice file at path at the origin it was saved with.
+    """
+    with open(path, 'rb') as file:
+        header = lf.read_header(file)
+    return wl.WorldLattice.open(*header['origin'], path = path)
+
+
+class LatticeService:
+    """
+    The endpoints, independent of the web framework: each takes the parsed
+    request and returns a Reply.
+    """
+
+    def __init__(self, lattice, cache_size = 4096):
+        self.lattice = lattice
+        # (endpoint, arguments, format, snapshot version) -> encoded Reply
+        self.cache = ElevationCache.LRUCache(cache_size)
+        self.lock = threading.Lock()
+        # read view of a mapped lattice, see view()
+        self.mapped = None
+
+    @staticmethod
+    def open(path = None, cache_size = 4096):
+
+        return LatticeService(open_lattice(path or LATTICE_FILE), cache_size)
+
+    def view(self):
+        """
+        The read view point and box reads go through, made on first use: for
+        a mapped lattice, its mapped_snapshot(), which leaves the file mapped;
+        otherwise the lattice's published snapshot.
+        """
+        lattice = self.lattice
+        if lattice.backing is None:
+            snapshot = lattice.published
+            if snapshot is None:
+                with self.lock:
+                    snapshot = lattice.published or lattice.snapshot()
+            return snapshot
+        if self.mapped is None:
+            with self.lock:
+                if self.mapped is None:
+                    self.mapped = lattice.mapped_snapshot()
+        return self.mapped
+
+    def warm(self):
+        """
+        Build everything reads need up front (read view, index, terrain),
+        e.g. before forking workers. A mapped lattice stays mapped.
+        """
+        snapshot = self.view()
+        snapshot.query_index()
+        if snapshot.grid is not None:
+            snapshot.terrain()
+        self.lattice.lod()
+        return self
+
+    def cached(self, key, build):
+
+        key = key + (self.view().version,)
+        reply = self.cache.get(key)
+        if reply is None:
+            reply = build()
+            reply.etag = '"' + hashlib.blake2b(reply.body, digest_size = 8).hexdigest() + '"'
+            self.cache.put(key, reply)
+        return reply
+
+    def tile(self, level, tx, ty, args):
+
+        fmt = format_of(args)
+        if not 0 <= level <= self.lattice.lod().depth:
+            raise ValueError(f"level must be within 0 .. {self.lattice.lod().depth}")
+
+        def build():
+            size = TILE_CELLS << level
+            box = (tx * size, ty * size, (tx + 1) * size - 1, (ty + 1) * size - 1)
+            cells = self.lattice.overview(1 << level if level else None, box)
+            return encode({ name: cells[name] for name in ('x', 'y', 'min', 'max', 'mean', 'count') }, fmt)
+
+        return self.cached(('tile', level, tx, ty, fmt), build)
+
+    def box(self, args):
+
+        fmt = format_of(args)
+        bounds = tuple(number(args, name) for name in ('lat0', 'lon0', 'lat1', 'lon1'))
+
+        def build():
+            found = self.view().query_box(*bounds)
+            return encode({ name: found[name] for name in ('lat', 'lon', 'alt', 'coords') }, fmt)
+
+        return self.cached(('box', bounds, fmt), build)
+
+    def elevation(self, args):
+
+        fmt = format_of(args)
+        lat, lon = number(args, 'lat'), number(args, 'lon')
+        max_distance = number(args, 'max_distance') if 'max_distance' in args else None
+
+        def build():
+            alt = self.view().altitude_at([ lat ], [ lon ], max_distance)
+            return encode({ 'lat': [ lat ], 'lon': [ lon ], 'alt': alt }, fmt)
+
+        return self.cached(('elevation', lat, lon, max_distance, fmt), build)
+
+    def elevation_batch(self, body, content_type, args):
+
+        fmt = format_of(args)
+        max_distance = number(args, 'max_distance') if 'max_distance' in args else None
+        if content_type.startswith('application/json'):
+            try:
+                request = json.loads(body)
+                lats = np.asarray(request['lats'], dtype = np.float64)
+                lons = np.asarray(request['lons'], dtype = np.float64)
+            except (ValueError, KeyError, TypeError):
+                raise ValueError("expected a JSON body {\"lats\": [...], \"lons\": [...]}")
+        else:
+            if len(body) % 16:
+                raise ValueError("expected little-endian float64 (lat, lon) pairs")
+            points = np.frombuffer(body, dtype = '<f8').reshape(-1, 2)
+            lats, lons = points[:, 0], points[:, 1]
+        if lats.shape != lons.shape or lats.ndim != 1:
+            raise ValueError("lats and lons must be flat and of one length")
+        if len(lats) > MAX_BATCH:
+            raise ValueError(f"at most {MAX_BATCH} points per request")
+        if not (np.isfinite(lats).all() and np.isfinite(lons).all()):
+            raise ValueError("lats and lons must be finite")
+        return encode({ 'alt': self.view().altitude_at(lats, lons, max_distance) }, fmt)
+
+
+def dispatch(service, method, path, args, body = b'', content_type = '', if_none_match = None):
+    """
+    Route one request; returns (status line, headers, body).
+    """
+    parts = [ part for part in path.split('/') if part ]
+    try:
+        if method == 'GET' and len(parts) == 4 and parts[0] == 'tile':
+            try:
+                level, tx, ty = int(parts[1]), int(parts[2]), int(parts[3])
+            except ValueError:
+                raise ValueError("tiles are /tile/<level>/<tx>/<ty>, all integers")
+            reply = service.tile(level, tx, ty, args)
+        elif method == 'GET' and parts == [ 'box' ]:
+            reply = service.box(args)
+        elif method == 'GET' and parts == [ 'elevation' ]:
+            reply = service.elevation(args)
+        elif method == 'POST' and parts == [ 'elevation' ]:
+            reply = service.elevation_batch(body, content_type, args)
+        else:
+            reply = error('404 Not Found', f"no endpoint {method} {path}")
+    except ValueError as e:
+        reply = error('400 Bad Request', str(e))
+    return reply.finish(if_none_match)
+
+
+def wsgi_app(service = None):
+    """
+    The API as a plain WSGI application.
+    """
+    if service is None:
+        service = LatticeService.open().warm()
+
+    def app(environ, start_response):
+        method = environ['REQUEST_METHOD']
+        body = b''
+        reply = None
+        if method == 'POST':
+            try:
+                length = int(environ.get('CONTENT_LENGTH') or 0)
+            except ValueError:
+                length = -1
+            if length < 0:
+                reply = error('400 Bad Request', "invalid Content-Length")
+            elif length > MAX_BODY:
+                reply = error('413 Payload Too Large', f"request bodies are limited to {MAX_BODY} bytes")
+            else:
+                body = environ['wsgi.input'].read(length)
+        if reply is not None:
+            status, headers, payload = reply.finish()
+        else:
+            status, headers, payload = dispatch(service, method, environ.get('PATH_INFO', ''),
+                                                dict(parse_qsl(environ.get('QUERY_STRING', ''))), body,
+                                                environ.get('CONTENT_TYPE', ''),
+                                                environ.get('HTTP_IF_NONE_MATCH'))
+        start_response(status, headers)
+        return [ payload ]
+
+    return app
+
+
+def create_app(service = None):
+    """
+    The API as a Flask application. Raises RuntimeError if Flask is not
+    installed; wsgi_app() needs nothing beyond the standard library.
+    """
+    if flask is None:
+        raise RuntimeError("Flask is not installed; use wsgi_app() or serve()")
+    if service is None:
+        service = LatticeService.open().warm()
+    app = flask.Flask(__name__)
+    # larger bodies get 413 before they are read
+    app.config['MAX_CONTENT_LENGTH'] = MAX_BODY
+
+    def respond(method, path):
+        request = flask.request
+        status, headers, body = dispatch(service, method, path, request.args.to_dict(),
+                                         request.get_data() if method == 'POST' else b'',
+                                         request.content_type or '', request.headers.get('If-None-Match'))
+        return flask.Response(body, status = status, headers = headers)
+
+    @app.get('/tile/<int:level>/<int(signed=True):tx>/<int(signed=True):ty>')
+    def tile(level, tx, ty):
+        return respond('GET', flask.request.path)
+
+    @app.get('/box')
+    def box():
+        return respond('GET', '/box')
+
+    @app.get('/elevation')
+    def elevation():
+        return respond('GET', '/elevation')
+
+    @app.post('/elevation')
+    def elevation_batch():
+        return respond('POST', '/elevation')
+
+    return app
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_lattice_server(service, host = '127.0.0.1', port = 8080):
+    """
+    A threaded stdlib HTTP server for the API (port 0 picks a free one).
+    """
+    return make_server(host, port, wsgi_app(service), server_class = ThreadingWSGIServer,
+                       handler_class = QuietHandler)
+
+
+def serve(path = None, host = '127.0.0.1', port = 8080, workers = 4, cache_size = 4096):
+    """
+    Serve the lattice file at path from `workers` processes sharing one
+    listening socket. The lattice is opened and warmed once, before the
+    workers fork, so they share its pages copy-on-write.
+    """
+    service = LatticeService.open(path, cache_size).warm()
+    server = make_lattice_server(service, host, port)
+    children = []
+    for _ in range(workers - 1):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        children.append(pid)
+    try:
+        server.serve_forever()
+    finally:
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+        for pid in children:
+            os.waitpid(pid, 0)
+        server.server_close()
+
+
+if __name__ == '__main__':
+    serve(sys.argv[1] if len(sys.argv) > 1 else None,
+          port = int(sys.argv[2]) if len(sys.argv) > 2 else 8080)
@@ -14,62 +14,273 @@
 
  NOTES:
  Regularly maintain dbits/
- Flask API Coming soon
+ Flask API: see LatticeServer
 
 """
 
-import requests
 import os
-from mapsloader import WorldLattice, AlgorithmicMemory
-from math import cos, sin, radians
+import asyncio
+import numpy as np
+from mapsloader import WorldLattice, AlgorithmicMemory, ElevationClient, ElevationCache, Geocoder
+from mapsloader import ElevationProvider, Grid, TiledWorld
+
+geocoders = {}
+
+def geocoder(api_key):
+    """
+    Shared Geocoder per API key, caching next to the lattices.
+    """
+    path = os.path.join(WorldLattice.main_directory, 'geocode.sqlite')
+    coder = geocoders.get((api_key, path))
+    if coder is None:
+        coder = geocoders[(api_key, path)] = Geocoder.Geocoder(api_key, path)
+    return coder
 
 def geocode_address(address, api_key):
-    url = f"https://maps.googleapis.com/maps/api/geocode/json?address={address}&key={api_key}"
-    response = requests.get(url)
-    if response.status_code == 200:
-        results = response.json().get('results')
-        if results:
-            location = results[0]['geometry']['location']
-            return location['lat'], location['lng']
-    raise ValueError("Failed to geocode address")
+    """
+    (lat, lng) of an address, from the geocode cache when it has been seen before.
+    Raises Geocoder.GeocodeError (a ValueError) when it cannot be resolved.
+    """
+    return geocoder(api_key).geocode(address)
+
+def geocode_addresses(addresses, api_key):
+    """
+    (lat, lng) for many addresses; duplicates and cached ones cost no request.
+    """
+    return geocoder(api_key).geocode_many(addresses)
 
 # Google API functions
 GOOGLE_API_KEY = os.environ.get('SN_GM_API_KEY')
-print (GOOGLE_API_KEY)
 
-def get_altitude_for_multiple_locations(locations, api_key):
+elevation_clients = {}
+
+def elevation_client(api_key):
+    """
+    Shared ElevationClient per API key, so batches reuse one connection pool.
+    """
+    client = elevation_clients.get(api_key)
+    if client is None:
+        client = elevation_clients[api_key] = ElevationClient.ElevationClient(api_key)
+    return client
+
+# finer than precision_factor below: about a meter
+elevation_precision_factor = 100000
+
+elevation_caches = {}
+
+def elevation_cache():
+    """
+    The on-disk elevation cache, kept next to the lattices.
+    """
+    path = os.path.join(WorldLattice.main_directory, 'elevation.sqlite')
+    cache = elevation_caches.get(path)
+    if cache is None:
+        cache = elevation_caches[path] = ElevationCache.ElevationCache(
+            path, precision_factor = elevation_precision_factor)
+    return cache
+
+def get_altitude_for_multiple_locations(locations, api_key, cached = True):
     """
     Fetch altitudes for multiple latitude and longitude pairs using Google Elevation API.
+    Requests are split into valid batches, run concurrently and retried (see ElevationClient).
+    With cached, points already in the elevation cache are not requested again.
     :param locations: List of (lat, lon) tuples.
     :param api_key: Google API key.
     :return: List of altitudes corresponding to each (lat, lon) pair.
     """
-    # Construct the locations string for the API request
-    location_str = "|".join([f"{lat},{lon}" for lat, lon in locations])
-    url = f"https://maps.googleapis.com/maps/api/elevation/json?locations={location_str}&key={api_key}"
-    response = requests.get(url)
-    
-    if response.status_code != 200:
-        print(f"Error: Received status code {response.status_code} from the Elevation API.")
-        print("Response content:", response.content)
-        raise ValueError("Failed to get altitude")
-    
-    data = response.json()
-    status = data.get('status', '')
-    
-    if status != 'OK':
-        print(f"Error: Elevation API returned status '{status}'.")
-        print("Response content:", response.content)
-        raise ValueError("Failed to get altitude")
-    
-    results = data.get('results', [])
-    altitudes = [result['elevation'] for result in results]
-    return altitudes
+    if cached:
+        return elevation_cache().get_altitudes(locations, elevation_client(api_key).get_altitudes)
+    return elevation_client(api_key).get_altitudes(locations)
+
+# directory of SRTM .hgt tiles; when set, builds read elevations offline
+DEM_DIRECTORY = os.environ.get('SN_DEM_DIR')
+
+def elevation_provider(api_key = None):
+    """
+    The default ElevationProvider: local DEM tiles when SN_DEM_DIR is set,
+    otherwise the Google Elevation API behind the elevation cache.
+    """
+    if DEM_DIRECTORY:
+        return ElevationProvider.DEMElevationProvider(DEM_DIRECTORY)
+    return ElevationProvider.GoogleElevationProvider(elevation_client(api_key or GOOGLE_API_KEY),
+                                                     elevation_cache())
 
 precision_factor = 1000
 
+def iter_grid_batches(spec, batch_size = 512):
+    """
+    The grid described by spec (see Grid.grid_spec) as (n, 2) arrays of
+    (lat, lon) rows, n <= batch_size.
+    """
+    carry = np.empty((0, 2))
+    for lats, lons in Grid.iter_grid(spec, max(batch_size, 1 << 16)):
+        points = np.concatenate([ carry, np.stack([ lats, lons ], axis = 1) ])
+        full = len(points) - len(points) % batch_size
+        for start in range(0, full, batch_size):
+            yield points[start:start + batch_size]
+        carry = points[full:]
+    if len(carry):
+        yield carry
+
+def lattice_reference(lat, lon, alt):
+    """
+    Integer lattice coordinates of the point that becomes the lattice's (0, 0, 0).
+    """
+    x, y = WorldLattice.quantize([ lat, lon ], precision_factor).tolist()
+    return x, y, int(WorldLattice.quantize(alt))
+
+def is_vacant(root):
+
+    return root is None or root.lbit0.other is root.lbit1
+
+def insert_locations(lattice, lats, lons, alts, reference):
+    """
+    Quantize (lat, lon, alt) arrays against reference and insert the points
+    landing on vertices the lattice does not have yet. Returns the number inserted.
+    """
+    x_lat, y_lon, z_alt = reference
+
+    coords = np.stack([ WorldLattice.quantize(lats, precision_factor) - x_lat,
+                        WorldLattice.quantize(lons, precision_factor) - y_lon,
+                        WorldLattice.quantize(alts) - z_alt ], axis = 1)
+
+    # Keep the first point landing on each lattice vertex, skip vertices
+    # the lattice already has. A root DBit alone (head scaffolding) is not
+    # a vertex: only a cell with something stacked on it counts.
+    _, first = np.unique(coords, axis = 0, return_index = True)
+    first = np.sort(first)
+    local = coords[first] - np.array([ lattice.x, lattice.y, lattice.z ])
+    first = first[[ is_vacant(lattice.retrieve(*xyz)) for xyz in local.tolist() ]]
+
+    # Insert dbits into the lattice with the fetched altitude data
+    lattice.insert_batch(coords[first], [ {
+                'type' : 'map_vertex',
+                'lat' : float(lats[i]),
+                'lon' : float(lons[i]),
+                'alt' : float(alts[i])
+                } for i in first.tolist() ])
+    return len(first)
+
+def ingest_lattice(lattice, batches, altitudes_for):
+    """
+    Sequential counterpart of stream_lattice: fetch and insert one batch at
+    a time, so only one batch of points and altitudes is held at once.
+    The first point fixes the lattice reference. Returns the number of
+    vertices inserted.
+    """
+    reference = None
+    inserted = 0
+    for batch in batches:
+        batch = np.asarray(batch, dtype = np.float64).reshape(-1, 2)
+        alts = np.array(altitudes_for(batch), dtype = np.float64)
+        if reference is None:
+            reference = lattice_reference(batch[0, 0], batch[0, 1], alts[0])
+        inserted += insert_locations(lattice, batch[:, 0], batch[:, 1], alts, reference)
+    return inserted
+
+async def stream_lattice(lattice, batches, altitudes_for, fetch_workers = 4, queue_size = 4,
+                         save_every = 8, publish = True):
+    """
+    Streaming ingestion: grid batches -> elevation fetches -> lattice inserts
+    -> incremental saves. Stages are joined by bounded queues, so the
+    producer blocks while fetches are behind and memory stays flat; fetches
+    and inserts run in threads, letting network waits overlap with linking.
+
+    batches yields (n, 2) arrays (or lists) of (lat, lon), altitudes_for returns their
+    elevations. The first batch is fetched up front because its first point
+    fixes the lattice reference. With publish, a read snapshot of the
+    lattice (lattice.published) is taken after every batch, so readers can
+    serve it while ingestion goes on. Returns the number of vertices inserted.
+    """
+    batches = iter(batches)
+    first = next(batches, None)
+    if first is None:
+        return 0
+
+    first_alts = await asyncio.to_thread(altitudes_for, first)
+    reference = lattice_reference(first[0][0], first[0][1], first_alts[0])
+
+    points = asyncio.Queue(maxsize = queue_size)
+    results = asyncio.Queue(maxsize = queue_size)
+    await results.put((first, first_alts))
+
+    # a failing producer or fetch hands its exception to consume(), which
+    # raises it and so stops the pipeline instead of waiting for it forever
+    async def produce():
+        try:
+            for batch in batches:
+                await points.put(batch)
+        except Exception as error:
+            await results.put(error)
+            return
+        for _ in range(fetch_workers):
+            await points.put(None)
+
+    async def fetch():
+        while True:
+            batch = await points.get()
+            if batch is None:
+                await results.put(None)
+                return
+            try:
+                alts = await asyncio.to_thread(altitudes_for, batch)
+            except Exception as error:
+                await results.put(error)
+                return
+            await results.put((batch, alts))
+
+    async def consume():
+        inserted = 0
+        done = 0
+        batches_seen = 0
+        while done < fetch_workers:
+            item = await results.get()
+            if item is None:
+                done += 1
+                continue
+            if isinstance(item, Exception):
+                raise item
+            batch, alts = item
+            batch = np.asarray(batch, dtype = np.float64).reshape(-1, 2)
+            inserted += await asyncio.to_thread(insert_locations, lattice, batch[:, 0], batch[:, 1],
+                                                np.array(alts, dtype = np.float64), reference)
+            batches_seen += 1
+            if publish:
+                await asyncio.to_thread(lattice.snapshot)
+            if save_every and batches_seen % save_every == 0:
+                await asyncio.to_thread(lattice.save_incremental)
+        return inserted
+
+    tasks = [ asyncio.create_task(produce()) ]
+    tasks += [ asyncio.create_task(fetch()) for _ in range(fetch_workers) ]
+    consumer = asyncio.create_task(consume())
+    try:
+        inserted = await consumer
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks + [ consumer ]:
+            task.cancel()
+        raise
+
+    await asyncio.to_thread(lattice.save_incremental)
+    return inserted
+
+def initializeRegion(lat0, lon0, lat1, lon1, provider = None, tile_size = 256, step = 1,
+                     workers = None, processes = False):
+    """
+    Cover a lat/lon box with lattice tiles (see TiledWorld), one WorldLattice
+    per tile_size x tile_size block of lattice vertices, built in parallel.
+    Returns the TiledWorld; its region() loads just the tiles a box touches.
+    """
+    if provider is None:
+        provider = elevation_provider(GOOGLE_API_KEY)
+    world = TiledWorld.TiledWorld(tile_size, precision_factor)
+    world.build(lat0, lon0, lat1, lon1, provider, step, workers, processes)
+    return world
+
 # Main script to populate lattice and visualize
-def initializeLattice(city = None, region = None):
+def initializeLattice(city = None, region = None, stream = False, provider = None,
+                      grid_size = 20, spacing = Grid.DEFAULT_SPACING, rotation = 45, shape = 'diamond'):
     # Convert address to GPS coordinates using Google Geocoding API
     if city is None:
         start_address = "3508 Red Rock Dr, Moab UT 84532"
@@ -79,59 +290,32 @@ def initializeLattice(city = None, region = None):
     # start_address = "ul. Jacka Szarskiego 20a, 30-698 Krakow, Poland"
     start_lat, start_lon = geocode_address(start_address, GOOGLE_API_KEY)
 
-    # Define the grid dimensions
-    grid_size = 20  # 40x40 points
-    spacing = 100 / 3.28084  # 100 feet to meters
+    # Define the grid: grid_size + 1 points across, spacing meters apart
+    spec = Grid.grid_spec(start_lat, start_lon, grid_size, spacing, rotation, shape)
+
+    if provider is None:
+        provider = elevation_provider(GOOGLE_API_KEY)
 
     # Initialize lattice
     try:
-        lattice = WorldLattice.WorldLattice.deserialize('lat_test0.dat')
+        lattice = WorldLattice.WorldLattice.load(0, 0, 0)
     except FileNotFoundError as e:
-        lattice = WorldLattice.WorldLattice('lat_test0.dat')
-
-    # Create a list of (lat, lon) tuples for the grid points
-    locations = []
-    for i in range(-grid_size // 2, grid_size // 2 + 1):
-        for j in range(-grid_size // 2, grid_size // 2 + 1):
-            if abs(i) + abs(j) <= grid_size // 2:
-                # Convert offsets to GPS coordinates
-                dx = i * spacing * cos(radians(45)) - j * spacing * sin(radians(45))
-                dy = i * spacing * sin(radians(45)) + j * spacing * cos(radians(45))
-                lat = start_lat + dx / 111320
-                lon = start_lon + dy / (111320 * cos(radians(start_lat)))
-                locations.append((lat, lon))
-
-    # Fetch altitudes for all locations in a single API call
-    altitudes = get_altitude_for_multiple_locations(locations, GOOGLE_API_KEY)
-
-    # print(altitudes)
+        lattice = WorldLattice.WorldLattice(0, 0, 0)
 
-    x_lat = int(locations[0][0] * precision_factor)
-    y_lon = int(locations[0][1] * precision_factor)
-    z_alt = int(altitudes[0])
+    lattice.grid = spec
 
-    # print(x_lat, y_lon, z_alt)
-
-    # Insert dbits into the lattice with the fetched altitude data
-    for (lat, lon), alt in zip(locations, altitudes):
-        int_lat = int(lat * precision_factor) - x_lat
-        int_lon = int(lon * precision_factor) - y_lon
-        int_alt = int(alt) - z_alt
-        dbit = lattice.am.retrieve(int_lat, int_lon, int_alt)
-        if dbit is None:
-            lattice.insert({
-                'type' : 'map_vertex',
-                'lat' :lat,
-                'lon' :lon,
-                'alt' :alt
-                }, int_lat, int_lon, int_alt)
+    if stream:
+        asyncio.run(stream_lattice(lattice, iter_grid_batches(spec), provider.get_altitudes))
+    else:
+        # Fetch altitudes and insert block by block (the provider batches further)
+        ingest_lattice(lattice, iter_grid_batches(spec, 1 << 16), provider.get_altitudes)
 
     # Visualize the lattice
-    lattice.serialize()
+    lattice.save()
     # lattice.visualize_lattice()
     # # in_development lattice.serialize()
 
-    latticecopy = WorldLattice.WorldLattice.deserialize('lat_test0.dat')
+    latticecopy = WorldLattice.WorldLattice.load(0, 0, 0)
 
     latticecopy.visualize_lattice()
 
@@ -0,0 +1,240 @@
+"""
+
+ Tiled worlds: many WorldLattices side by side.
+
+ Global lattice coordinates (lat * precision_factor, lon * precision_factor,
+ alt), floored by WorldLattice.quantize as in MapsLoader, are cut into
+ tile_size x tile_size columns in x/y. Each tile is one WorldLattice whose origin is the tile's
+ corner, stored under its own file, so a region only ever reads the tiles
+ it touches.
+
+ Tiles are built independently (in a thread or process pool) and saved;
+ neighbor links across tile seams are not persisted but resolved whenever
+ two adjacent tiles are in memory together.
+
+"""
+import os
+import time
+import numpy as np
+from mapsloader import WorldLattice as wl
+from mapsloader import ChunkIndex as ci
+
+
+def tile_key(x, y, tile_size):
+    return (x // tile_size, y // tile_size)
+
+
+def tile_origin(key, tile_size):
+    return (key[0] * tile_size, key[1] * tile_size, 0)
+
+
+def tiles_for_box(x0, y0, x1, y1, tile_size):
+    """
+    Keys of the tiles overlapping the inclusive box (x0, y0) .. (x1, y1).
+    """
+    kx0, ky0 = tile_key(min(x0, x1), min(y0, y1), tile_size)
+    kx1, ky1 = tile_key(max(x0, x1), max(y0, y1), tile_size)
+    return [ (kx, ky) for kx in range(kx0, kx1 + 1) for ky in range(ky0, ky1 + 1) ]
+
+
+def build_tile(task):
+    """
+    Sample one tile of a box from an elevation provider, save it and return
+    (key, vertices). Module level so it can run in a process pool.
+    """
+    key, box, tile_size, step, precision_factor, provider = task
+    x0, y0, x1, y1 = box
+    ox, oy, oz = tile_origin(key, tile_size)
+
+    # global lattice rows/columns inside both the tile and the box, on the step grid
+    lo_x = max(x0, ox)
+    lo_y = max(y0, oy)
+    xs = np.arange(-(-lo_x // step) * step, min(x1, ox + tile_size - 1) + 1, step, dtype = np.int64)
+    ys = np.arange(-(-lo_y // step) * step, min(y1, oy + tile_size - 1) + 1, step, dtype = np.int64)
+    gx, gy = np.meshgrid(xs, ys, indexing = 'ij')
+    gx, gy = gx.ravel(), gy.ravel()
+
+    lats = gx / precision_factor
+    lons = gy / precision_factor
+    alts = np.asarray(provider.elevations(lats, lons), dtype = np.float64)
+    keep = ~np.isnan(alts)
+
+    lattice = wl.WorldLattice(ox, oy, oz)
+    coords = np.stack([ gx[keep], gy[keep], wl.quantize(alts[keep]) ], axis = 1)
+    lattice.insert_batch(coords, [ {
+                'type' : 'map_vertex',
+                'lat' : lat,
+                'lon' : lon,
+                'alt' : alt
+                } for lat, lon, alt in zip(lats[keep].tolist(), lons[keep].tolist(), alts[keep].tolist()) ])
+    lattice.save()
+    return key, len(coords)
+
+
+def boundary_cells(lattice, axis, value):
+    """
+    (coords, root DBit) of the lattice cells whose local coordinate on axis
+    equals value, faulting in the chunks of a lazily opened lattice first.
+    """
+    plane = value >> ci.CHUNK_BITS
+    if lattice.backing is not None:
+        lattice.fault_in_chunks([ key for key in lattice.backing.chunk_keys() if key[axis] == plane ])
+    dbits = lattice.am.dbits
+    for key in dbits.chunk_keys():
+        if key[axis] == plane:
+            for coords, dbit in dbits.iter_chunk(key):
+                if coords[axis] == value:
+                    yield coords, dbit
+
+
+def link_seam(lower, upper, axis, tile_size):
+    """
+    Link the last plane of `lower` to the first plane of `upper` along axis
+    (0 for x, 1 for y), the way scaffold links neighbors inside one lattice.
+    Returns the number of links made.
+    """
+    name = 'xy'[axis]
+    links = 0
+    for (x, y, z), dbit in list(boundary_cells(lower, axis, tile_size - 1)):
+        coords = [ x, y, z ]
+        coords[axis] = 0
+        if upper.backing is not None:
+            upper.fault_in(*coords)
+        neighbor = upper.am.dbits.get(tuple(coords))
+        if neighbor is not None:
+            # the seam replaces links to cells past the tile edge (head
+            # scaffolding); those cells lose their side of the link
+            for lbit, other in ((dbit.lbit1, neighbor.lbit0), (neighbor.lbit0, dbit.lbit1)):
+                stale = getattr(lbit, name)
+                if stale is not None and stale is not other:
+                    setattr(stale, name, None)
+            setattr(dbit.lbit1, name, neighbor.lbit0)
+            setattr(neighbor.lbit0, name, dbit.lbit1)
+            links += 1
+    return links
+
+
+class TiledWorld:
+
+    def __init__(self, tile_size = 256, precision_factor = 1000):
+        self.tile_size = tile_size
+        self.precision_factor = precision_factor
+        self.tiles = {}
+        self.build_report = None
+
+    def box_for_latlon(self, lat0, lon0, lat1, lon1):
+        """
+        Inclusive global lattice box (x0, y0, x1, y1) of a lat/lon box.
+        """
+        x0, x1 = wl.quantize([ min(lat0, lat1), max(lat0, lat1) ], self.precision_factor).tolist()
+        y0, y1 = wl.quantize([ min(lon0, lon1), max(lon0, lon1) ], self.precision_factor).tolist()
+        return (x0, y0, x1, y1)
+
+    def build(self, lat0, lon0, lat1, lon1, provider, step = 1, workers = None, processes = False):
+        """
+        Sample every step-th lattice vertex of the box from provider into
+        tiles, building and saving the tiles in parallel. Built tiles are not
+        kept in memory; load() or region() brings them in.
+        """
+        start = time.perf_counter()
+        box = self.box_for_latlon(lat0, lon0, lat1, lon1)
+        keys = tiles_for_box(*box, self.tile_size)
+        tasks = [ (key, box, self.tile_size, step, self.precision_factor, provider) for key in keys ]
+        built = wl.run_pool(build_tile, tasks, workers, processes)
+
+        for key, _ in built:
+            self.tiles.pop(key, None)
+        self.build_report = wl.load_report(len(built), sum(count for _, count in built),
+                                           time.perf_counter() - start)
+        return self.build_report
+
+    def load(self, keys, lazy = False, workers = None):
+        """
+        Bring the given tiles into memory (skipping loaded and missing ones)
+        and link their seams. lazy memory-maps them instead of reading them.
+        """
+        wanted = [ key for key in dict.fromkeys(keys) if key not in self.tiles ]
+        origins = [ tile_origin(key, self.tile_size) for key in wanted ]
+        present = [ (key, origin) for key, origin in zip(wanted, origins)
+                    if os.path.exists(wl.lattice_file_for_coords(*origin)) ]
+        if not present:
+            return []
+
+        if lazy:
+            lattices = [ wl.WorldLattice.open(*origin) for _, origin in present ]
+        else:
+            lattices = wl.WorldLattice.load_many([ origin for _, origin in present ], workers)
+        for (key, _), lattice in zip(present, lattices):
+            self.tiles[key] = lattice
+        for key, _ in present:
+            self.link_tile(key)
+        return [ key for key, _ in present ]
+
+    def link_tile(self, key):
+        kx, ky = key
+        links = 0
+        for axis, lower, upper in ((0, (kx - 1, ky), key), (0, key, (kx + 1, ky)),
+                                   (1, (kx, ky - 1), key), (1, key, (kx, ky + 1))):
+            if lower in self.tiles and upper in self.tiles:
+                links += link_seam(self.tiles[lower], self.tiles[upper], axis, self.tile_size)
+        return links
+
+    def region(self, lat0, lon0, lat1, lon1, lazy = False):
+        """
+        The tiles touched by a lat/lon box, loading only those.
+        """
+        keys = tiles_for_box(*self.box_for_latlon(lat0, lon0, lat1, lon1), self.tile_size)
+        self.load(keys, lazy)
+        return [ self.tiles[key] for key in keys if key in self.tiles ]
+
+    def tile_for(self, x, y):
+        key = tile_key(x, y, self.tile_size)
+        if key not in self.tiles:
+            self.load([ key ])
+        return self.tiles.get(key)
+
+    def retrieve(self, x, y, z):
+        """
+        Root DBit at global (x, y, z), loading its tile if needed.
+        """
+        tile = self.tile_for(x, y)
+        if tile is None:
+            return None
+        return tile.retrieve(x - tile.x, y - tile.y, z - tile.z)
+
+    def altitude_at(self, lats, lons, max_distance = None, k = 3):
+        """
+        WorldLattice.altitude_at over the tiles the points fall in, loading
+        them as needed. NaN where there is no tile.
+        """
+        lats = np.atleast_1d(np.asarray(lats, dtype = np.float64))
+        lons = np.atleast_1d(np.asarray(lons, dtype = np.float64))
+        alts = np.full(lats.shape, np.nan)
+        kx = wl.quantize(lats, self.precision_factor) // self.tile_size
+        ky = wl.quantize(lons, self.precision_factor) // self.tile_size
+        keys, inverse = np.unique(np.stack([ kx, ky ], axis = 1), axis = 0, return_inverse = True)
+        inverse = inverse.reshape(-1)
+        self.load([ tuple(key) for key in keys.tolist() ])
+        for group, key in enumerate(keys.tolist()):
+            tile = self.tiles.get(tuple(key))
+            if tile is not None:
+                points = inverse == group
+                alts[points] = tile.altitude_at(lats[points], lons[points], max_distance, k)
+        return alts
+
+    def unload(self, key):
+        """
+        Drop a tile from memory, cutting its seam links first.
+        """
+        tile = self.tiles.pop(key, None)
+        if tile is None:
+            return
+        kx, ky = key
+        for axis, below, above in ((0, (kx - 1, ky), (kx + 1, ky)), (1, (kx, ky - 1), (kx, ky + 1))):
+            name = 'xy'[axis]
+            if below in self.tiles:
+                for _, dbit in boundary_cells(self.tiles[below], axis, self.tile_size - 1):
+                    setattr(dbit.lbit1, name, None)
+            if above in self.tiles:
+                for _, dbit in boundary_cells(self.tiles[above], axis, 0):
+                    setattr(dbit.lbit0, name, None)
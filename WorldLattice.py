@@ -1,8 +1,16 @@
 import os
+import time
 import pickle
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
 import matplotlib
 import matplotlib.pyplot as plt
 from mapsloader import AlgorithmicMemory as am
+from mapsloader import LatticeFile as lf
+from mapsloader import ChunkIndex as ci
+from mapsloader import LatticePyramid as lp
+from mapsloader import LatticeQuery as lq
+from mapsloader import Grid
 matplotlib.use('WebAgg')
 
 main_directory = 'dbits'
@@ -11,7 +19,429 @@ def file_path_for_coords(x, y, z):
 
     return main_directory + '/' + str(x) + "_" + str(y) + "_" + str(z) + "_lattice"
 
-class WorldLattice:
+def lattice_file_for_coords(x, y, z):
+
+    return main_directory + '/' + str(x) + "_" + str(y) + "_" + str(z) + ".lattice"
+
+def journal_path(path):
+
+    return path + '.journal'
+
+def quantize(values, factor = 1):
+    """
+    Integer lattice coordinates of values * factor, floored, so negative
+    values land in the cell below them just like positive ones. Products
+    within 1e-6 of an integer snap to it first, so x / factor maps back to x.
+    """
+    scaled = np.asarray(values, dtype = np.float64) * factor
+    return np.floor(np.round(scaled, 6)).astype(np.int64)
+
+def run_pool(fn, items, workers = None, processes = False):
+    """
+    list(map(fn, items)) on a thread or process pool; inline for a single item.
+    """
+    if len(items) <= 1 or workers == 1:
+        return [ fn(item) for item in items ]
+    executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with executor(max_workers = workers) as pool:
+        return list(pool.map(fn, items))
+
+def restore_pyramid(header, arrays):
+
+    if not header.get('lod'):
+        return None
+    return lp.LatticePyramid.from_arrays(arrays, header['lod'])
+
+def load_report(files, vertices, seconds):
+
+    return {
+        'files': files,
+        'vertices': vertices,
+        'seconds': seconds,
+        'files_per_s': files / seconds if seconds else 0.0,
+        'vertices_per_s': vertices / seconds if seconds else 0.0,
+        }
+
+def payload_altitudes(payload, z):
+    """
+    Altitude of each vertex: the payload's 'alt' where it has one, z otherwise.
+    """
+    return np.array([ data['alt'] if isinstance(data, dict) and 'alt' in data else depth
+                      for data, depth in zip(payload, np.asarray(z).tolist()) ], dtype = np.float64)
+
+def payload_columns(payload, z):
+    """
+    lat, lon and altitude (see payload_altitudes) of each payload as float
+    arrays; lat and lon are NaN where it does not have both.
+    """
+    located = [ isinstance(data, dict) and 'lat' in data and 'lon' in data for data in payload ]
+    lat = np.array([ data['lat'] if ok else np.nan for data, ok in zip(payload, located) ], dtype = np.float64)
+    lon = np.array([ data['lon'] if ok else np.nan for data, ok in zip(payload, located) ], dtype = np.float64)
+    return lat, lon, payload_altitudes(payload, z)
+
+def mapped_columns(backing, box = None):
+    """
+    (coords, lat, lon, alt) of the rows of a MappedLattice that were not
+    faulted in yet, as payload_columns gives them. Numeric payload columns
+    are read straight from the file; nothing is turned into DBits. With box
+    (x0, y0, x1, y1), only rows of the chunks over it are read.
+    """
+    arrays = backing.arrays
+    loaded = np.array(sorted(backing.loaded), dtype = np.int64)
+    rows = np.arange(len(arrays['chunk'])) if box is None else backing.column_rows(*box)
+    rows = rows[~np.isin(arrays['chunk'][rows], loaded)]
+    coords = np.asarray(arrays['coords'][rows], dtype = np.int64).reshape(-1, 3)
+    spec = backing.header['payload']
+    if spec['kind'] != 'columns':
+        return (coords,) + payload_columns(backing.payload(rows), coords[:, 2])
+
+    kinds = { column['key']: column['kind'] for column in spec['columns'] }
+    def column(key, default):
+        if kinds.get(key) in ('int', 'float'):
+            return np.asarray(arrays['payload/' + key][rows], dtype = np.float64)
+        return default
+    missing = np.full(len(rows), np.nan)
+    return (coords, column('lat', missing), column('lon', missing),
+            column('alt', coords[:, 2].astype(np.float64)))
+
+def located_index(coords, lat, lon, alt, origin):
+    """
+    GridIndex over the vertices with a lat and lon, coords (local) shifted by origin.
+    """
+    keep = ~(np.isnan(lat) | np.isnan(lon))
+    return lq.GridIndex(lat[keep], lon[keep], alt[keep], coords[keep] + np.array(origin))
+
+def vertex_index(payload, coords, origin):
+    """
+    GridIndex over the vertices whose payload has a 'lat' and 'lon', with
+    coords (local) shifted by origin.
+    """
+    coords = np.asarray(coords, dtype = np.int64).reshape(-1, 3)
+    return located_index(coords, *payload_columns(payload, coords[:, 2]), origin)
+
+def grid_terrain(grid, index):
+    """
+    Altitudes of the indexed vertices sitting on the sampling grid as a dense
+    (grid_size + 1) x (grid_size + 1) array (see WorldLattice.terrain).
+    """
+    half = grid['grid_size'] // 2
+    dense = np.full((2 * half + 1, 2 * half + 1), np.nan)
+    i, j = Grid.grid_coordinates(grid, index.lat, index.lon)
+    ri, rj = np.rint(i), np.rint(j)
+    # vertices of other grids (earlier ingestions) are left to the index
+    on_grid = ((np.abs(i - ri) < 1e-3) & (np.abs(j - rj) < 1e-3)
+               & (np.abs(ri) <= half) & (np.abs(rj) <= half))
+    dense[ri[on_grid].astype(np.int64) + half, rj[on_grid].astype(np.int64) + half] = index.alt[on_grid]
+    return dense
+
+def chunk_view(dbits, key, version):
+    """
+    Freeze the stacks of one chunk of dbits; None if it holds no vertices.
+    """
+    cells = {}
+    for coords, root in dbits.iter_chunk(key):
+        stack = []
+        lbit = root.lbit0.other
+        while lbit is not root.lbit1:
+            stack.append(lbit.data)
+            if lbit.other is lbit.dbit.lbit1:
+                break
+            lbit = lbit.other
+        if stack:
+            cells[coords] = tuple(stack)
+    return ChunkView(version, cells) if cells else None
+
+class ChunkView:
+    """
+    The vertices of one chunk as of one snapshot version: cells maps local
+    (x, y, z) to the payloads stacked there, bottom first, and coords /
+    payload hold the same vertices as rows.
+    """
+    __slots__ = ('version', 'cells', 'coords', 'payload')
+
+    def __init__(self, version, cells):
+        self.version = version
+        self.cells = cells
+        self.coords = np.array([ coords for coords, stack in cells.items() for _ in stack ],
+                               dtype = np.int64).reshape(-1, 3)
+        self.payload = tuple(data for stack in cells.values() for data in stack)
+
+class MappedViews:
+    """
+    Bottom of the view layers of an opened lattice: the chunks that were
+    still only in the mapped file when its first snapshot was taken. Their
+    views are built from the file rows on first read, without faulting the
+    chunks in as DBits.
+    """
+
+    def __init__(self, backing, version):
+        self.backing = backing
+        self.version = version
+        # chunks faulted in later are overridden by the layers above
+        self.loaded = frozenset(backing.loaded)
+        self.count = len(backing.arrays['chunk']) - sum(
+            rows.stop - rows.start for rows in map(backing.chunk_rows, self.loaded))
+        self.cache = {}
+
+    def keys(self):
+        chunk = self.backing.arrays['chunk']
+        return [ ci.unpack_chunk_key(packed) for packed in np.unique(chunk).tolist()
+                 if packed not in self.loaded ]
+
+    def get(self, key):
+        packed = ci.pack_chunk_key(key)
+        if packed in self.loaded:
+            return None
+        view = self.cache.get(key)
+        if view is None:
+            rows = self.backing.chunk_rows(packed)
+            if rows.start == rows.stop:
+                return None
+            # file rows keep each cell's stack bottom first
+            cells = {}
+            for coords, data in zip(map(tuple, self.backing.arrays['coords'][rows].tolist()),
+                                    self.backing.payload(rows)):
+                cells.setdefault(coords, []).append(data)
+            view = self.cache[key] = ChunkView(self.version, { coords: tuple(stack)
+                                                               for coords, stack in cells.items() })
+        return view
+
+class ViewLayer:
+    """
+    Persistent chunk key -> ChunkView map behind a snapshot. A layer holds
+    the views of the chunks changed over a run of snapshots (None for a
+    chunk left without vertices) on top of its parent, so publishing a
+    snapshot copies only what changed. A layer is merged into its parent
+    once it is at least half the parent's size: reads cross O(log chunks)
+    layers and every view is copied O(log chunks) times in all.
+    """
+    __slots__ = ('views', 'parent')
+
+    def __init__(self, views, parent = None):
+        self.views = views
+        # the layer below, a MappedViews, or None
+        self.parent = parent
+
+    def get(self, key, default = None):
+        layer = self
+        while isinstance(layer, ViewLayer):
+            if key in layer.views:
+                view = layer.views[key]
+                return default if view is None else view
+            layer = layer.parent
+        view = None if layer is None else layer.get(key)
+        return default if view is None else view
+
+    def keys(self):
+        seen = set()
+        layer = self
+        while isinstance(layer, ViewLayer):
+            for key, view in layer.views.items():
+                if key not in seen:
+                    seen.add(key)
+                    if view is not None:
+                        yield key
+            layer = layer.parent
+        if layer is not None:
+            for key in layer.keys():
+                if key not in seen:
+                    yield key
+
+    def items(self):
+        for key in self.keys():
+            yield key, self.get(key)
+
+    def values(self):
+        for key in self.keys():
+            yield self.get(key)
+
+    def __len__(self):
+        return sum(1 for _ in self.keys())
+
+    def changed(self, views):
+        """
+        A new top layer with views (chunk key -> ChunkView or None) over this one.
+        """
+        parent = self
+        while isinstance(parent, ViewLayer) and 2 * len(views) >= len(parent.views):
+            merged = dict(parent.views)
+            merged.update(views)
+            views = merged
+            parent = parent.parent
+        if parent is None:
+            views = { key: view for key, view in views.items() if view is not None }
+        return ViewLayer(views, parent)
+
+# coords of a missing nearest neighbor; no lattice vertex can have it
+MISSING_COORD = np.iinfo(np.int64).min
+
+class LatticeQueries:
+    """
+    Lat/lon reads shared by WorldLattice and LatticeSnapshot, on top of
+    their query_index(), terrain() and grid.
+    """
+
+    def query_box(self, lat0, lon0, lat1, lon1):
+        """
+        Vertices inside lat/lon boxes. The bounds may be arrays (one box per
+        element); 'query' tells which box each returned vertex falls in.
+        """
+        index = self.query_index()
+        query, rows = index.box(lat0, lon0, lat1, lon1)
+        return { 'query': query, 'lat': index.lat[rows], 'lon': index.lon[rows],
+                 'alt': index.alt[rows], 'coords': index.coords[rows] }
+
+    def nearest(self, lats, lons, k = 1, max_distance = None):
+        """
+        The k nearest vertices to each (lat, lon), closest first, as (n, k)
+        arrays; 'distance' is the ground distance in meters. Missing
+        neighbors (fewer than k vertices, or none within max_distance
+        meters) have NaN position, inf distance and MISSING_COORD coords.
+        """
+        index = self.query_index()
+        rows, distances = index.nearest(lats, lons, k, max_distance)
+        missing = rows < 0
+        if index.count == 0:
+            empty = np.full(rows.shape, np.nan)
+            return { 'distance': distances, 'lat': empty, 'lon': empty, 'alt': empty,
+                     'coords': np.full(rows.shape + (3,), MISSING_COORD, dtype = np.int64) }
+        rows = np.where(missing, 0, rows)
+        return {
+            'distance': distances,
+            'lat': np.where(missing, np.nan, index.lat[rows]),
+            'lon': np.where(missing, np.nan, index.lon[rows]),
+            'alt': np.where(missing, np.nan, index.alt[rows]),
+            'coords': np.where(missing[..., None], MISSING_COORD, index.coords[rows]),
+            }
+
+    def altitude_at(self, lats, lons, max_distance = None, k = 3):
+        """
+        Altitude at arbitrary GPS points, as a float array. Points inside a
+        fully populated cell of the sampling grid are interpolated bilinearly
+        over the cached terrain() array; the rest get an inverse-distance
+        blend of their k nearest vertices, or NaN if the nearest is farther
+        than max_distance meters (default: two grid spacings, if there is
+        a grid).
+        """
+        lats = np.atleast_1d(np.asarray(lats, dtype = np.float64))
+        lons = np.atleast_1d(np.asarray(lons, dtype = np.float64))
+        alts = np.full(lats.shape, np.nan)
+
+        if self.grid is not None:
+            dense = self.terrain()
+            size = dense.shape[0]
+            half = size // 2
+            i, j = Grid.grid_coordinates(self.grid, lats, lons)
+            i += half
+            j += half
+            inside = (i >= 0) & (i <= size - 1) & (j >= 0) & (j <= size - 1)
+            i, j = i[inside], j[inside]
+            i0 = np.clip(np.floor(i).astype(np.int64), 0, size - 2)
+            j0 = np.clip(np.floor(j).astype(np.int64), 0, size - 2)
+            fi = i - i0
+            fj = j - j0
+            alts[inside] = ((dense[i0, j0] * (1 - fj) + dense[i0, j0 + 1] * fj) * (1 - fi)
+                            + (dense[i0 + 1, j0] * (1 - fj) + dense[i0 + 1, j0 + 1] * fj) * fi)
+            if max_distance is None:
+                max_distance = 2 * self.grid['spacing']
+
+        missing = np.flatnonzero(np.isnan(alts))
+        if len(missing):
+            near = self.nearest(lats[missing], lons[missing], k, max_distance)
+            distance = near['distance']
+            weight = 1 / np.maximum(distance, 1e-6) ** 2
+            weight[~np.isfinite(distance)] = 0
+            blend = (np.nansum(weight * near['alt'], axis = 1) / np.maximum(weight.sum(axis = 1), 1e-300))
+            blend[~np.isfinite(distance[:, 0])] = np.nan
+            alts[missing] = blend
+        return alts
+
+class LatticeSnapshot(LatticeQueries):
+    """
+    Point-in-time read view of a WorldLattice (see WorldLattice.snapshot),
+    in the lattice's local coordinates. Nothing in it changes after it is
+    made and reads never touch the DBits or the head, so any thread can
+    read it while the lattice goes on changing.
+    """
+
+    def __init__(self, version, origin, views, count, grid = None):
+        self.version = version
+        self.origin = origin
+        # chunk key -> ChunkView (a ViewLayer), sharing the layers and views
+        # of the chunks that did not change with the snapshots around it
+        self.views = views
+        self.count = count
+        self.grid = grid
+        self.index = None
+        self.surface = None
+
+    def get(self, x, y, z):
+        """
+        The payloads stacked at (x, y, z), bottom first; () if none.
+        """
+        view = self.views.get(ci.chunk_key(x, y, z))
+        if view is None:
+            return ()
+        return view.cells.get((x, y, z), ())
+
+    def vertices(self, lo = None, hi = None):
+        """
+        (coords, payload) of the vertices, or of those in the inclusive
+        box lo..hi.
+        """
+        if lo is None:
+            views = list(self.views.values())
+        else:
+            klo, khi = ci.chunk_key(*lo), ci.chunk_key(*hi)
+            views = [ self.views.get(key) for key in self.views.keys()
+                      if klo[0] <= key[0] <= khi[0] and klo[1] <= key[1] <= khi[1]
+                      and klo[2] <= key[2] <= khi[2] ]
+        coords = np.concatenate([ view.coords for view in views ]) if views else np.zeros((0, 3), dtype = np.int64)
+        payload = [ data for view in views for data in view.payload ]
+        if lo is not None:
+            keep = np.all((coords >= np.array(lo)) & (coords <= np.array(hi)), axis = 1)
+            coords = coords[keep]
+            payload = [ payload[n] for n in np.flatnonzero(keep).tolist() ]
+        return coords, payload
+
+    def query_index(self):
+
+        if self.index is None:
+            coords, payload = self.vertices()
+            self.index = vertex_index(payload, coords, self.origin)
+        return self.index
+
+    def terrain(self):
+
+        if self.surface is None:
+            self.surface = grid_terrain(self.grid, self.query_index())
+        return self.surface
+
+class MappedSnapshot(LatticeQueries):
+    """
+    Point-in-time lat/lon read view over a prebuilt GridIndex (see
+    WorldLattice.mapped_snapshot). It holds no per-chunk views.
+    """
+
+    def __init__(self, version, origin, index, grid = None):
+        self.version = version
+        self.origin = origin
+        self.index = index
+        self.count = index.count
+        self.grid = grid
+        self.surface = None
+
+    def query_index(self):
+
+        return self.index
+
+    def terrain(self):
+
+        if self.surface is None:
+            self.surface = grid_terrain(self.grid, self.index)
+        return self.surface
+
+class WorldLattice(LatticeQueries):
     def __init__(self, x, y, z, filepath = None):
         self.am = am.AlgorithmicMemory()
         self.x = x
@@ -19,14 +449,236 @@ class WorldLattice:
         self.z = z
         self.filepath = filepath
 
+        # set by open(): the memory-mapped file vertices are faulted in from
+        self.backing = None
+
+        # persisted state: generation of the base file, and base / journal
+        # sizes that decide when save_incremental compacts
+        self.generation = None
+        self.base_bytes = 0
+        self.journal_bytes = 0
+
+        # sampling grid of the map points (Grid.grid_spec), persisted
+        self.grid = None
+
+        # level-of-detail pyramid (LatticePyramid), built on first use, persisted
+        self.pyramid = None
+
+        # lat/lon index for box and nearest queries (LatticeQuery), built on
+        # first use and dropped on insert
+        self.index = None
+
+        # dense altitudes over the sampling grid for altitude_at, same lifetime
+        self.surface = None
+
+        # files/s and vertices/s of the load that produced this lattice
+        self.load_report = None
+
+        # latest read snapshot (LatticeSnapshot), see snapshot()
+        self.published = None
+
     def insert(self, data, x, y, z):
 
+        if self.backing is not None:
+            # persisted vertices of the cell go below the new one
+            self.fault_in(x-self.x, y-self.y, z-self.z)
+        if self.pyramid is not None:
+            self.pyramid.add(x-self.x, y-self.y, payload_altitudes([ data ], [ z-self.z ]))
+        self.index = None
+        self.surface = None
         return self.am.insert(data, x-self.x,  y-self.y, z-self.z)
 
+    def insert_batch(self, coords, payload):
+
+        coords = np.asarray(coords, dtype = np.int64).reshape(-1, 3) - np.array([self.x, self.y, self.z])
+        if self.backing is not None:
+            self.fault_in_chunks({ ci.chunk_key(*xyz) for xyz in coords.tolist() })
+        if self.pyramid is not None:
+            self.pyramid.add(coords[:, 0], coords[:, 1], payload_altitudes(payload, coords[:, 2]))
+        self.index = None
+        self.surface = None
+        return self.am.insert_many(coords, payload)
+
+    def prune_region(self, lo, hi):
+        """
+        Remove every vertex in the inclusive box lo..hi (same coordinates as
+        insert). Returns the number of DBits removed.
+        """
+        origin = np.array([ self.x, self.y, self.z ])
+        lo = tuple((np.asarray(lo) - origin).tolist())
+        hi = tuple((np.asarray(hi) - origin).tolist())
+        if self.backing is not None:
+            self.fault_in(*lo, *hi)
+        return self.am.prune_region(lo, hi)
+
+    def lod(self):
+        """
+        The level-of-detail pyramid with pending inserts folded in; rebuilt
+        from the vertices when DBits were removed since it was made.
+        """
+        if self.pyramid is None or self.pyramid.removed != self.am.removed:
+            coords, _, _, alt = self.columns()
+            self.pyramid = lp.LatticePyramid().build(coords[:, 0], coords[:, 1], alt)
+            self.pyramid.removed = self.am.removed
+        return self.pyramid.flush()
+
+    def query_index(self):
+        """
+        The GridIndex over the vertices with a 'lat' / 'lon' payload, rebuilt
+        after inserts and removals.
+        """
+        if self.index is None or self.index.removed != self.am.removed:
+            self.index = located_index(*self.columns(), (self.x, self.y, self.z))
+            self.index.removed = self.am.removed
+        return self.index
+
+    def columns(self, box = None):
+        """
+        (coords, lat, lon, alt) of every vertex, or of those in the local
+        inclusive box (x0, y0, x1, y1) at any z; coords are local, lat and lon
+        NaN where the payload has none. The rows of an opened lattice that
+        were not faulted in come from the mapped file without materializing.
+        """
+        if box is None:
+            dbits = self.am.dbit_list
+        else:
+            depth = ci.PACK_BIAS << ci.CHUNK_BITS
+            dbits = self.am.stacked(self.am.dbits.chunks_in_box((box[0], box[1], -depth),
+                                                                (box[2], box[3], depth - 1)))
+        coords = np.array([ (dbit.x, dbit.y, dbit.z) for dbit in dbits ], dtype = np.int64).reshape(-1, 3)
+        columns = (coords,) + payload_columns([ dbit.lbit0.data for dbit in dbits ], coords[:, 2])
+        if self.backing is not None:
+            columns = tuple(np.concatenate(pair) for pair in zip(columns, mapped_columns(self.backing, box)))
+        if box is not None:
+            coords = columns[0]
+            keep = ((coords[:, 0] >= box[0]) & (coords[:, 0] <= box[2])
+                    & (coords[:, 1] >= box[1]) & (coords[:, 1] <= box[3]))
+            columns = tuple(column[keep] for column in columns)
+        return columns
+
+    def mapped_snapshot(self):
+        """
+        Read view of a lattice opened with open(), for lat/lon queries: its
+        GridIndex built from the mapped columns, the file staying mapped
+        (see columns). Like a snapshot, reads never touch the DBits.
+        """
+        return MappedSnapshot(self.generation or 0, (self.x, self.y, self.z), self.query_index(), self.grid)
+
+    def terrain(self):
+        """
+        Altitudes of the vertices sitting on the sampling grid (self.grid) as
+        a dense (grid_size + 1) x (grid_size + 1) array indexed by offset
+        (i + grid_size // 2, j + grid_size // 2), NaN where there is none.
+        """
+        if self.surface is None or self.surface[0] != self.am.removed:
+            self.surface = (self.am.removed, grid_terrain(self.grid, self.query_index()))
+        return self.surface[1]
+
+    def overview(self, resolution = None, box = None):
+        """
+        Altitude summary on the coarsest level whose cells are no wider than
+        resolution lattice units: dict of x, y (cell corners), min, max, mean,
+        count arrays plus the level used. Level 0 is the vertices themselves.
+        box (x0, y0, x1, y1) is inclusive, in the same coordinates as insert.
+        """
+        if box is not None:
+            box = (box[0] - self.x, box[1] - self.y, box[2] - self.x, box[3] - self.y)
+        pyramid = self.lod()
+        level = pyramid.level_for(resolution)
+
+        if level:
+            cells = pyramid.cells(level, box)
+        else:
+            # only the chunks under the box are read
+            coords, _, _, alt = self.columns(box)
+            cells = { 'level': 0, 'x': coords[:, 0], 'y': coords[:, 1], 'min': alt, 'max': alt,
+                      'mean': alt, 'count': np.ones(len(alt), dtype = np.int64) }
+        cells['x'] = cells['x'] + self.x
+        cells['y'] = cells['y'] + self.y
+        return cells
+
+    def snapshot(self):
+        """
+        Publish a point-in-time read view of the lattice as self.published
+        and return it. Only the chunks whose stacks changed since the last
+        snapshot are frozen again, into a new ViewLayer over the previous
+        snapshot's; the others are shared with it. The chunks of an opened
+        lattice that were never faulted in are read from the mapped file
+        (see MappedViews). Call it from the thread that writes, between
+        writes; readers just take self.published.
+        """
+        memory = self.am
+        previous = self.published
+        changed, memory.changed = memory.changed, set()
+        if previous is not None and not changed and previous.grid is self.grid:
+            return previous
+
+        if previous is None:
+            version = 1
+            mapped = None if self.backing is None else MappedViews(self.backing, version)
+            layers = ViewLayer({}, mapped)
+            count = 0 if mapped is None else mapped.count
+            changed = memory.dbits.chunk_keys()
+        else:
+            version, layers, count = previous.version + 1, previous.views, previous.count
+        views = {}
+        for key in changed:
+            view = layers.get(key)
+            if view is not None:
+                count -= len(view.payload)
+            view = views[key] = chunk_view(memory.dbits, key, version)
+            if view is not None:
+                count += len(view.payload)
+
+        self.published = LatticeSnapshot(version, (self.x, self.y, self.z), layers.changed(views),
+                                         count, self.grid)
+        return self.published
+
     def get(self, x, y, z):
 
+        if self.backing is not None:
+            # the head window covers (x, y, z) .. (x + 2, y + 2, z + 2)
+            self.fault_in(x, y, z, x + 2, y + 2, z + 2)
         return self.am.move_head_abs(x, y, z)
 
+    def retrieve(self, x, y, z):
+
+        if self.backing is not None:
+            self.fault_in(x, y, z)
+        return self.am.retrieve(x, y, z)
+
+    def fault_in(self, x0, y0, z0, x1 = None, y1 = None, z1 = None):
+        """
+        Materialize the persisted chunks overlapping the box (x0, y0, z0) ..
+        (x1, y1, z1) that have not been loaded yet.
+        """
+        if x1 is None:
+            x1, y1, z1 = x0, y0, z0
+        (cx0, cy0, cz0), (cx1, cy1, cz1) = ci.chunk_key(x0, y0, z0), ci.chunk_key(x1, y1, z1)
+        self.fault_in_chunks([ (cx, cy, cz)
+                               for cx in range(cx0, cx1 + 1)
+                               for cy in range(cy0, cy1 + 1)
+                               for cz in range(cz0, cz1 + 1) ])
+
+    def fault_in_chunks(self, keys):
+
+        for key in keys:
+            rows = self.backing.take(key)
+            if rows is not None:
+                self.am.insert_many(*rows)
+
+    def materialize(self):
+        """
+        Load every chunk still only on disk and drop the mapping.
+        """
+        if self.backing is None:
+            return
+        for key in self.backing.chunk_keys():
+            rows = self.backing.take(key)
+            if rows is not None:
+                self.am.insert_many(*rows)
+        self.backing = None
+
     def serialize(self):
         directory = file_path_for_coords(self.x, self.y, self.z)
         if not os.path.exists(directory):
@@ -65,8 +717,187 @@ class WorldLattice:
                 write (file, dbit, 'lbit1', 'z')
                 write (file, dbit, 'lbit1', 'other')
 
+    def save(self, path = None):
+        """
+        Write the lattice as one columnar file (see LatticeFile). This is also
+        the compaction step for incremental saves: the journal is dropped.
+        """
+        if path is None:
+            path = lattice_file_for_coords(self.x, self.y, self.z)
+
+        # never write out a partially faulted-in lattice
+        self.materialize()
+
+        generation = (self.generation or 0) + 1
+        arrays, payload_spec = lf.encode_dbits(self.am.stacked())
+        pyramid = self.lod()
+        arrays.update(pyramid.arrays())
+
+        lf.write_lattice(path, arrays, {
+            'origin': [ self.x, self.y, self.z ],
+            'count': len(self.am.dbit_list),
+            'payload': payload_spec,
+            'generation': generation,
+            'grid': self.grid,
+            'lod': pyramid.depth,
+            })
+        if os.path.exists(journal_path(path)):
+            os.remove(journal_path(path))
+
+        self.am.clear_dirty()
+        self.generation = generation
+        self.base_bytes = os.path.getsize(path)
+        self.journal_bytes = 0
+        return path
+
+    def save_incremental(self, path = None, compact_ratio = 0.5):
+        """
+        Append the DBits inserted and removed since the last save to the
+        journal next to the lattice file, so save time follows the size of
+        the change. Falls back to a full save when there is no base file for
+        this lattice yet, and compacts once the journal grows past
+        compact_ratio times the base file.
+        """
+        if path is None:
+            path = lattice_file_for_coords(self.x, self.y, self.z)
+
+        if self.generation is None or not os.path.exists(path):
+            return self.save(path)
+
+        dirty = list(self.am.dirty.values())
+        deleted = self.am.deleted
+        if not dirty and not deleted:
+            return path
+
+        arrays, payload_spec = lf.encode_dbits(dirty)
+        arrays['deleted_tr'] = np.array(list(deleted.keys()), dtype = np.int64)
+        arrays['deleted_coords'] = np.array(list(deleted.values()), dtype = np.int64).reshape(-1, 3)
+
+        self.journal_bytes += lf.append_journal(journal_path(path), arrays, {
+            'origin': [ self.x, self.y, self.z ],
+            'count': len(dirty),
+            'payload': payload_spec,
+            'generation': self.generation,
+            })
+        self.am.clear_dirty()
+
+        if self.journal_bytes > compact_ratio * self.base_bytes:
+            self.save(path)
+        return path
+
+    def compact(self, path = None):
+
+        return self.save(path)
+
+    def replay_journal(self, path):
+        """
+        Apply the journal records written against the current base generation.
+        """
+        for header, arrays in lf.read_journal(journal_path(path)):
+            if header.get('generation') != self.generation:
+                continue
+
+            coords = arrays['coords']
+            deleted_coords = arrays['deleted_coords']
+            if self.backing is not None:
+                # bring in the chunks the record touches so stacking order
+                # and deletions line up with the base file
+                touched = np.concatenate([ coords, deleted_coords ])
+                self.fault_in_chunks({ ci.chunk_key(*xyz) for xyz in touched.tolist() })
+
+            if len(coords):
+                payload = lf.decode_payload(arrays, header['payload'])
+                if self.pyramid is not None:
+                    self.pyramid.add(coords[:, 0], coords[:, 1], payload_altitudes(payload, coords[:, 2]))
+                self.am.insert_many(coords, payload, arrays['tr'])
+                self.index = None
+                self.surface = None
+            for tr, (x, y, z) in zip(arrays['deleted_tr'].tolist(), deleted_coords.tolist()):
+                dbit = self.am.find_stacked(x, y, z, tr)
+                if dbit is not None:
+                    self.am.unstack(dbit)
+
+        self.am.clear_dirty()
+        self.journal_bytes = os.path.getsize(journal_path(path)) if os.path.exists(journal_path(path)) else 0
+
+    @staticmethod
+    def load(xrequest, yrequest, zrequest, path = None):
+        """
+        Read a lattice written by save() and replay its journal. Raises
+        FileNotFoundError if there is none.
+        """
+        if path is None:
+            path = lattice_file_for_coords(xrequest, yrequest, zrequest)
+
+        header, arrays = lf.read_lattice(path)
+
+        wl = WorldLattice(xrequest, yrequest, zrequest)
+        wl.am.insert_many(arrays['coords'], lf.decode_payload(arrays, header['payload']),
+                          arrays['tr'])
+        wl.generation = header.get('generation', 0)
+        wl.grid = header.get('grid')
+        wl.pyramid = restore_pyramid(header, arrays)
+        wl.base_bytes = os.path.getsize(path)
+        wl.replay_journal(path)
+        return wl
+
     @staticmethod
-    def deserialize(xrequest, yrequest, zrequest):
+    def open(xrequest, yrequest, zrequest, path = None):
+        """
+        Memory-map a lattice written by save() without loading it. Vertices
+        are created chunk by chunk as get/retrieve reach them, so startup
+        cost and resident memory follow the queried region, not the map.
+        """
+        if path is None:
+            path = lattice_file_for_coords(xrequest, yrequest, zrequest)
+
+        wl = WorldLattice(xrequest, yrequest, zrequest)
+        wl.backing = lf.MappedLattice(path)
+        wl.generation = wl.backing.header.get('generation', 0)
+        wl.grid = wl.backing.header.get('grid')
+        wl.pyramid = restore_pyramid(wl.backing.header, wl.backing.arrays)
+        wl.base_bytes = os.path.getsize(path)
+        wl.replay_journal(path)
+        return wl
+
+    @staticmethod
+    def load_many(origins, workers = None, processes = False):
+        """
+        Load several lattice files (e.g. tiles) at once. Reading and decoding
+        run in a thread pool (or a process pool), building the lattices and
+        replaying journals happens here. Returns the lattices in origin order.
+        """
+        start = time.perf_counter()
+        paths = [ lattice_file_for_coords(*origin) for origin in origins ]
+        decoded = run_pool(lf.decode_lattice_file, paths, workers, processes)
+
+        lattices = []
+        vertices = 0
+        for origin, path, (header, coords, payload, trs, extra) in zip(origins, paths, decoded):
+            wl = WorldLattice(*origin)
+            wl.am.insert_many(coords, payload, trs)
+            wl.generation = header.get('generation', 0)
+            wl.grid = header.get('grid')
+            wl.pyramid = restore_pyramid(header, extra)
+            wl.base_bytes = os.path.getsize(path)
+            wl.replay_journal(path)
+            vertices += len(coords)
+            lattices.append(wl)
+
+        report = load_report(len(paths), vertices, time.perf_counter() - start)
+        for wl in lattices:
+            wl.load_report = report
+        return lattices
+
+    @staticmethod
+    def deserialize(xrequest, yrequest, zrequest, workers = None, processes = False,
+                    batch_size = 256):
+        """
+        Read a per-DBit pickle directory written by serialize(). Files are
+        decoded in batches on a worker pool and inserted in one bulk pass;
+        throughput ends up in the returned lattice's load_report.
+        """
+        start = time.perf_counter()
 
         directory = file_path_for_coords(xrequest, yrequest, zrequest)
 
@@ -75,52 +906,28 @@ class WorldLattice:
         if not os.path.exists(directory):
             os.mkdir(directory)
 
-        latdir = os.listdir(directory)
-
-        # Loop through all files in the directory
-        for filename in latdir:
-            file_path = os.path.join(directory, filename)
-
-            # Check if it's a file (not a directory)
-            if os.path.isfile(file_path):
-                with open(file_path, 'rb') as file:
-                    print(f"Reading {filename}:")
-                    
-                    x = pickle.load(file)
-                    y = pickle.load(file)
-                    z = pickle.load(file)
-                    
-                    lbit0tr = pickle.load(file)
-                    lbit0data = pickle.load(file)
-                    lbit0x = pickle.load(file)
-                    lbit0y = pickle.load(file)
-                    lbit0z = pickle.load(file)
-                    lbit0other = pickle.load(file)
-
-                    # lbit0 = am.LBit(lbit0tr, lbit0other, lbit0x, lbit0y, lbit0z)
-
-                    lbit1tr = pickle.load(file)
-                    lbit1data = pickle.load(file)
-                    lbit1x = pickle.load(file)
-                    lbit1y = pickle.load(file)
-                    lbit1z = pickle.load(file)
-                    lbit1other = pickle.load(file)
-                    
-                    # lbit1 = am.LBit(lbit1tr, lbit1other, lbit1x, lbit1y, lbit1z)
-
-                    # create a dictionary of lbits
-                    #
-                    #  HERE
-                    #
-
-                    rv = wl.am.insert(lbit0data, x, y, z)
+        paths = [ entry.path for entry in os.scandir(directory) if entry.is_file() ]
+        batches = [ paths[i:i + batch_size] for i in range(0, len(paths), batch_size) ]
+
+        decoded = run_pool(lf.decode_dbit_files, batches, workers, processes)
+
+        if decoded:
+            wl.am.insert_many(np.concatenate([ coords for coords, _, _ in decoded ]),
+                              [ data for _, payload, _ in decoded for data in payload ],
+                              np.concatenate([ trs for _, _, trs in decoded ]))
 
+        wl.load_report = load_report(len(paths), len(wl.am.dbit_list), time.perf_counter() - start)
         return wl
 
-    def visualize_lattice(self):
+    def visualize_lattice(self, resolution = None):
         """
         Visualize the 3D lattice using matplotlib, showing altitude as text.
+        With resolution (lattice units), plot the coarsest LOD level that
+        meets it instead of every vertex.
         """
+        if resolution is not None and self.lod().level_for(resolution):
+            return self.visualize_overview(resolution)
+
         fig = plt.figure()
         ax = fig.add_subplot(111, projection='3d')
 
@@ -136,7 +943,8 @@ class WorldLattice:
             #     continue
             # dbit = dbit.lbit0.other.dbit
 
-            print("dbit in viz ", dbit.lbit0.data)
+            if am.verbosity > 3:
+                print("dbit in viz ", dbit.lbit0.data)
             x_coords.append(dbit.lbit0.data['lat'])
             y_coords.append(dbit.lbit0.data['lon'])
             z_coords.append(dbit.lbit0.data['alt'])
@@ -158,6 +966,23 @@ class WorldLattice:
 
         plt.show()
 
+    def visualize_overview(self, resolution):
+
+        cells = self.overview(resolution)
+        size = 1 << cells['level']
+
+        fig = plt.figure()
+        ax = fig.add_subplot(111, projection='3d')
+        ax.scatter(cells['x'] + size / 2, cells['y'] + size / 2, cells['mean'],
+                   c = cells['max'] - cells['min'], cmap = 'viridis', s = 20)
+
+        ax.set_xlabel('Lattice x')
+        ax.set_ylabel('Lattice y')
+        ax.set_zlabel('Mean altitude (m)')
+        ax.set_title(f"Lattice overview, level {cells['level']} ({size} x {size} cells)")
+
+        plt.show()
+
 
 # wl = WorldLattice('wl.wl')
 
@@ -0,0 +1,49 @@
+import json
+import threading
+import pytest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        stub = self.server.stub
+        query = { name: values[0] for name, values in parse_qs(urlparse(self.path).query).items() }
+        with stub.lock:
+            stub.requests.append(self.path)
+        status, body = stub.answer(query)
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class Stub:
+    """
+    A local Google Maps web service. answer(query dict) -> (status, JSON body).
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.url = 'http://127.0.0.1:%d/json' % server.server_address[1]
+        self.requests = []
+        self.lock = threading.Lock()
+        self.answer = lambda query: (500, {})
+
+
+@pytest.fixture
+def stub():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    server.stub = Stub(server)
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    yield server.stub
+    server.shutdown()
+    server.server_close()
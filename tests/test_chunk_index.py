@@ -0,0 +1,65 @@
+import pytest
+import numpy as np
+from mapsloader import ChunkIndex as ci
+
+
+def test_set_get_delete_across_chunk_boundaries():
+    index = ci.ChunkIndex()
+    cells = [ (15, 0, 0), (16, 0, 0), (15, 15, 15), (16, 16, 16), (31, 32, 0) ]
+    for n, cell in enumerate(cells):
+        index[cell] = n
+    assert len(index) == len(cells)
+    assert len(index.chunk_keys()) == 4
+    assert [ index[cell] for cell in cells ] == list(range(len(cells)))
+    assert (17, 0, 0) not in index and index.get((17, 0, 0)) is None
+
+    index[(16, 0, 0)] = 'replaced'
+    assert len(index) == len(cells) and index[(16, 0, 0)] == 'replaced'
+    del index[(15, 0, 0)]
+    assert (15, 0, 0) not in index and (16, 0, 0) in index
+    with pytest.raises(KeyError):
+        index[(15, 0, 0)]
+    with pytest.raises(KeyError):
+        del index[(15, 0, 0)]
+    assert sorted(index) == sorted(cells[1:])
+
+
+def test_negative_coordinates():
+    index = ci.ChunkIndex()
+    cells = [ (-1, -1, -1), (-16, 0, 0), (-17, 0, 0), (0, -16, 15) ]
+    for n, cell in enumerate(cells):
+        index[cell] = n
+    # -1 lives in chunk -1 at local 15, -17 in chunk -2 at local 15
+    assert ci.chunk_key(-1, -16, -17) == (-1, -1, -2)
+    assert index.chunk(-1, -1, -1).key == (-1, -1, -1)
+    assert index.chunk(-17, 0, 0).slots[15, 0, 0] == 2
+    assert dict(index.items()) == { cell: n for n, cell in enumerate(cells) }
+    assert (1, 1, 1) not in index and (-2, -1, -1) not in index
+
+    packed = ci.pack_chunk_keys(np.array(cells))
+    assert [ ci.unpack_chunk_key(int(key)) for key in packed ] == [ ci.chunk_key(*cell) for cell in cells ]
+    assert ci.pack_chunk_key((-1, -1, -1)) == packed[0]
+
+
+def test_drop_chunk_keeps_count():
+    index = ci.ChunkIndex()
+    for x in range(40):
+        index[(x, 0, 0)] = x
+    assert len(index) == 40
+
+    chunk = index.drop_chunk((1, 0, 0))
+    assert chunk.count == 16 and len(index) == 24
+    assert (16, 0, 0) not in index and (15, 0, 0) in index
+    assert index.drop_chunk((1, 0, 0)) is None and len(index) == 24
+    assert sorted(index.chunks_in_box((0, 0, 0), (47, 0, 0))) == [ (0, 0, 0), (2, 0, 0) ]
+
+
+def test_empty_chunks_removed():
+    index = ci.ChunkIndex()
+    index[(5, 5, 5)] = 'a'
+    index[(6, 5, 5)] = 'b'
+    del index[(5, 5, 5)]
+    assert index.chunk_keys() == [ (0, 0, 0) ]
+    del index[(6, 5, 5)]
+    assert index.chunk_keys() == [] and len(index) == 0
+    assert index.chunk(5, 5, 5) is None and list(index.iter_chunk((0, 0, 0))) == []
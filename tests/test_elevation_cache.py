@@ -0,0 +1,77 @@
+import numpy as np
+from mapsloader import ElevationCache as ecache
+from mapsloader import ElevationClient as ec
+from test_elevation_client import answer_elevations, elevation, query_points_of
+
+
+def test_points_within_quantum_share_an_entry(tmp_path):
+    cache = ecache.ElevationCache(str(tmp_path / 'elevation.sqlite'))
+    fetched = []
+
+    def fetch(points):
+        fetched.extend(points)
+        return [ 1000.0 + n for n in range(len(points)) ]
+
+    # 1e-5 degrees apart at most, and in the same quantum
+    assert cache.get_altitudes([ (40.000011, -110.000021), (40.000019, -110.000029) ], fetch) == [ 1000.0, 1000.0 ]
+    assert fetched == [ (40.000011, -110.000021) ]
+    assert cache.get_altitudes([ (40.000015, -110.000025) ], fetch) == [ 1000.0 ]
+    # the next quantum over is a different entry
+    assert cache.get_altitudes([ (40.000021, -110.000021) ], fetch) == [ 1000.0 ]
+    assert len(fetched) == 2 and len(cache.lru) == 2
+
+
+def test_entries_survive_reopening(tmp_path):
+    path = str(tmp_path / 'elevation.sqlite')
+    cache = ecache.ElevationCache(path)
+    locations = [ (40 + n * 1e-3, -110.0) for n in range(1000) ]
+    cache.get_altitudes(locations, lambda points: [ lat for lat, _ in points ])
+    cache.close()
+
+    reopened = ecache.ElevationCache(path)
+    alts = reopened.get_altitudes(locations, lambda points: [ -1.0 ] * len(points))
+    assert np.allclose(alts, [ lat for lat, _ in locations ])
+    assert reopened.stats()['disk_hits'] == 1000 and reopened.stats()['misses'] == 0
+
+
+def test_lru_evicts_least_recently_used():
+    lru = ecache.LRUCache(capacity = 3)
+    for key in 'abc':
+        lru.put(key, key.upper())
+    assert lru.get('a') == 'A'
+    lru.put('d', 'D')
+    assert 'b' not in lru and list(lru.entries) == [ 'c', 'a', 'd' ]
+    lru.put('c', 'C2')
+    lru.put('e', 'E')
+    assert list(lru.entries) == [ 'd', 'c', 'e' ] and lru.get('c') == 'C2'
+    assert lru.get('a') is None and len(lru) == 3
+
+
+def test_hit_and_miss_stats(tmp_path):
+    path = str(tmp_path / 'elevation.sqlite')
+    cache = ecache.ElevationCache(path, lru_size = 2)
+    fetch = lambda points: [ 0.0 ] * len(points)
+    locations = [ (40.0 + n * 1e-3, -110.0) for n in range(4) ]
+
+    cache.get_altitudes(locations, fetch)
+    assert cache.stats()['misses'] == 4 and cache.stats()['hit_ratio'] == 0.0
+    # the LRU holds the last two, the other two come back from SQLite
+    cache.get_altitudes(locations, fetch)
+    stats = cache.stats()
+    assert (stats['memory_hits'], stats['disk_hits'], stats['misses']) == (2, 2, 4)
+    assert stats['hit_ratio'] == 0.5 and stats['lru_entries'] == 2
+
+
+def test_client_requests_only_misses(stub, tmp_path):
+    stub.answer = answer_elevations
+    cache = ecache.ElevationCache(str(tmp_path / 'elevation.sqlite'))
+    client = ec.ElevationClient('key', base_url = stub.url, workers = 1)
+    cached = [ (40.0 + n * 1e-3, -110.0) for n in range(10) ]
+    cache.get_altitudes(cached, client.get_altitudes)
+    stub.requests.clear()
+
+    missing = [ (41.0 + n * 1e-3, -110.0) for n in range(5) ]
+    locations = [ point for pair in zip(cached, missing) for point in pair ] + missing
+    assert cache.get_altitudes(locations, client.get_altitudes) == [ elevation(*point) for point in locations ]
+    assert len(stub.requests) == 1
+    assert query_points_of(stub.requests[0]) == missing
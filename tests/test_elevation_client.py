@@ -0,0 +1,138 @@
+import time
+import random
+import pytest
+import numpy as np
+from urllib.parse import urlparse, parse_qs
+from mapsloader import ElevationClient as ec
+
+
+def decode_polyline(encoded):
+
+    points = []
+    index = lat = lon = 0
+    while index < len(encoded):
+        deltas = []
+        for _ in range(2):
+            shift = value = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                value |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(value >> 1) if value & 1 else value >> 1)
+        lat += deltas[0]
+        lon += deltas[1]
+        points.append((lat / 1e5, lon / 1e5))
+    return points
+
+
+def query_points(query):
+
+    locations = query['locations']
+    if locations.startswith('enc:'):
+        return decode_polyline(locations[4:])
+    return [ tuple(map(float, point.split(','))) for point in locations.split('|') ]
+
+
+def query_points_of(path):
+
+    return query_points({ 'locations': parse_qs(urlparse(path).query)['locations'][0] })
+
+
+def elevation(lat, lon):
+
+    return float(round(lat * 1e5) - 2 * round(lon * 1e5))
+
+
+def answer_elevations(query):
+
+    points = query_points(query)
+    if len(points) > ec.MAX_LOCATIONS:
+        return 200, { 'status': 'INVALID_REQUEST', 'results': [] }
+    return 200, { 'status': 'OK', 'results': [ { 'elevation': elevation(*point) } for point in points ] }
+
+
+def grid_points(n, seed = 0):
+
+    rng = np.random.default_rng(seed)
+    lats = rng.integers(4000000, 4010000, n) / 1e5
+    lons = rng.integers(-11010000, -11000000, n) / 1e5
+    return list(zip(lats.tolist(), lons.tolist()))
+
+
+def test_batches_split_at_location_count(stub):
+    stub.answer = answer_elevations
+    locations = grid_points(1300)
+    client = ec.ElevationClient('key', base_url = stub.url, workers = 1)
+
+    assert client.batches(locations) == [ (0, 512), (512, 1024), (1024, 1300) ]
+    assert client.get_altitudes(locations) == [ elevation(*point) for point in locations ]
+    assert sorted(len(query_points_of(path)) for path in stub.requests) == [ 276, 512, 512 ]
+
+
+def test_batches_split_at_url_length(stub):
+    stub.answer = answer_elevations
+    # full-precision coordinates make 512 points longer than the URL limit
+    rng = np.random.default_rng(1)
+    locations = list(zip(rng.uniform(40, 41, 1000).tolist(), rng.uniform(-111, -110, 1000).tolist()))
+    client = ec.ElevationClient('key', base_url = stub.url, workers = 1)
+
+    ranges = client.batches(locations)
+    assert len(ranges) > 2 and all(end - start < ec.MAX_LOCATIONS for start, end in ranges)
+    assert [ start for start, _ in ranges[1:] ] == [ end for _, end in ranges[:-1] ]
+    client.get_altitudes(locations)
+    lengths = [ len(stub.url) - len('/json') + len(path) for path in stub.requests ]
+    assert len(lengths) == len(ranges) and max(lengths) <= ec.MAX_URL_LENGTH
+    # each batch but the last is cut only once the next point would not fit
+    assert min(lengths[:-1]) > ec.MAX_URL_LENGTH - 100
+
+
+@pytest.mark.parametrize('failure', [ (503, {}), (200, { 'status': 'OVER_QUERY_LIMIT' }) ])
+def test_retries_with_backoff(stub, failure):
+    failures = [ failure ] * 3
+    stub.answer = lambda query: failures.pop() if failures else answer_elevations(query)
+    client = ec.ElevationClient('key', base_url = stub.url, max_retries = 3, backoff = 0.01)
+
+    started = time.perf_counter()
+    assert client.get_altitudes([ (40.0, -110.0) ]) == [ elevation(40.0, -110.0) ]
+    # backoff doubles: at least 0.01 + 0.02 + 0.04 seconds of waiting
+    assert time.perf_counter() - started >= 0.07
+    assert len(stub.requests) == 4
+
+
+@pytest.mark.parametrize('failure', [ (503, {}), (200, { 'status': 'OVER_QUERY_LIMIT' }) ])
+def test_retries_give_up(stub, failure):
+    stub.answer = lambda query: failure
+    client = ec.ElevationClient('key', base_url = stub.url, max_retries = 2, backoff = 0.001)
+
+    with pytest.raises(ec.ElevationError):
+        client.get_altitudes([ (40.0, -110.0) ])
+    assert len(stub.requests) == 3
+
+
+def test_concurrent_batches_keep_input_order(stub):
+
+    def answer(query):
+        # later batches tend to finish first
+        points = query_points(query)
+        time.sleep(0.05 * random.random() * (points[0][0] < 40.05))
+        return answer_elevations(query)
+
+    stub.answer = answer
+    locations = sorted(grid_points(400, seed = 2))
+    client = ec.ElevationClient('key', base_url = stub.url, max_locations = 10, workers = 8)
+    assert client.get_altitudes(locations) == [ elevation(*point) for point in locations ]
+    assert len(stub.requests) == 40
+
+
+def test_polyline_matches_plain_locations(stub):
+    stub.answer = answer_elevations
+    locations = grid_points(1500, seed = 3) + [ (-33.86785, 151.20732), (0.0, 0.0) ]
+    plain = ec.ElevationClient('key', base_url = stub.url, workers = 4)
+    polyline = ec.ElevationClient('key', base_url = stub.url, workers = 4, polyline = True)
+
+    assert polyline.get_altitudes(locations) == plain.get_altitudes(locations)
+    assert any('enc%3A' in path for path in stub.requests)
+    assert polyline.get_altitudes(locations) == [ elevation(*point) for point in locations ]
@@ -0,0 +1,52 @@
+import pytest
+import numpy as np
+from mapsloader import ElevationProvider as ep
+from mapsloader.ElevationClient import ElevationError
+
+# N40W111, 5 x 5 samples, a quarter degree apart
+TILE = np.array([ [ 10, 20, 30, 40, 50 ],
+                  [ 15, 25, 60, 80, 55 ],
+                  [ 20, 30, 90, 10, 60 ],
+                  [ 25, 35, 45, 55, 65 ],
+                  [ 30, 40, 50, 60, 70 ] ])
+
+
+@pytest.fixture
+def dem(tmp_path):
+    ep.write_hgt(str(tmp_path), 40, -111, TILE)
+    # the eastern neighbour shares the edge column, and has a void
+    east = np.full((5, 5), 100)
+    east[:, 0] = TILE[:, 4]
+    east[2, 2] = ep.HGT_VOID
+    ep.write_hgt(str(tmp_path), 40, -110, east)
+    return ep.DEMElevationProvider(str(tmp_path))
+
+
+def test_bilinear_inside_tile(dem):
+    lats = [ 40.625, 40.875, 40.5 ]
+    lons = [ -110.4375, -110.875, -110.25 ]
+    # (60 * .75 + 80 * .25) * .5 + (90 * .75 + 10 * .25) * .5, a cell mean, a sample
+    assert dem.elevations(lats, lons).tolist() == [ 67.5, 17.5, 10.0 ]
+
+
+def test_bilinear_on_tile_edges(dem):
+    lats = [ 41.0, 40.0, 40.875, 40.0, 41.0, 40.5 ]
+    lons = [ -111.0, -110.875, -110.0, -110.0, -109.0, -110.0 ]
+    assert dem.elevations(lats, lons).tolist() == [ 10.0, 35.0, 52.5, 70.0, 100.0, 60.0 ]
+    # halfway into the eastern tile, between the shared edge and its constant columns
+    assert dem.elevations([ 40.75 ], [ -109.875 ]).tolist() == [ (55 + 100) / 2 ]
+
+
+def test_outside_tiles_and_voids_are_nan(dem):
+    lats = [ 42.0, 40.5, 39.999, 40.5, 40.5 ]
+    lons = [ -110.5, -111.5, -110.5, -108.5, -109.5 ]
+    assert np.isnan(dem.elevations(lats, lons)).all()
+    assert dem.elevations([ 40.875 ], [ -109.875 ]).tolist() == [ (55 + 50 + 100 + 100) / 4 ]
+    with pytest.raises(ElevationError):
+        dem.get_altitudes([ (40.5, -110.5), (42.0, -110.5) ])
+    assert dem.get_altitudes([ (40.5, -110.25) ]) == [ 10.0 ]
+
+
+def test_provider_is_abstract():
+    with pytest.raises(TypeError):
+        ep.ElevationProvider()
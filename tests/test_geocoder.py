@@ -0,0 +1,65 @@
+import pytest
+from mapsloader import Geocoder as gc
+
+
+def answer_geocode(query):
+
+    address = query['address']
+    if address == 'nowhere':
+        return 200, { 'status': 'ZERO_RESULTS', 'results': [] }
+    location = { 'lat': 40.0 + len(address) * 1e-3, 'lng': -110.0 - len(address) * 1e-3 }
+    return 200, { 'status': 'OK', 'results': [ { 'geometry': { 'location': location } } ] }
+
+
+def located(address):
+
+    return answer_geocode({ 'address': gc.normalize_address(address) })[1]['results'][0]['geometry']['location']
+
+
+def test_normalization_maps_variants_to_one_key():
+    key = gc.normalize_address('1600 Amphitheatre Pkwy, Mountain View, CA')
+    assert key == '1600 amphitheatre pkwy, mountain view, ca'
+    for variant in [ '  1600  AMPHITHEATRE Pkwy,Mountain View ,  ca ',
+                     '1600 Amphitheatre\tPkwy,\nMountain   View, CA.',
+                     '1600 amphitheatre pkwy,, mountain view, ca' ]:
+        assert gc.normalize_address(variant) == key
+
+
+def test_geocode_many_dedupes_before_fetching(stub, tmp_path):
+    stub.answer = answer_geocode
+    coder = gc.Geocoder('key', str(tmp_path / 'geocode.sqlite'), base_url = stub.url)
+    addresses = [ 'Salt Lake City, UT', 'salt lake city,ut', 'Denver, CO',
+                  'SALT  LAKE CITY, UT', 'Reno, NV', 'denver, co' ]
+
+    locations = coder.geocode_many(addresses)
+    assert len(stub.requests) == 3
+    assert locations == [ (located(address)['lat'], located(address)['lng']) for address in addresses ]
+    assert locations[0] == locations[1] == locations[3] and locations[2] == locations[5]
+    assert coder.stats()['misses'] == 3
+
+
+def test_cached_addresses_need_no_network(stub, tmp_path):
+    stub.answer = answer_geocode
+    path = str(tmp_path / 'geocode.sqlite')
+    coder = gc.Geocoder('key', path, base_url = stub.url)
+    first = coder.geocode_many([ 'Reno, NV', 'Denver, CO' ])
+    coder.close()
+
+    # the stub is gone: any request would fail
+    stub.answer = lambda query: (500, {})
+    offline = gc.Geocoder('key', path, base_url = stub.url, max_retries = 0)
+    assert offline.geocode_many([ 'reno,nv', 'DENVER, CO' ]) == first
+    assert offline.geocode('Reno, NV') == first[0]
+    assert len(stub.requests) == 2
+    stats = offline.stats()
+    assert (stats['disk_hits'], stats['memory_hits'], stats['misses']) == (2, 1, 0)
+
+    with pytest.raises(gc.GeocodeError):
+        offline.geocode('Boise, ID')
+
+
+def test_unknown_address_raises(stub, tmp_path):
+    stub.answer = answer_geocode
+    coder = gc.Geocoder('key', str(tmp_path / 'geocode.sqlite'), base_url = stub.url)
+    with pytest.raises(gc.GeocodeError):
+        coder.geocode('Nowhere')
@@ -0,0 +1,64 @@
+import pytest
+import numpy as np
+from mapsloader import Grid
+from mapsloader import MapsLoader as ml
+
+
+@pytest.mark.parametrize('shape, count', [ ('diamond', 61), ('square', 121), ('circle', 81) ])
+def test_mask_shapes(shape, count):
+    i, j = Grid.grid_indices(10, shape)
+    assert len(i) == count
+    cells = set(zip(i.tolist(), j.tolist()))
+    assert { (5, 0), (0, -5), (-5, 0), (0, 5), (0, 0) } <= cells
+    assert ((3, 3) in cells) == (shape != 'diamond')
+    assert ((5, 5) in cells) == (shape == 'square')
+    # row-major
+    assert np.all(np.diff(i) >= 0)
+
+    lats, lons = Grid.make_grid(40, -110, 10, shape = shape)
+    assert lats.shape == lons.shape == (count,)
+
+
+def test_unknown_shape_rejected():
+    with pytest.raises(ValueError):
+        Grid.grid_spec(40, -110, shape = 'hexagon')
+
+
+def test_rotation():
+    spacing = Grid.METERS_PER_DEGREE * 1e-3
+    north = Grid.grid_spec(40, -110, 2, spacing, rotation = 0, shape = 'square')
+    east = dict(north, rotation = 90)
+    turned = dict(north, rotation = 45)
+    degree = np.cos(np.radians(40))
+
+    # offset i points north without rotation, east once turned 90 degrees
+    assert np.allclose(Grid.grid_points(north, [ 1 ], [ 0 ]), ([ 40.001 ], [ -110 ]))
+    assert np.allclose(Grid.grid_points(east, [ 1 ], [ 0 ]), ([ 40 ], [ -110 + 1e-3 / degree ]))
+    assert np.allclose(Grid.grid_points(east, [ 0 ], [ 1 ]), ([ 40 - 1e-3 ], [ -110 ]))
+    lats, lons = Grid.grid_points(turned, [ 1 ], [ 0 ])
+    assert np.allclose([ lats[0] - 40, (lons[0] + 110) * degree ], [ 1e-3 / 2 ** 0.5 ] * 2)
+
+
+@pytest.mark.parametrize('rotation', [ 0, 30, 45, 90, 200 ])
+@pytest.mark.parametrize('shape', Grid.SHAPES)
+def test_grid_coordinates_invert_make_grid(rotation, shape):
+    spec = Grid.grid_spec(-33.9, 151.2, 40, 25.0, rotation, shape)
+    lats, lons = Grid.make_grid(-33.9, 151.2, 40, 25.0, rotation, shape)
+    i, j = Grid.grid_coordinates(spec, lats, lons)
+    indices = Grid.grid_indices(40, shape)
+    assert np.allclose(i, indices[0], atol = 1e-6) and np.allclose(j, indices[1], atol = 1e-6)
+    assert (np.rint(i).astype(np.int64) == indices[0]).all()
+
+
+def test_blocks_and_batches_cover_the_grid():
+    spec = Grid.grid_spec(40, -110, 60, rotation = 30, shape = 'circle')
+    lats, lons = Grid.make_grid(40, -110, 60, rotation = 30, shape = 'circle')
+
+    blocks = list(Grid.iter_grid(spec, block_points = 200))
+    assert len(blocks) > 1
+    assert np.array_equal(np.concatenate([ block[0] for block in blocks ]), lats)
+    assert np.array_equal(np.concatenate([ block[1] for block in blocks ]), lons)
+
+    batches = list(ml.iter_grid_batches(spec, 100))
+    assert all(len(batch) == 100 for batch in batches[:-1]) and 0 < len(batches[-1]) <= 100
+    assert np.array_equal(np.concatenate(batches), np.stack([ lats, lons ], axis = 1))
@@ -0,0 +1,89 @@
+import asyncio
+import pytest
+import numpy as np
+from mapsloader import MapsLoader as ml
+from mapsloader import WorldLattice as wl
+
+
+def test_insert_locations_fills_scaffold_cells():
+    # the head window leaves empty root DBits around the origin
+    lattice = wl.WorldLattice(0, 0, 0)
+    lats = (np.array([ 0, 0, 1, 2 ]) + 0.5) / ml.precision_factor
+    lons = (np.array([ 0, 0, 1, 2 ]) + 0.5) / ml.precision_factor
+    alts = np.array([ 0.0, 0.0, 1.0, 2.0 ])
+
+    assert ml.insert_locations(lattice, lats, lons, alts, (0, 0, 0)) == 3
+    assert len(lattice.am.dbit_list) == 3
+    assert lattice.am.retrieve(0, 0, 0).lbit0.other.data['alt'] == 0.0
+
+    # vertices already present are skipped
+    assert ml.insert_locations(lattice, lats, lons, alts, (0, 0, 0)) == 0
+
+
+def test_stream_lattice_raises_fetch_errors():
+    batches = [ [ (0.0, 0.0) ] ] + [ [ (n / ml.precision_factor, 0.0) ] for n in range(1, 20) ]
+
+    def altitudes_for(batch):
+        if batch[0][0] > 5 / ml.precision_factor:
+            raise ConnectionError('elevation service down')
+        return [ 0.0 ] * len(batch)
+
+    for workers in (1, 4):
+        stream = ml.stream_lattice(wl.WorldLattice(0, 0, 0), batches, altitudes_for,
+                                   fetch_workers = workers, queue_size = 1, save_every = 0)
+        with pytest.raises(ConnectionError):
+            asyncio.run(asyncio.wait_for(stream, 10))
+
+
+def test_stream_lattice_raises_producer_errors():
+
+    def batches():
+        yield [ (0.0, 0.0) ]
+        raise ValueError('bad batch')
+
+    stream = ml.stream_lattice(wl.WorldLattice(0, 0, 0), batches(), lambda batch: [ 0.0 ] * len(batch),
+                               save_every = 0)
+    with pytest.raises(ValueError):
+        asyncio.run(asyncio.wait_for(stream, 10))
+
+
+class SlopeProvider:
+
+    def __init__(self):
+        self.batches = []
+
+    def get_altitudes(self, locations):
+        locations = np.asarray(locations)
+        self.batches.append(len(locations))
+        return ((locations[:, 0] - 40) * 1e4 - (locations[:, 1] + 110) * 2e3).tolist()
+
+
+def test_ingest_lattice_matches_whole_grid_insert():
+    spec = ml.Grid.grid_spec(40, -110, 120, 40.0, 30, 'circle')
+    provider = SlopeProvider()
+    lattice = wl.WorldLattice(0, 0, 0)
+    inserted = ml.ingest_lattice(lattice, ml.iter_grid_batches(spec, 1000), provider.get_altitudes)
+    assert len(provider.batches) > 1 and max(provider.batches) == 1000
+
+    lats, lons = ml.Grid.make_grid(40, -110, 120, 40.0, 30, 'circle')
+    alts = np.array(provider.get_altitudes(np.stack([ lats, lons ], axis = 1)))
+    whole = wl.WorldLattice(0, 0, 0)
+    assert ml.insert_locations(whole, lats, lons, alts, ml.lattice_reference(lats[0], lons[0], alts[0])) == inserted
+    assert sorted(map(tuple, lattice.columns()[0].tolist())) == \
+        sorted(map(tuple, whole.columns()[0].tolist()))
+
+
+def test_initialize_lattice_never_builds_the_whole_grid(tmp_path, monkeypatch):
+    monkeypatch.setattr(wl, 'main_directory', str(tmp_path))
+    monkeypatch.setattr(wl.WorldLattice, 'visualize_lattice', lambda self, *args, **kwargs: None)
+    monkeypatch.setattr(ml, 'geocode_address', lambda address, api_key: (40.0, -110.0))
+
+    def make_grid(*args, **kwargs):
+        raise AssertionError('the whole grid was materialized')
+
+    monkeypatch.setattr(ml.Grid, 'make_grid', make_grid)
+    provider = SlopeProvider()
+    lattice = ml.initializeLattice(provider = provider, grid_size = 400, spacing = 20.0)
+    # 80401 diamond points, fetched a block at a time
+    assert provider.batches == [ 1 << 16, 80401 - (1 << 16) ]
+    assert len(lattice.am.dbit_list) > 0
@@ -0,0 +1,34 @@
+from mapsloader import AlgorithmicMemory as am
+from mapsloader import WorldLattice as wl
+from mapsloader import TiledWorld as tw
+
+
+def test_touched_cells_recorded_only_once_checking():
+    memory = am.AlgorithmicMemory()
+    memory.insert_many([ (x, 0, 0) for x in range(100) ], [ 'v' ] * 100)
+    assert memory.touched is None
+
+    # without an earlier check, check_touched checks everything
+    assert memory.check_touched().cells == len(memory.dbits)
+    memory.insert('w', 200, 0, 0)
+    assert (200, 0, 0) in memory.touched
+
+    memory.retrieve(200, 0, 0).lbit1.x = None
+    report = memory.check_touched()
+    assert not report.ok and report.cells < len(memory.dbits)
+
+
+def test_seam_links_between_tiles():
+    lower = wl.WorldLattice(0, 0, 0)
+    upper = wl.WorldLattice(4, 0, 0)
+    lower.insert_batch([ (x, y, 0) for x in range(4) for y in range(4) ], [ 'v' ] * 16)
+    upper.insert_batch([ (x, y, 0) for x in range(4, 8) for y in range(4) ], [ 'v' ] * 16)
+    assert tw.link_seam(lower, upper, 0, 4) == 4
+
+    assert lower.am.check_integrity().ok
+    assert upper.am.check_integrity().ok
+    assert lower.am.check_integrity_parallel(workers = 1).ok
+
+    # a link into the own lattice still has to reach the adjacent cell
+    lower.am.retrieve(0, 0, 0).lbit1.y = lower.am.retrieve(2, 0, 0).lbit0
+    assert not lower.am.check_integrity().ok
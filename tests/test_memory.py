@@ -0,0 +1,148 @@
+import sys
+import random
+import threading
+import pytest
+import numpy as np
+from mapsloader import AlgorithmicMemory as am
+from mapsloader import Instrumentation as instr
+
+
+def time_roots(dbits):
+
+    return [ tr for dbit in dbits for tr in (dbit.lbit0.tr.tr, dbit.lbit1.tr.tr) ]
+
+
+def test_restored_ids_are_not_handed_out_again():
+    memory = am.AlgorithmicMemory()
+    # ids inside a block this thread already holds
+    ids = am.TimeRoot.ids
+    ids.next = am.TimeRoot.reserve(ids)
+    restored = ids.next + 200
+    memory.insert_many([ (1, 0, 0) ], [ 'restored' ], [ (restored, restored + 1) ])
+
+    memory.insert_many([ (x, 0, 0) for x in range(2, 402) ], [ 'new' ] * 400)
+    ids = time_roots(memory.dbit_list)
+    assert len(ids) == len(set(ids))
+
+
+def test_restored_ids_drop_other_threads_blocks():
+    memory = am.AlgorithmicMemory().concurrent()
+    cursor = memory.new_cursor()
+    started = threading.Event()
+    restored = threading.Event()
+
+    def insert():
+        cursor.insert('before', 100, 0, 0)
+        started.set()
+        restored.wait()
+        cursor.insert_many([ (x, 1, 0) for x in range(100, 400) ], [ 'after' ] * 300)
+
+    thread = threading.Thread(target = insert)
+    thread.start()
+    started.wait()
+    first = memory.retrieve(100, 0, 0).lbit0.other.tr.tr
+    memory.insert_many([ (0, 5, 0) ], [ 'restored' ], [ (first + 100, first + 101) ])
+    restored.set()
+    thread.join()
+
+    ids = time_roots(memory.dbit_list)
+    assert len(ids) == len(set(ids))
+
+
+def stacked_data(memory, x, y, z):
+
+    root = memory.retrieve(x, y, z)
+    lbit = root.lbit0
+    stack = []
+    while lbit is not lbit.other.other:
+        lbit = lbit.other
+        stack.append(lbit.data)
+    return stack
+
+
+def scaffold_cells(memory):
+
+    return [ coords for coords, dbit in memory.dbits.items() if dbit.lbit0.other is dbit.lbit1 ]
+
+
+@pytest.mark.parametrize('batched', [ False, True ])
+def test_reclaim_frees_scaffolding(batched):
+    rng = random.Random(0)
+    points = sorted({ (rng.randrange(200), rng.randrange(200), rng.randrange(10)) for _ in range(500) })
+    memories = []
+    for reclaim in (False, True):
+        memory = am.AlgorithmicMemory(reclaim = reclaim)
+        if batched:
+            memory.insert_many(points, [ 'p%d' % n for n in range(len(points)) ])
+        else:
+            for n, (x, y, z) in enumerate(points):
+                memory.insert('p%d' % n, x, y, z)
+        memories.append(memory)
+    kept, reclaimed = memories
+
+    # only the head window is left as scaffolding
+    assert len(scaffold_cells(kept)) > 100
+    assert all(reclaimed.in_head(*coords) for coords in scaffold_cells(reclaimed))
+    assert len(reclaimed.dbits) <= len(reclaimed.dbit_list) + 27
+
+    for n, (x, y, z) in enumerate(points):
+        assert stacked_data(reclaimed, x, y, z)[-1] == 'p%d' % n
+    assert reclaimed.check_integrity().ok and kept.check_integrity().ok
+
+
+def adjacent_pairs(cells):
+
+    return sum((x + 1, y, z) in cells for x, y, z in cells) + \
+        sum((x, y + 1, z) in cells for x, y, z in cells) + \
+        sum((x, y, z + 1) in cells for x, y, z in cells)
+
+
+def test_concurrent_cursors_keep_links():
+    # switch threads often, so cursors race for shared chunk borders
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    threads = 4
+    i, j = np.meshgrid(np.arange(96), np.arange(64), indexing = 'ij')
+    coords = np.stack([ i.ravel(), j.ravel(), ((i * 3 + j * 5) % 11).ravel() ], axis = 1)
+    # neighboring 16-wide chunk columns go to different threads
+    owner = ((coords[:, 0] >> 4) + (coords[:, 1] >> 4)) % threads
+
+    memory = am.AlgorithmicMemory().concurrent()
+    initial = set(memory.dbits.keys())
+    errors = []
+
+    def ingest(worker):
+        try:
+            cursor = memory.new_cursor()
+            rows = np.flatnonzero(owner == worker)
+            for start in range(0, len(rows), 100):
+                part = rows[start:start + 100]
+                cursor.insert_many(coords[part], [ (x, y, z) for x, y, z in coords[part].tolist() ])
+        except Exception as error:
+            errors.append(error)
+
+    instr.stats.reset()
+    instr.stats.enable()
+    try:
+        workers = [ threading.Thread(target = ingest, args = (worker,)) for worker in range(threads) ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    finally:
+        instr.stats.disable()
+        sys.setswitchinterval(interval)
+
+    assert not errors
+    assert memory.check_integrity().ok
+    assert len(memory.dbit_list) == len(coords)
+    assert all(dbit.slot == n for n, dbit in enumerate(memory.dbit_list))
+    assert sorted(dbit.lbit0.data for dbit in memory.dbit_list) == sorted(map(tuple, coords.tolist()))
+    ids = time_roots(memory.dbit_list)
+    assert len(ids) == len(set(ids))
+
+    # no counter update is lost between threads
+    cells = set(memory.dbits.keys())
+    assert instr.stats.inserts == len(coords)
+    assert instr.stats.dbits_allocated == len(coords) + len(cells - initial)
+    assert instr.stats.links == 4 * len(coords) + adjacent_pairs(cells) - adjacent_pairs(initial)
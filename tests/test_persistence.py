@@ -0,0 +1,122 @@
+from mapsloader import WorldLattice as wl
+from mapsloader import LatticeFile as lf
+
+
+def stack_at(lattice, x, y, z):
+    """
+    Payloads stacked at local (x, y, z), bottom first.
+    """
+    root = lattice.am.retrieve(x, y, z)
+    if root is None:
+        return []
+    stack = []
+    lbit = root.lbit0
+    while lbit is not lbit.other.other:
+        lbit = lbit.other
+        stack.append(lbit.data)
+    return stack
+
+
+def persisted(path, cells):
+
+    lattice = wl.WorldLattice(0, 0, 0)
+    for (x, y, z), stack in cells.items():
+        for data in stack:
+            lattice.insert(data, x, y, z)
+    lattice.save(path)
+    return lattice
+
+
+def test_insert_into_opened_lattice(tmp_path):
+    path = str(tmp_path / 'base.lattice')
+    persisted(path, { (5, 5, 5): [ 'old' ], (40, 5, 5): [ 'far' ] })
+
+    lattice = wl.WorldLattice.open(0, 0, 0, path)
+    lattice.insert('new', 5, 5, 5)
+    lattice.insert_batch([ (40, 5, 5) ], [ 'near' ])
+    assert stack_at(lattice, 5, 5, 5) == [ 'old', 'new' ]
+
+    lattice.save(path)
+    loaded = wl.WorldLattice.load(0, 0, 0, path)
+    assert stack_at(loaded, 5, 5, 5) == [ 'old', 'new' ]
+    assert stack_at(loaded, 40, 5, 5) == [ 'far', 'near' ]
+
+
+def test_pickled_payload_unpickled_once(tmp_path, monkeypatch):
+    path = str(tmp_path / 'pickled.lattice')
+    # plain strings are stored as one pickled blob
+    persisted(path, { (x, 0, 0): [ 'v%d' % x ] for x in range(0, 160, 16) })
+
+    calls = []
+    loads = lf.pickle.loads
+    monkeypatch.setattr(lf.pickle, 'loads', lambda data: calls.append(1) or loads(data))
+    lattice = wl.WorldLattice.open(0, 0, 0, path)
+    for x in range(0, 160, 16):
+        lattice.retrieve(x, 0, 0)
+        assert stack_at(lattice, x, 0, 0) == [ 'v%d' % x ]
+    assert len(calls) == 1
+
+
+def test_journal_insert_into_unfaulted_cell(tmp_path):
+    path = str(tmp_path / 'journal.lattice')
+    persisted(path, { (5, 5, 5): [ 'old' ] })
+
+    lattice = wl.WorldLattice.open(0, 0, 0, path)
+    lattice.insert('new', 5, 5, 5)
+    lattice.save_incremental(path, compact_ratio = 1e9)
+    assert lf.read_journal(wl.journal_path(path))
+    lattice.retrieve(5, 5, 5)
+    assert stack_at(lattice, 5, 5, 5) == [ 'old', 'new' ]
+
+    assert stack_at(wl.WorldLattice.load(0, 0, 0, path), 5, 5, 5) == [ 'old', 'new' ]
+    reopened = wl.WorldLattice.open(0, 0, 0, path)
+    reopened.retrieve(5, 5, 5)
+    assert stack_at(reopened, 5, 5, 5) == [ 'old', 'new' ]
+
+
+def test_stack_order_survives_removals(tmp_path):
+    path = str(tmp_path / 'pruned.lattice')
+    lattice = persisted(path, { (5, 5, 5): [ 'a1', 'a2', 'a3', 'a4' ], (9, 5, 5): [ 'b1', 'b2' ] })
+    memory = lattice.am
+    # removals move the last entry of dbit_list into the freed slot
+    memory.unstack(memory.retrieve(5, 5, 5).lbit0.other.dbit)
+    memory.prune(5, 5, 5)
+    lattice.insert('a5', 5, 5, 5)
+    assert [ dbit.lbit0.data for dbit in memory.dbit_list ] == [ 'b2', 'a2', 'a3', 'b1', 'a5' ]
+
+    lattice.save(path)
+    loaded = wl.WorldLattice.load(0, 0, 0, path)
+    assert stack_at(loaded, 5, 5, 5) == [ 'a2', 'a3', 'a5' ]
+    assert stack_at(loaded, 9, 5, 5) == [ 'b1', 'b2' ]
+    opened = wl.WorldLattice.open(0, 0, 0, path)
+    opened.retrieve(5, 5, 5)
+    assert stack_at(opened, 5, 5, 5) == [ 'a2', 'a3', 'a5' ]
+
+
+def test_prune_region(tmp_path):
+    path = str(tmp_path / 'region.lattice')
+    lattice = persisted(path, { (x, y, 0): [ 'old' ] for x in range(0, 12, 2) for y in range(0, 12, 2) })
+    memory = lattice.am
+    lattice.insert('new outside', 20, 5, 0)
+    lattice.insert('new inside', 5, 5, 0)
+    memory.move_head_abs(4, 4, -1)
+    assert memory.in_head(5, 5, 0)
+    persisted_ids = { dbit.lbit0.tr.tr: (dbit.x, dbit.y, dbit.z) for dbit in memory.dbit_list
+                      if 3 <= dbit.x <= 8 and 3 <= dbit.y <= 8 and dbit.lbit0.data == 'old' }
+
+    # 3 x 3 old vertices and the new one inside
+    assert lattice.prune_region((3, 3, -2), (8, 8, 2)) == 10
+    assert all(memory.retrieve(x, y, z) is None
+               for x in range(3, 9) for y in range(3, 9) for z in range(-2, 3))
+    assert not memory.in_head(5, 5, 0)
+    assert memory.deleted == persisted_ids
+    assert [ dbit.lbit0.data for dbit in memory.dirty.values() ] == [ 'new outside' ]
+    assert memory.check_integrity().ok
+
+    lattice.save_incremental(path, compact_ratio = 1e9)
+    assert lf.read_journal(wl.journal_path(path)) and not memory.deleted and not memory.dirty
+    loaded = wl.WorldLattice.load(0, 0, 0, path)
+    assert len(loaded.am.dbit_list) == 36 - 9 + 1
+    assert stack_at(loaded, 5, 5, 0) == [] and stack_at(loaded, 4, 4, 0) == []
+    assert stack_at(loaded, 2, 2, 0) == [ 'old' ] and stack_at(loaded, 20, 5, 0) == [ 'new outside' ]
+    assert loaded.am.check_integrity().ok
@@ -0,0 +1,87 @@
+import numpy as np
+from mapsloader import LatticePyramid as lp
+from mapsloader import WorldLattice as wl
+
+
+def brute_force(x, y, alt, level):
+    """
+    {(x, y) of the cell corner: (min, max, mean, count)} at one level.
+    """
+    cells = {}
+    for vx, vy, value in zip(x.tolist(), y.tolist(), alt.tolist()):
+        cells.setdefault(((vx >> level) << level, (vy >> level) << level), []).append(value)
+    return { key: (min(values), max(values), sum(values) / len(values), len(values))
+             for key, values in cells.items() }
+
+
+def as_dict(cells):
+
+    return { (x, y): (low, high, mean, count)
+             for x, y, low, high, mean, count in zip(cells['x'].tolist(), cells['y'].tolist(),
+                                                     cells['min'].tolist(), cells['max'].tolist(),
+                                                     cells['mean'].tolist(), cells['count'].tolist()) }
+
+
+def assert_levels_match(pyramid, x, y, alt):
+
+    for level in range(1, pyramid.depth + 1):
+        got = as_dict(pyramid.cells(level))
+        expected = brute_force(x, y, alt, level)
+        assert got.keys() == expected.keys()
+        for key, (low, high, mean, count) in expected.items():
+            assert got[key][0] == low and got[key][1] == high and got[key][3] == count
+            assert np.isclose(got[key][2], mean)
+
+
+def random_columns(n, seed = 0):
+
+    rng = np.random.default_rng(seed)
+    return rng.integers(-300, 300, n), rng.integers(-200, 400, n), rng.normal(1500, 300, n)
+
+
+def test_levels_match_brute_force():
+    x, y, alt = random_columns(3000)
+    pyramid = lp.LatticePyramid(levels = 6).build(x, y, alt)
+    assert_levels_match(pyramid, x, y, alt)
+
+    box = (-40, 10, 25, 90)
+    cells = pyramid.cells(3, box)
+    expected = { key: value for key, value in brute_force(x, y, alt, 3).items()
+                 if key[0] + 8 > box[0] and key[0] <= box[2] and key[1] + 8 > box[1] and key[1] <= box[3] }
+    assert as_dict(cells).keys() == expected.keys()
+
+
+def test_add_and_flush_equal_a_rebuild():
+    x, y, alt = random_columns(3000, seed = 1)
+    pyramid = lp.LatticePyramid(levels = 6).build(x[:1000], y[:1000], alt[:1000])
+    for start in range(1000, 3000, 700):
+        pyramid.add(x[start:start + 700], y[start:start + 700], alt[start:start + 700])
+    pyramid.add(5, 7, 99.0)
+    x, y, alt = np.append(x, 5), np.append(y, 7), np.append(alt, 99.0)
+
+    rebuilt = lp.LatticePyramid(levels = 6).build(x, y, alt)
+    added = pyramid.flush().arrays()
+    assert added.keys() == rebuilt.arrays().keys()
+    for name, values in rebuilt.arrays().items():
+        assert np.allclose(added[name], values), name
+    assert_levels_match(pyramid, x, y, alt)
+
+
+def test_lattice_rebuilds_pyramid_after_removals():
+    lattice = wl.WorldLattice(0, 0, 0)
+    coords = [ (x, y, (x * y) % 7) for x in range(40) for y in range(40) ]
+    lattice.insert_batch(coords, [ { 'alt': float(x + y) } for x, y, _ in coords ])
+    pyramid = lattice.lod()
+
+    # inserts are folded into the same pyramid
+    lattice.insert_batch([ (50, 50, 0) ], [ { 'alt': 500.0 } ])
+    assert lattice.lod() is pyramid and pyramid.removed == lattice.am.removed
+
+    removed = lattice.prune_region((0, 0, -10), (19, 39, 10))
+    assert removed and lattice.am.removed != pyramid.removed
+    rebuilt = lattice.lod()
+    assert rebuilt is not pyramid and rebuilt.removed == lattice.am.removed
+
+    coords, _, _, alt = lattice.columns()
+    assert coords[:, 0].min() == 20
+    assert_levels_match(rebuilt, coords[:, 0], coords[:, 1], alt)
@@ -0,0 +1,77 @@
+import pytest
+import numpy as np
+from mapsloader import LatticeQuery as lq
+from mapsloader import WorldLattice as wl
+
+
+def random_index(n, seed = 0):
+
+    rng = np.random.default_rng(seed)
+    lats = rng.uniform(40, 40.1, n)
+    lons = rng.uniform(-110, -109.9, n)
+    return lq.GridIndex(lats, lons, np.zeros(n), np.zeros((n, 3))), rng
+
+
+@pytest.mark.parametrize('block', [ lq.CANDIDATE_BLOCK, 64 ])
+def test_nearest_matches_brute_force(monkeypatch, block):
+    monkeypatch.setattr(lq, 'CANDIDATE_BLOCK', block)
+    index, rng = random_index(2000)
+    # points inside the index and far outside it, whose rings span it all
+    lats = np.concatenate([ rng.uniform(40, 40.1, 200), rng.uniform(30, 50, 100) ])
+    lons = np.concatenate([ rng.uniform(-110, -109.9, 200), rng.uniform(-120, -100, 100) ])
+
+    rows, distances = index.nearest(lats, lons, 4)
+    x, y = index.project(lats, lons)
+    every = np.hypot(index.x[None, :] - x[:, None], index.y[None, :] - y[:, None])
+    assert np.allclose(distances, np.sort(every, axis = 1)[:, :4])
+    assert np.allclose(np.take_along_axis(every, rows, axis = 1), distances)
+
+
+def test_nearest_with_fewer_vertices_than_k():
+    index, _ = random_index(2)
+    rows, distances = index.nearest([ 40.05 ], [ -109.95 ], 4)
+    assert rows[0, 2:].tolist() == [ -1, -1 ]
+    assert np.isinf(distances[0, 2:]).all()
+
+    lattice = wl.WorldLattice(0, 0, 0)
+    lattice.insert_batch([ (3, 4, 5), (6, 7, 8) ], [ { 'lat': 40.0, 'lon': -110.0, 'alt': 5.0 },
+                                                     { 'lat': 40.1, 'lon': -110.0, 'alt': 8.0 } ])
+    near = lattice.nearest([ 40.0, 41.0 ], [ -110.0, -110.0 ], 4)
+    assert near['coords'][0, :2].tolist() == [ [ 3, 4, 5 ], [ 6, 7, 8 ] ]
+    assert (near['coords'][:, 2:] == wl.MISSING_COORD).all()
+    assert np.isnan(near['lat'][:, 2:]).all() and np.isnan(near['alt'][:, 2:]).all()
+
+    # nothing within range is missing too, as is everything in an empty lattice
+    near = lattice.nearest([ 40.0, 41.0 ], [ -110.0, -110.0 ], 1, max_distance = 1000)
+    assert near['coords'][:, 0].tolist() == [ [ 3, 4, 5 ], [ wl.MISSING_COORD ] * 3 ]
+    assert np.isnan(near['lat'][1]).all() and np.isinf(near['distance'][1]).all()
+    near = wl.WorldLattice(0, 0, 0).nearest([ 40.0 ], [ -110.0 ], 2)
+    assert (near['coords'] == wl.MISSING_COORD).all() and np.isinf(near['distance']).all()
+
+
+@pytest.mark.parametrize('bad', [ np.nan, np.inf ])
+def test_non_finite_queries_rejected(bad):
+    index, _ = random_index(100)
+    with pytest.raises(ValueError):
+        index.nearest([ bad ], [ -109.95 ])
+    with pytest.raises(ValueError):
+        index.box([ 40.0 ], [ bad ], [ 40.1 ], [ -109.9 ])
+
+
+def test_nearest_within_max_distance(monkeypatch):
+    index, rng = random_index(2000)
+    lats = np.concatenate([ rng.uniform(40, 40.1, 200), rng.uniform(30, 50, 100) ])
+    lons = np.concatenate([ rng.uniform(-110, -109.9, 200), rng.uniform(-120, -100, 100) ])
+    rows, distances = index.nearest(lats, lons, 3)
+
+    searched = []
+    ring_search = index.ring_search
+    monkeypatch.setattr(index, 'ring_search',
+                        lambda *args: searched.append(len(args[0])) or ring_search(*args))
+    bounded_rows, bounded = index.nearest(lats, lons, 3, max_distance = 500)
+    near = distances[:, 0] <= 500
+    assert near[:200].any() and not near[200:].any()
+    assert (bounded_rows[near] == rows[near]).all()
+    assert (bounded_rows[~near] == -1).all() and np.isinf(bounded[~near]).all()
+    # far points stop once the ring is wider than max_distance
+    assert len(searched) <= int(np.log2(500 / index.cell)) + 3
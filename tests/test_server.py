@@ -0,0 +1,98 @@
+import io
+import json
+import pytest
+import numpy as np
+from mapsloader import WorldLattice as wl
+from mapsloader import LatticeServer as ls
+
+
+@pytest.fixture
+def app(tmp_path):
+    path = str(tmp_path / 'served.lattice')
+    lattice = wl.WorldLattice(0, 0, 0)
+    lattice.insert_batch([ (x, y, x + y) for x in range(20) for y in range(20) ],
+                         [ { 'lat': 40 + x * 1e-3, 'lon': -110 + y * 1e-3, 'alt': float(x + y) }
+                           for x in range(20) for y in range(20) ])
+    lattice.save(path)
+    return ls.wsgi_app(ls.LatticeService(ls.open_lattice(path)))
+
+
+def request(app, method, path, query = '', body = b'', content_type = '', length = None):
+
+    environ = { 'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': query,
+                'CONTENT_TYPE': content_type, 'wsgi.input': io.BytesIO(body),
+                'CONTENT_LENGTH': str(len(body) if length is None else length) }
+    replies = []
+    payload = b''.join(app(environ, lambda status, headers: replies.append(status)))
+    return int(replies[0].split()[0]), payload
+
+
+def test_elevation(app):
+    status, body = request(app, 'GET', '/elevation', 'lat=40.005&lon=-109.995')
+    assert status == 200
+    assert json.loads(body)['alt'][0] == pytest.approx(10, abs = 1)
+
+
+@pytest.mark.parametrize('query', [ 'lat=nan&lon=-110', 'lat=40&lon=inf',
+                                    'lat0=40&lon0=-110&lat1=NaN&lon1=-109' ])
+def test_non_finite_parameters_rejected(app, query):
+    path = '/box' if 'lat0' in query else '/elevation'
+    assert request(app, 'GET', path, query)[0] == 400
+
+
+def test_batch_limits(app):
+    body = json.dumps({ 'lats': [ 40.0, float('nan') ], 'lons': [ -110.0, -110.0 ] }).encode()
+    assert request(app, 'POST', '/elevation', body = body, content_type = 'application/json')[0] == 400
+
+    points = np.zeros((ls.MAX_BATCH + 1, 2))
+    assert request(app, 'POST', '/elevation', body = points.tobytes())[0] == 400
+    # too large a body is refused without being read
+    assert request(app, 'POST', '/elevation', length = ls.MAX_BODY + 1)[0] == 413
+
+
+@pytest.mark.parametrize('extra', [ { 'lat': 40.05, 'lon': -109.95, 'alt': 7.0 }, 'unlocated' ])
+def test_read_view_leaves_lattice_mapped(tmp_path, extra):
+    path = str(tmp_path / 'mapped.lattice')
+    lattice = wl.WorldLattice(0, 0, 0)
+    lattice.insert_batch([ (x, y, 0) for x in range(40) for y in range(40) ],
+                         [ { 'lat': 40 + x * 1e-3, 'lon': -110 + y * 1e-3, 'alt': float(x) }
+                           for x in range(40) for y in range(40) ])
+    lattice.save(path)
+    # a journaled change brings one chunk into memory on open
+    lattice.insert(extra, 3, 3, 0)
+    lattice.save_incremental(path, compact_ratio = 1e9)
+
+    service = ls.LatticeService(ls.open_lattice(path)).warm()
+    assert service.lattice.backing is not None
+    assert len(service.lattice.am.dbit_list) < 40 * 40
+
+    expected = wl.WorldLattice.load(0, 0, 0, path)
+    view = service.view()
+    assert view.query_index().count == expected.query_index().count
+    found = view.query_box(40.0, -110.0, 40.01, -109.99)
+    want = expected.query_box(40.0, -110.0, 40.01, -109.99)
+    assert sorted(map(tuple, found['coords'].tolist())) == sorted(map(tuple, want['coords'].tolist()))
+    assert np.allclose(view.altitude_at([ 40.0205 ], [ -109.9795 ]), expected.altitude_at([ 40.0205 ], [ -109.9795 ]))
+
+
+def test_level_zero_tiles_read_only_their_chunks(tmp_path, monkeypatch):
+    path = str(tmp_path / 'tiles.lattice')
+    lattice = wl.WorldLattice(0, 0, 0)
+    lattice.insert_batch([ (x, y, (x * y) % 7) for x in range(100) for y in range(100) ],
+                         [ { 'lat': 40 + x * 1e-3, 'lon': -110 + y * 1e-3, 'alt': float(x - y) }
+                           for x in range(100) for y in range(100) ])
+    lattice.save(path)
+    expected = wl.WorldLattice.load(0, 0, 0, path).overview(None, (20, 30, 40, 35))
+
+    opened = ls.open_lattice(path)
+    opened.insert({ 'lat': 40.0, 'lon': -110.0, 'alt': 99.0 }, 30, 33, 50)
+    rows = []
+    column_rows = opened.backing.column_rows
+    monkeypatch.setattr(opened.backing, 'column_rows', lambda *box: rows.append(column_rows(*box)) or rows[-1])
+    cells = opened.overview(None, (20, 30, 40, 35))
+
+    assert opened.backing is not None
+    assert len(rows[0]) < 100 * 100 // 4
+    got = sorted(zip(cells['x'].tolist(), cells['y'].tolist(), cells['min'].tolist()))
+    want = sorted(zip(expected['x'].tolist(), expected['y'].tolist(), expected['min'].tolist()))
+    assert got == sorted(want + [ (30, 33, 99.0) ])
@@ -0,0 +1,82 @@
+import threading
+import numpy as np
+from mapsloader import WorldLattice as wl
+
+
+def grid_lattice(side = 64):
+
+    lattice = wl.WorldLattice(0, 0, 0)
+    lattice.insert_batch([ (x, y, 0) for x in range(side) for y in range(side) ],
+                         [ { 'lat': 40 + x * 1e-3, 'lon': -110 + y * 1e-3, 'alt': 0.0 }
+                           for x in range(side) for y in range(side) ])
+    return lattice
+
+
+def layers_of(snapshot):
+
+    depth = 0
+    layer = snapshot.views
+    while isinstance(layer, wl.ViewLayer):
+        depth += 1
+        layer = layer.parent
+    return depth
+
+
+def test_reader_keeps_its_snapshot_while_writer_publishes():
+    lattice = grid_lattice()
+    first = lattice.snapshot()
+    expected = sorted(map(tuple, first.vertices()[0].tolist()))
+    published = threading.Event()
+    seen = []
+
+    def read():
+        while not published.is_set():
+            seen.append(sorted(map(tuple, first.vertices()[0].tolist())) == expected
+                        and first.get(5, 5, 1) == ())
+
+    reader = threading.Thread(target = read)
+    reader.start()
+    for n in range(20):
+        lattice.insert_batch([ (n, y, 1) for y in range(64) ], [ { 'alt': 1.0 } ] * 64)
+        lattice.snapshot()
+    published.set()
+    reader.join()
+
+    assert seen and all(seen)
+    last = lattice.published
+    assert last.version == 21 and first.version == 1
+    assert first.count == 64 * 64 and last.count == 64 * 64 + 20 * 64
+    assert last.get(5, 5, 1) == ({ 'alt': 1.0 },) and first.get(5, 5, 1) == ()
+    # chunks no insert reached are shared, not copied
+    assert last.views.get((3, 3, 0)) is first.views.get((3, 3, 0))
+    assert layers_of(last) <= 6
+
+
+def test_snapshot_of_opened_lattice_reads_the_mapped_file(tmp_path):
+    path = str(tmp_path / 'mapped.lattice')
+    grid_lattice().save(path)
+    lattice = wl.WorldLattice.open(0, 0, 0, path)
+    lattice.retrieve(1, 1, 0)
+
+    first = lattice.snapshot()
+    assert lattice.backing is not None and len(lattice.backing.loaded) == 1
+    assert len(lattice.am.dbit_list) == 16 * 16
+    assert first.count == 64 * 64 and len(first.views) == 16
+    assert first.get(40, 50, 0) == ({ 'lat': 40.04, 'lon': -109.95, 'alt': 0.0 },)
+    coords, payload = first.vertices((30, 30, 0), (33, 31, 0))
+    assert sorted(map(tuple, coords.tolist())) == [ (x, y, 0) for x in range(30, 34) for y in range(30, 32) ]
+
+    lattice.insert('new', 40, 50, 0)
+    second = lattice.snapshot()
+    assert second.get(40, 50, 0) == ({ 'lat': 40.04, 'lon': -109.95, 'alt': 0.0 }, 'new')
+    assert first.get(40, 50, 0) == ({ 'lat': 40.04, 'lon': -109.95, 'alt': 0.0 },)
+    assert second.count == first.count + 1
+    assert len(lattice.am.dbit_list) == 2 * 16 * 16 + 1
+
+    loaded = wl.WorldLattice.load(0, 0, 0, path)
+    loaded.insert('new', 40, 50, 0)
+    expected = loaded.snapshot().vertices()
+    got = second.vertices()
+    assert sorted(zip(map(tuple, got[0].tolist()), map(repr, got[1]))) == \
+        sorted(zip(map(tuple, expected[0].tolist()), map(repr, expected[1])))
+    assert np.allclose(second.altitude_at([ 40.02 ], [ -109.99 ]), [ 0.0 ])
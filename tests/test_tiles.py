@@ -0,0 +1,52 @@
+import numpy as np
+from mapsloader import MapsLoader as ml
+from mapsloader import TiledWorld as tw
+from mapsloader import WorldLattice as wl
+
+
+class Basin:
+    """
+    Below sea level everywhere, with fractional altitudes.
+    """
+
+    def elevations(self, lats, lons):
+        lats = np.asarray(lats, dtype = np.float64)
+        lons = np.asarray(lons, dtype = np.float64)
+        return -400.25 + 3731.7 * (lats + 31.5) - 1170.3 * (lons + 70.2)
+
+
+def test_quantize_floors_and_round_trips():
+    assert wl.quantize([ -0.5, -1.0, -1e-9, 0.0, 0.99 ]).tolist() == [ -1, -1, 0, 0, 0 ]
+    assert ml.lattice_reference(-31.5205, -70.2, -400.5) == (-31521, -70200, -401)
+    # x / factor lands back on x despite float error (0.029 * 1000 != 29)
+    xs = np.arange(-200000, 200000)
+    assert (wl.quantize(xs / 1000, 1000) == xs).all()
+
+
+def test_tiles_agree_with_untiled_lattice(tmp_path, monkeypatch):
+    monkeypatch.setattr(wl, 'main_directory', str(tmp_path))
+    world = tw.TiledWorld(tile_size = 16, precision_factor = ml.precision_factor)
+    world.build(-31.52, -70.22, -31.48, -70.18, Basin(), workers = 1)
+
+    # the same lattice nodes, ingested untiled against the global origin
+    gx, gy = np.meshgrid(np.arange(-31520, -31479), np.arange(-70220, -70179), indexing = 'ij')
+    lats, lons = gx.ravel() / ml.precision_factor, gy.ravel() / ml.precision_factor
+    alts = Basin().elevations(lats, lons)
+    assert (alts < 0).all() and (alts % 1 != 0).any()
+    untiled = wl.WorldLattice(0, 0, 0)
+    assert ml.insert_locations(untiled, lats, lons, alts, (0, 0, 0)) == len(lats)
+    expected = sorted(map(tuple, untiled.columns()[0].tolist()))
+
+    keys = tw.tiles_for_box(*world.box_for_latlon(-31.52, -70.22, -31.48, -70.18), 16)
+    assert world.load(keys) and len(world.tiles) == 9
+    tiled = []
+    for key, tile in world.tiles.items():
+        for x, y, z in tile.columns()[0].tolist():
+            coords = (x + tile.x, y + tile.y, z + tile.z)
+            assert tw.tile_key(coords[0], coords[1], 16) == key
+            tiled.append(coords)
+    assert sorted(tiled) == expected
+
+    for x, y, z in expected[::50]:
+        assert not ml.is_vacant(world.retrieve(x, y, z))
+        assert ml.is_vacant(world.retrieve(x, y, z + 1))